@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import os, time
-from typing import Any, Dict, List, Tuple, Optional
+import os, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple, Optional
 
-from .ollama_client import schema_smoke_test, grammar_smoke_test
+from . import llm_cache
+from .disk_cache import cache_enabled
+from .llm_capabilities import capabilities, with_age
 from .llm_router import chat_llm
 from .gbnf import COMPACT_AUDIT_GBNF
 from .utils_json import coerce_json
@@ -11,16 +14,26 @@ from .timeline_extractor import extract_timeline
 from .validator_stac_det import validate_stac_det
 from .info_extractor_gen import extract_general
 from .validator_gen_det import validate_gen_det
+from .doc_index import DocumentIndex
+from .vitals_extractor import extract_vitals, vitals_summary, fact_sheet
 from .json_schema import (
     RULE_ID_ENUM, ORDER_ENUM, WHERE_ENUM,
     RULE_TITLES, RULE_SEVERITY,
     COMPACT_AUDIT_SCHEMA,
 )
-from .focus_text import focus_text
+from .focus_text import focus_text, AVG_CHARS_PER_TOKEN
+from .prompt_layout import prefix_first
 from .rag import get_global_context, get_rule_hints
 
 STAC_MODEL = os.getenv("STAC_MODEL", "gpt-oss:latest")
 
+# on_event(kind, payload): промежуточные результаты аудита (см. audit_stac)
+EventCallback = Callable[[str, Dict[str, Any]], None]
+
+
+class AuditCancelled(Exception):
+    """Бросается из on_event, чтобы прервать аудит (например, клиент SSE отключился)."""
+
 # ---------- утилиты ----------
 def _ensure_status(data: dict) -> dict:
     for it in data.get("passes", []) or []:
@@ -46,6 +59,44 @@ def _append_pass(data: dict, rule_id: str, title: str, severity: str, order: str
 def _chunks(lst: List[str], n: int) -> List[List[str]]:
     return [lst[i:i+n] for i in range(0, len(lst), n)]
 
+def _llm_parallel(n_chunks: int) -> int:
+    """
+    Сколько чанков отправлять в LLM одновременно: LLM_PARALLEL, иначе OLLAMA_NUM_PARALLEL
+    (число слотов сервера Ollama), иначе 1 — последовательно. Не больше числа чанков.
+    """
+    try:
+        n = int(os.getenv("LLM_PARALLEL") or os.getenv("OLLAMA_NUM_PARALLEL") or "1")
+    except ValueError:
+        n = 1
+    return max(1, min(n, n_chunks))
+
+def _det_decided(data: dict, min_conf: float) -> List[str]:
+    """rule_id из RULE_ID_ENUM, по которым детерминированный вердикт уверен не ниже min_conf."""
+    conf: Dict[str, float] = {}
+    for it in (data.get("passes", []) or []) + (data.get("violations", []) or []):
+        rid = it.get("rule_id", "")
+        conf[rid] = max(conf.get(rid, 0.0), float(it.get("confidence", 0.0) or 0.0))
+    return [rid for rid in RULE_ID_ENUM if conf.get(rid, 0.0) >= min_conf]
+
+def _system_ctx() -> str:
+    # RAG-контекст: глобальные подсказки (одинаковы для всех чанков — часть общего префикса промпта)
+    return (
+        "Ты строгий аудитор медицинских документов РК. Возвращай только валидный JSON по заданной схеме, без какого-либо текста вне JSON.\n"
+        f"[Глобальный контекст]\n{get_global_context()}"
+    )
+
+
+def _chunk_prompt(rules_this_chunk: List[str], limit_items: int, ev_max: int) -> Tuple[str, str]:
+    """
+    (system, question) чанка. Подсказки по правилам чанка в раскладке prefix идут в задание
+    (после документа), чтобы system + документ были общим префиксом всех чанков; в legacy — в system.
+    """
+    hints = f"[Подсказки по правилам]\n{get_rule_hints(rules_this_chunk)}"
+    q = _compact_question(rules_this_chunk, limit_items, ev_max)
+    if prefix_first():
+        return _system_ctx(), f"{hints}\n\n{q}"
+    return f"{_system_ctx()}\n{hints}", q
+
 def _compact_question(rules_this_chunk: List[str], limit_items: int, ev_max: int) -> str:
     ids = ", ".join(rules_this_chunk)
     where_opts = ", ".join(WHERE_ENUM)
@@ -106,25 +157,55 @@ def _chunk_schema(rules_this_chunk: List[str], ev_max: int, limit_items: int) ->
     }
 
 # ---------- основной аудит ----------
-def audit_stac(text: str, llm_text: str | None = None, model: Optional[str] = None) -> dict:
+def _emit(on_event: Optional[EventCallback], kind: str, payload: Dict[str, Any]) -> None:
+    if on_event is None:
+        return
+    try:
+        on_event(kind, payload)
+    except AuditCancelled:
+        raise
+    except Exception as e:
+        # сбой получателя не должен ронять аудит
+        print(f"[audit_engine_stac] on_event {kind}: {e}", file=sys.stderr)
+
+
+def audit_stac(text: str, llm_text: str | None = None, model: Optional[str] = None,
+               page_offsets: Optional[List[int]] = None,
+               on_event: Optional[EventCallback] = None) -> dict:
     """
     Единый аудит стационара: детерминированные проверки + LLM (чанки, компактный JSON).
+    page_offsets — смещения начала страниц в text (для привязки разделов к страницам).
+    on_event(kind, payload) — промежуточные результаты по мере готовности (вызывается из потока
+    аудита; пункты в payload — копии): deterministic (passes/violations), llm_start (план чанков),
+    llm_chunk (вердикты чанка после слияния: assessed, violations). AuditCancelled из on_event
+    прерывает аудит: ещё не начатые чанки LLM отменяются.
     """
     result: Dict[str, Any] = {"passes": [], "violations": [], "doc_profile_hint": ["STAC", "GEN"]}
 
-    # 1) Детерминированные проверки (быстрые, без ЛЛМ)
-    tl = extract_timeline(text)
-    det1 = validate_stac_det(tl, full_text=text)
+    # 1) Детерминированные проверки (быстрые, без ЛЛМ): индекс разделов строится один раз
+    idx = DocumentIndex(text, page_offsets)
+    result["debug_focus"] = {"sections": idx.summary()}
+    tl = extract_timeline(text, index=idx)
+    det1 = validate_stac_det(tl, full_text=text, index=idx)
     result["passes"] += det1.get("passes", [])
     result["violations"] += det1.get("violations", [])
 
-    gen = extract_general(text)
+    gen = extract_general(text, index=idx)
     det2 = validate_gen_det(gen)
     result["passes"] += det2.get("passes", [])
     result["violations"] += det2.get("violations", [])
+    if on_event is not None:
+        det = _ensure_status({"passes": [dict(p) for p in result["passes"]],
+                              "violations": [dict(v) for v in result["violations"]]})
+        _emit(on_event, "deterministic", dict(det, sections=result["debug_focus"]["sections"]))
 
-    # 2) Вход для ЛЛМ (фокус)
+    # 2) Вход для ЛЛМ (фокус) + сводка показателей: числа модели не приходится искать в страницах
     condensed = llm_text if llm_text is not None else focus_text(text)
+    vitals = extract_vitals(idx)
+    result["debug_focus"]["vitals"] = vitals_summary(vitals)
+    facts = fact_sheet(vitals) if os.getenv("LLM_FACT_SHEET", "1") == "1" else ""
+    if facts:
+        condensed = f"[Показатели — извлечены из документа]\n{facts}\n\n{condensed}"
 
     # 3) LLM выключаем по окружению
     model_used = model or os.getenv("STAC_MODEL", STAC_MODEL)
@@ -140,6 +221,32 @@ def audit_stac(text: str, llm_text: str | None = None, model: Optional[str] = No
     EV_MAX = int(os.getenv("EVIDENCE_MAX_CHARS", "90"))
     NUM_PREDICT = int(os.getenv("NUM_PREDICT", "768"))       # можно поднять до 1024+ при VRAM
 
+    # 4a) Правила, уже решённые детерминированно с высокой уверенностью, в LLM не отправляем
+    # (LLM_SKIP_DET_CONFIDENCE > 1 — отправлять все)
+    min_conf = float(os.getenv("LLM_SKIP_DET_CONFIDENCE", "0.85"))
+    det_decided = _det_decided(result, min_conf)
+    llm_rule_ids = [rid for rid in RULE_ID_ENUM if rid not in det_decided]
+    chunks = _chunks(llm_rule_ids, CHUNK_SIZE)
+
+    def _prompt_tokens(plan: List[List[str]]) -> int:
+        # оценка входа: system + вопрос + текст документа на каждый вызов
+        chars = sum(sum(map(len, _chunk_prompt(c, LIMIT_ITEMS, EV_MAX))) + len(condensed) for c in plan)
+        return int(chars / AVG_CHARS_PER_TOKEN)
+
+    full_plan = _chunks(RULE_ID_ENUM, CHUNK_SIZE)
+    llm_status["det_short_circuit"] = {
+        "min_confidence": min_conf,
+        "skipped_rules": det_decided,
+        "chunks_saved": len(full_plan) - len(chunks),
+        "tokens_saved_est": _prompt_tokens(full_plan) - _prompt_tokens(chunks),
+    }
+    if not chunks:
+        llm_status.update({"ok": True, "chunks": 0})
+        llm_status.pop("error", None)
+        result["assessed_rule_ids"] = []
+        result["llm_status"] = llm_status
+        return _ensure_status(result)
+
     assessed_all: set[str] = set()
     viol_map: Dict[str, Dict[str, Any]] = {}  # rule_id -> item
     assessed_empty_chunks = 0
@@ -151,18 +258,26 @@ def audit_stac(text: str, llm_text: str | None = None, model: Optional[str] = No
     SAMPLES_MAX = int(os.getenv("LLM_SAMPLES_MAX", "3"))
     SAMPLE_CHARS = int(os.getenv("LLM_SAMPLE_CHARS", "160"))
 
-    # Выбор формата вывода ЛЛМ: JSON-Schema (если поддерживается), Grammar (GBNF) или простой JSON
+    # Выбор формата вывода ЛЛМ: JSON-Schema (если поддерживается), Grammar (GBNF) или простой JSON.
+    # В режиме auto поддержка берётся из реестра llm_capabilities (пробы — при старте и в фоне)
+    caps: Optional[Dict[str, Any]] = None
+
+    def _caps() -> Dict[str, Any]:
+        nonlocal caps
+        if caps is None:
+            try:
+                caps = capabilities("ollama")
+            except Exception:
+                caps = {}
+        return caps
+
     use_schema_env = os.getenv("OLLAMA_USE_SCHEMA", "auto").lower()
     if use_schema_env in ("1", "true", "yes", "on"):
         schema_supported = True
     elif use_schema_env in ("0", "false", "no", "off"):
         schema_supported = False
     else:
-        # auto-детект через пробный вызов
-        try:
-            schema_supported = bool(schema_smoke_test())
-        except Exception:
-            schema_supported = False
+        schema_supported = bool(_caps().get("schema"))
 
     grammar_env = os.getenv("OLLAMA_USE_GRAMMAR", "auto").lower()
     if schema_supported:
@@ -174,14 +289,8 @@ def audit_stac(text: str, llm_text: str | None = None, model: Optional[str] = No
         if grammar_env in ("0", "false", "no", "off"):
             chosen_mode = "json"
         else:
-            chosen_mode = "grammar"
-            try:
-                if not grammar_smoke_test():
-                    chosen_mode = "json"
-            except Exception:
-                chosen_mode = "json"
+            chosen_mode = "grammar" if _caps().get("grammar") else "json"
 
-    chunks = _chunks(RULE_ID_ENUM, CHUNK_SIZE)
     rules_per_chunk: List[List[str]] = []
     parse_errors = 0
     assessed_weak_chunks = 0
@@ -190,19 +299,44 @@ def audit_stac(text: str, llm_text: str | None = None, model: Optional[str] = No
     llm_last_error = ""
     retry_stats: Dict[str, Any] = {}
 
+    # Кэш ответов LLM (llm_cache): какие чанки/правила взяты из кэша, а какие ушли в модель
+    cache_stats: Dict[str, Any] = {"enabled": cache_enabled("LLM_CACHE"), "hits": 0, "misses": 0,
+                                   "hit_rules": [], "miss_rules": []}
+
+    def _cache_state(cinfo: Dict[str, Any]) -> str:
+        hit = cinfo.get("hit")
+        return "off" if hit is None else ("hit" if hit else "miss")
+
+    # Потоковый ответ Ollama (OLLAMA_STREAM): сколько чанков оборвано на закрытии JSON и сколько токенов сэкономлено
+    stream_stats: Dict[str, Any] = {"calls": 0, "early_stops": 0, "tokens": 0, "tokens_saved_max": 0}
+
+    def _track_cache(rules_this_chunk: List[str], cinfo: Dict[str, Any]) -> None:
+        # вызывается в порядке разбора ответов (не из потоков пула)
+        if cinfo.get("streamed"):
+            stream_stats["calls"] += 1
+            stream_stats["early_stops"] += int(bool(cinfo.get("early_stop")))
+            stream_stats["tokens"] += cinfo.get("tokens", 0)
+            stream_stats["tokens_saved_max"] += cinfo.get("tokens_saved_max", 0)
+        state = _cache_state(cinfo)
+        if state == "hit":
+            cache_stats["hits"] += 1
+            cache_stats["hit_rules"].extend(rules_this_chunk)
+        elif state == "miss":
+            cache_stats["misses"] += 1
+            cache_stats["miss_rules"].extend(rules_this_chunk)
+
+    def _forget_cached(cinfo: Dict[str, Any]) -> None:
+        # неразбираемый ответ не оставляем в кэше: следующий аудит спросит модель заново
+        if cinfo.get("key"):
+            llm_cache.forget(cinfo["key"])
+
     def _call_chunk(rules_this_chunk: List[str], num_predict_override: int | None = None, model_override: str | None = None):
-        q = _compact_question(rules_this_chunk, LIMIT_ITEMS, EV_MAX)
+        system, q = _chunk_prompt(rules_this_chunk, LIMIT_ITEMS, EV_MAX)
         t0 = time.time()
         per_chunk_schema = _chunk_schema(rules_this_chunk, EV_MAX, LIMIT_ITEMS) if chosen_mode == "schema" else None
-        # RAG-контекст: глобальные подсказки + краткие подсказки по правилам чанка
-        global_ctx = get_global_context()
-        rule_hints = get_rule_hints(rules_this_chunk)
-        system_ctx = (
-            "Ты строгий аудитор медицинских документов РК. Возвращай только валидный JSON по заданной схеме, без какого-либо текста вне JSON.\n"
-            f"[Глобальный контекст]\n{global_ctx}\n[Подсказки по правилам]\n{rule_hints}"
-        )
+        info: Dict[str, Any] = {}   # кэш (hit/key) и поток (early_stop/tokens) — ключи не пересекаются
         raw = chat_llm(
-            system=system_ctx,
+            system=system,
             question=q,
             text=condensed,
             model=(model_override or model_used),
@@ -216,113 +350,172 @@ def audit_stac(text: str, llm_text: str | None = None, model: Optional[str] = No
             retries=int(os.getenv("OLLAMA_RETRIES", "1")),
             grammar=(COMPACT_AUDIT_GBNF if chosen_mode == "grammar" else None),
             json_schema=(per_chunk_schema if chosen_mode == "schema" else None),
+            cache_info=info,
+            stream_info=info,
         )
         dt = int((time.time() - t0) * 1000)
-        return raw, dt
+        return raw, dt, info
+
+    # Чанки уходят в LLM параллельно (не больше слотов сервера), а ответы разбираются строго
+    # в порядке чанков — слияние viol_map/assessed_all и повторная попытка не зависят от того,
+    # какой ответ пришёл раньше.
+    workers = _llm_parallel(len(chunks))
+    t_phase = time.time()
+    _emit(on_event, "llm_start", {"chunks": len(chunks), "rules": [list(c) for c in chunks], "parallel": workers,
+                                  "mode": chosen_mode, "skipped_rules": det_decided})
+    chunk_timings: List[Dict[str, Any]] = []
 
-    for rules_this_chunk in chunks:
-        rules_per_chunk.append(list(rules_this_chunk))
+    def _safe_call(rules_this_chunk: List[str], num_predict_override: int | None = None):
+        start_ms = int((time.time() - t_phase) * 1000)
         try:
-            raw, dt = _call_chunk(rules_this_chunk)
+            raw, dt, cinfo = _call_chunk(rules_this_chunk, num_predict_override=num_predict_override)
+            return raw, dt, cinfo, None, start_ms
         except Exception as e:
             # Перехватываем сбой LLM на чанке: не валим весь аудит, а подставляем пустой JSON
-            llm_errors += 1
-            llm_last_error = str(e)
-            raw, dt = '{"viol": [], "assessed": []}', 0
-        total_ms += dt
-        total_bytes += len(raw.encode("utf-8"))
-        if len(raw_samples) < SAMPLES_MAX:
-            raw_samples.append(raw[:SAMPLE_CHARS])
-        if raw_full is not None:
-            # опционально сохраняем полный сырой ответ (осторожно с размерами)
-            raw_full.append(raw)
+            return '{"viol": [], "assessed": []}', 0, {}, e, start_ms
 
-        try:
-            data = coerce_json(raw)
-        except Exception:
-            # если распарсить не удалось — считаем, что нарушений нет, assessed заполним фолбэком
-            parse_errors += 1
-            data = {"viol": [], "assessed": []}
-
-        # Если мы в json-режиме и видим пустой/слабый assessed — сделаем одну строгую повторную попытку с урезанным чанком
-        need_retry = False
-        assessed_list_probe = data.get("assessed", []) or []
-        valid_probe = [rid for rid in assessed_list_probe if rid in rules_this_chunk]
-        if chosen_mode == "json" and (not assessed_list_probe or len(set(valid_probe)) < max(1, len(rules_this_chunk)//2)):
-            need_retry = True
-        if need_retry and not retry_used:
-            retry_used = True
-            # разобъём текущий чанк пополам и попробуем снова с меньшим num_predict
-            mid = max(1, len(rules_this_chunk)//2)
-            small_chunks = [rules_this_chunk[:mid], rules_this_chunk[mid:]]
-            retry_hits = 0
-            retry_ms = 0
-            retry_bytes = 0
-            combined_assessed: set[str] = set()
-            combined_viol: Dict[str, Dict[str, Any]] = {}
-            for sub in small_chunks:
-                raw2, dt2 = _call_chunk(sub, num_predict_override=max(256, NUM_PREDICT//2))
-                retry_ms += dt2
-                retry_bytes += len(raw2.encode("utf-8"))
-                try:
-                    data2 = coerce_json(raw2)
-                except Exception:
-                    data2 = {"viol": [], "assessed": []}
-                al2 = data2.get("assessed", []) or []
-                if not al2:
-                    al2 = list(sub)
-                for rid in al2:
-                    if rid in sub:
-                        combined_assessed.add(rid)
-                for v in data2.get("viol", []) or []:
-                    rid = v.get("r", "")
-                    if rid and rid in sub and rid not in combined_viol:
-                        combined_viol[rid] = {
-                            "rule_id": rid,
-                            "title": RULE_TITLES.get(rid, rid),
-                            "severity": v.get("s", RULE_SEVERITY.get(rid, "major")),
-                            "required": True,
-                            "order": v.get("o", "timeline"),
-                            "where": v.get("w", "история болезни"),
-                            "evidence": v.get("e", ""),
-                        }
-            # подменяем результаты текущего чанка
-            assessed_list_probe = list(combined_assessed) or list(rules_this_chunk)
-            data = {"viol": [{"r": k, "s": combined_viol[k]["severity"], "o": combined_viol[k]["order"], "w": combined_viol[k]["where"], "e": combined_viol[k]["evidence"]} for k in combined_viol.keys()],
-                    "assessed": assessed_list_probe}
-            total_ms += retry_ms
-            total_bytes += retry_bytes
-            retry_stats = {"used": True, "extra_ms": retry_ms, "extra_bytes": retry_bytes}
-        # ожидаем {"viol":[...], "assessed":[...]}
-        assessed_list = data.get("assessed", []) or []
-        # если пусто — заполним всем чанком
-        if not assessed_list:
-            assessed_empty_chunks += 1
-            assessed_list = list(rules_this_chunk)
-        # если покрытие слабое (меньше половины валидных id) — фолбэк на полный чанк
-        valid_in_chunk = [rid for rid in assessed_list if rid in rules_this_chunk]
-        if len(set(valid_in_chunk)) < max(1, len(rules_this_chunk) // 2):
-            assessed_weak_chunks += 1
-            assessed_list = list(rules_this_chunk)
-        for rid in assessed_list:
-            if rid in rules_this_chunk:
-                assessed_all.add(rid)
-
-        for v in data.get("viol", []) or []:
-            rid = v.get("r", "")
-            if not rid or rid not in rules_this_chunk:
-                continue
-            # если в этом чанке уже есть нарушение по rid — оставим первое (дальше всё равно дедуп)
-            if rid not in viol_map:
-                viol_map[rid] = {
-                    "rule_id": rid,
-                    "title": RULE_TITLES.get(rid, rid),
-                    "severity": v.get("s", RULE_SEVERITY.get(rid, "major")),
-                    "required": True,
-                    "order": v.get("o", "timeline"),
-                    "where": v.get("w", "история болезни"),
-                    "evidence": v.get("e", ""),
-                }
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_safe_call, c) for c in chunks]
+        for chunk_no, rules_this_chunk in enumerate(chunks):
+            rules_per_chunk.append(list(rules_this_chunk))
+            raw, dt, cinfo, err, start_ms = futures[chunk_no].result()
+            if err is not None:
+                llm_errors += 1
+                llm_last_error = str(err)
+            chunk_timings.append({"chunk": chunk_no, "rules": len(rules_this_chunk), "start_ms": start_ms, "ms": dt,
+                                  "cache": _cache_state(cinfo)})
+            if cinfo.get("streamed"):
+                chunk_timings[-1].update(tokens=cinfo.get("tokens"), early_stop=cinfo.get("early_stop"),
+                                         tokens_saved_max=cinfo.get("tokens_saved_max"))
+            _track_cache(rules_this_chunk, cinfo)
+            total_ms += dt
+            total_bytes += len(raw.encode("utf-8"))
+            if len(raw_samples) < SAMPLES_MAX:
+                raw_samples.append(raw[:SAMPLE_CHARS])
+            if raw_full is not None:
+                # опционально сохраняем полный сырой ответ (осторожно с размерами)
+                raw_full.append(raw)
+
+            try:
+                data = coerce_json(raw)
+            except Exception:
+                # если распарсить не удалось — считаем, что нарушений нет, assessed заполним фолбэком
+                parse_errors += 1
+                data = {"viol": [], "assessed": []}
+                _forget_cached(cinfo)
+
+            # Если мы в json-режиме и видим пустой/слабый assessed — сделаем одну строгую повторную попытку с урезанным чанком
+            need_retry = False
+            assessed_list_probe = data.get("assessed", []) or []
+            valid_probe = [rid for rid in assessed_list_probe if rid in rules_this_chunk]
+            if chosen_mode == "json" and (not assessed_list_probe or len(set(valid_probe)) < max(1, len(rules_this_chunk)//2)):
+                need_retry = True
+            if need_retry and not retry_used:
+                retry_used = True
+                # разобъём текущий чанк пополам и попробуем снова с меньшим num_predict
+                mid = max(1, len(rules_this_chunk)//2)
+                small_chunks = [rules_this_chunk[:mid], rules_this_chunk[mid:]]
+                retry_hits = 0
+                retry_ms = 0
+                retry_bytes = 0
+                combined_assessed: set[str] = set()
+                combined_viol: Dict[str, Dict[str, Any]] = {}
+                retry_np = max(256, NUM_PREDICT//2)
+                retry_errors = 0
+                # отдельный маленький пул: повтор не ждёт в очереди за ещё не начатыми чанками основного пула
+                with ThreadPoolExecutor(max_workers=len(small_chunks)) as retry_pool:
+                    retry_res = list(retry_pool.map(lambda sub: _safe_call(sub, retry_np), small_chunks))
+                for sub, (raw2, dt2, cinfo2, err2, start2) in zip(small_chunks, retry_res):
+                    if err2 is not None:
+                        # сбой половинки считаем как сбой чанка: уже слитые чанки остаются, половинка — пустая
+                        llm_errors += 1
+                        retry_errors += 1
+                        llm_last_error = str(err2)
+                    chunk_timings.append({"chunk": chunk_no, "retry": True, "rules": len(sub), "start_ms": start2,
+                                          "ms": dt2, "cache": _cache_state(cinfo2)})
+                    _track_cache(sub, cinfo2)
+                    retry_ms += dt2
+                    retry_bytes += len(raw2.encode("utf-8"))
+                    try:
+                        data2 = coerce_json(raw2)
+                    except Exception:
+                        data2 = {"viol": [], "assessed": []}
+                        _forget_cached(cinfo2)
+                    al2 = data2.get("assessed", []) or []
+                    if not al2:
+                        al2 = list(sub)
+                    for rid in al2:
+                        if rid in sub:
+                            combined_assessed.add(rid)
+                    for v in data2.get("viol", []) or []:
+                        rid = v.get("r", "")
+                        if rid and rid in sub and rid not in combined_viol:
+                            combined_viol[rid] = {
+                                "rule_id": rid,
+                                "title": RULE_TITLES.get(rid, rid),
+                                "severity": v.get("s", RULE_SEVERITY.get(rid, "major")),
+                                "required": True,
+                                "order": v.get("o", "timeline"),
+                                "where": v.get("w", "история болезни"),
+                                "evidence": v.get("e", ""),
+                            }
+                # подменяем результаты текущего чанка
+                assessed_list_probe = list(combined_assessed) or list(rules_this_chunk)
+                data = {"viol": [{"r": k, "s": combined_viol[k]["severity"], "o": combined_viol[k]["order"], "w": combined_viol[k]["where"], "e": combined_viol[k]["evidence"]} for k in combined_viol.keys()],
+                        "assessed": assessed_list_probe}
+                total_ms += retry_ms
+                total_bytes += retry_bytes
+                retry_stats = {"used": True, "chunk": chunk_no, "extra_ms": retry_ms, "extra_bytes": retry_bytes,
+                               "timings": chunk_timings[-len(small_chunks):]}
+                if retry_errors:
+                    retry_stats["errors"] = retry_errors
+            # ожидаем {"viol":[...], "assessed":[...]}
+            assessed_list = data.get("assessed", []) or []
+            # если пусто — заполним всем чанком
+            if not assessed_list:
+                assessed_empty_chunks += 1
+                assessed_list = list(rules_this_chunk)
+            # если покрытие слабое (меньше половины валидных id) — фолбэк на полный чанк
+            valid_in_chunk = [rid for rid in assessed_list if rid in rules_this_chunk]
+            if len(set(valid_in_chunk)) < max(1, len(rules_this_chunk) // 2):
+                assessed_weak_chunks += 1
+                assessed_list = list(rules_this_chunk)
+            for rid in assessed_list:
+                if rid in rules_this_chunk:
+                    assessed_all.add(rid)
+
+            for v in data.get("viol", []) or []:
+                rid = v.get("r", "")
+                if not rid or rid not in rules_this_chunk:
+                    continue
+                # если в этом чанке уже есть нарушение по rid — оставим первое (дальше всё равно дедуп)
+                if rid not in viol_map:
+                    viol_map[rid] = {
+                        "rule_id": rid,
+                        "title": RULE_TITLES.get(rid, rid),
+                        "severity": v.get("s", RULE_SEVERITY.get(rid, "major")),
+                        "required": True,
+                        "order": v.get("o", "timeline"),
+                        "where": v.get("w", "история болезни"),
+                        "evidence": v.get("e", ""),
+                    }
+
+            try:
+                _emit(on_event, "llm_chunk", {
+                    "chunk": chunk_no,
+                    "of": len(chunks),
+                    "rules": list(rules_this_chunk),
+                    "assessed": [rid for rid in rules_this_chunk if rid in assessed_all],
+                    "violations": [dict(viol_map[rid], status="FAIL") for rid in rules_this_chunk if rid in viol_map],
+                    "ms": dt,
+                    "cache": _cache_state(cinfo),
+                    "error": str(err) if err is not None else None,
+                })
+            except AuditCancelled:
+                # уже идущие вызовы дорабатывают (выход из with ждёт их), остальные не начинаются
+                for f in futures:
+                    f.cancel()
+                raise
 
     # 5) Восстанавливаем PASS как assessed - violations
     violated_ids = set(viol_map.keys())
@@ -335,7 +528,10 @@ def audit_stac(text: str, llm_text: str | None = None, model: Optional[str] = No
     llm_status.update({
         "ok": True,
         "model": model_used,
-        "duration_ms": total_ms,
+        "duration_ms": int((time.time() - t_phase) * 1000),   # по часам: с параллельными вызовами меньше calls_ms
+        "calls_ms": total_ms,
+        "parallel": workers,
+        "chunk_timings": chunk_timings,
         "bytes": total_bytes,
         "chunks": len(chunks),
         "raw_samples": raw_samples,
@@ -345,6 +541,13 @@ def audit_stac(text: str, llm_text: str | None = None, model: Optional[str] = No
         "json_schema": bool(schema_supported),
         "grammar": True if chosen_mode == "grammar" else False,
     }
+    llm_status["cache_info"] = cache_stats
+    if stream_stats["calls"]:
+        llm_status["stream"] = stream_stats
+    if caps:
+        # режим выбран по реестру: насколько свежа запись (пробы в запросе не выполнялись, если она была)
+        c = with_age(caps)
+        llm_status["capabilities"] = {k: c.get(k) for k in ("schema", "grammar", "loaded", "age_s", "fresh")}
     if parse_errors:
         llm_status["parse_errors"] = parse_errors
     if assessed_empty_chunks:
@@ -1,18 +1,25 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 import re
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
-from typing import Optional
+from functools import lru_cache
+from typing import List, Optional, Tuple
 
 # Поддерживаем самые частые форматы дат/времени
 DATE_RX = re.compile(
     r"\b(?P<d>\d{1,2})[.\-/](?P<m>\d{1,2})[.\-/](?P<y>\d{2,4})(?:[T\s]+(?P<h>\d{1,2}):(?P<min>\d{2})(?::(?P<s>\d{2}))?)?\b"
 )
 
+# Упоминание даты (и времени) в тексте документа — для индекса дат (DateIndex)
+DT_MENTION_RX = re.compile(r"(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}(?:[T\s]+\d{1,2}:\d{2}(?::\d{2})?)?)")
+
+@lru_cache(maxsize=8192)
 def parse_dt(s: str) -> Optional[datetime]:
     """
     Парсим строку в datetime (локальное «наивное» время).
     Поддержка DD.MM.YYYY HH:MM[:SS] и DD.MM.YY ...
+    Результат кэшируется: одни и те же строки дат разбираются много раз за документ.
     """
     if not s:
         return None
@@ -54,3 +61,61 @@ def is_work_hours(dt: Optional[datetime]) -> Optional[bool]:
         return None
     wd = dt.weekday()  # 0=Mon..6=Sun
     return (wd < 5) and (WORK_START <= dt.hour < WORK_END)
+
+
+class DateIndex:
+    """
+    Все упоминания дат/времени в тексте, найденные один раз: отсортированные смещения
+    (для поиска даты рядом с маркером через bisect) и отсортированные datetime
+    (для запросов «все события в пределах N часов»).
+    """
+
+    def __init__(self, text: str):
+        self.starts: List[int] = []
+        self.strs: List[str] = []
+        for m in DT_MENTION_RX.finditer(text or ""):
+            self.starts.append(m.start())
+            self.strs.append(m.group(1))
+        self._by_time: Optional[List[Tuple[datetime, int]]] = None
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def first_in(self, start: int, end: int) -> Optional[str]:
+        """Первое упоминание, начинающееся в [start, end)."""
+        hit = self.first_at(start, end)
+        return hit[1] if hit else None
+
+    def first_at(self, start: int, end: int) -> Optional[Tuple[int, str]]:
+        """Первое упоминание в [start, end): (смещение, строка)."""
+        i = bisect_left(self.starts, max(0, start))
+        return (self.starts[i], self.strs[i]) if i < len(self.starts) and self.starts[i] < end else None
+
+    def nearest(self, offset: int, max_dist: Optional[int] = None) -> Optional[Tuple[int, str]]:
+        """Ближайшее к offset упоминание (смещение, строка); max_dist — предел расстояния."""
+        i = bisect_left(self.starts, offset)
+        best = None
+        for j in (i - 1, i):
+            if 0 <= j < len(self.starts):
+                d = abs(self.starts[j] - offset)
+                if (max_dist is None or d <= max_dist) and (best is None or d < best[0]):
+                    best = (d, j)
+        return (self.starts[best[1]], self.strs[best[1]]) if best else None
+
+    def by_time(self) -> List[Tuple[datetime, int]]:
+        """(datetime, смещение) по возрастанию времени; нераспознанные даты пропускаются."""
+        if self._by_time is None:
+            pairs = [(parse_dt(s), off) for s, off in zip(self.strs, self.starts)]
+            self._by_time = sorted((dt, off) for dt, off in pairs if dt)
+        return self._by_time
+
+    def between(self, a: datetime, b: datetime) -> List[Tuple[datetime, int]]:
+        """Упоминания со временем в [a, b]."""
+        items = self.by_time()
+        lo = bisect_left(items, (a, -1))
+        hi = bisect_right(items, (b, float("inf")))
+        return items[lo:hi]
+
+    def within_hours(self, center: datetime, hours: float) -> List[Tuple[datetime, int]]:
+        delta = timedelta(hours=hours)
+        return self.between(center - delta, center + delta)
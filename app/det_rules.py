@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+Декларативные детерминированные правила: блок `det:` у правила в rules/rules_all.yaml.
+Блоки компилируются один раз (при старте приложения) в замыкания и раскладываются по индексу
+«раздел документа → правила», поэтому правила, чьих разделов в документе нет, не вычисляются вовсе.
+
+Формат блока:
+
+  det:
+    source: timeline | general    # по чему проверяем: extract_timeline / extract_general
+    requires: [op_protocol]       # разделы (doc_index.SECTION_KINDS), нужны ВСЕ
+    requires_any: [er_exam, ...]  # нужен ХОТЯ БЫ ОДИН
+    when: [admission_dt, ...]     # поля данных: все непустые, иначе правило не применяется
+    when_any: [er_exam_dt, ...]   # хотя бы одно непустое
+    check:                        # одна проверка или список (все должны пройти)
+      - section: postop_note                              # раздел есть в документе
+      - fields: [op_protocol.pre_diag, ...]               # все поля непустые
+      - delta: [anes_protocol_dt, op_protocol_dt]         # |b − a| не больше max_minutes/max_hours/max_days
+        max_minutes: 30
+        ordered: true                                     # и b не раньше a
+      - count: signatures_count                           # число (или длина списка) ≥ min / > gt
+        min: 1
+    title: ...  where: ...  severity: ...  order: ...     # переопределяют поля правила
+    confidence: 0.9               # уверенность вердикта (по умолчанию DEFAULT_CONFIDENCE)
+    evidence: "Поступл:{admission_dt|fmt} ~ {delta_days:.2f} сут"
+
+В evidence подставляются поля данных (путь через точку) и вычисленные значения:
+delta_min / delta_h / delta_days (последняя проверка delta), has.<раздел> (проверка section).
+
+DEFAULT_CONFIDENCE ниже порога LLM_SKIP_DET_CONFIDENCE (0.85): по умолчанию вердикт правила
+перепроверяет LLM, а высокую уверенность правило объявляет явно. Для delta она ещё и
+ограничивается качеством дат (источник — dt_src из extract_timeline):
+  нет одной из дат                                  → не выше MISSING_DATA_CONFIDENCE
+  дата взята из окна соседства, а не из раздела      → не выше WINDOW_DATE_CONFIDENCE
+  даты неправдоподобны (разрыв больше MAX_STAY_DAYS
+  или дата вне [поступление − 1 сут, + MAX_STAY_DAYS]) → не выше IMPLAUSIBLE_DATE_CONFIDENCE
+FAIL проверки fields (поле не найдено) — скорее промах регулярного извлечения, чем отсутствие
+поля в документе: такой вердикт не выше EXTRACTOR_MISS_CONFIDENCE (PASS — все поля найдены —
+остаётся с уверенностью правила).
+
+Фильтры: yn (да/нет), fmt (дата-время), join (список через запятую), num (пусто → 0);
+после двоеточия — спецификация format() (".2f", ".120" — обрезка строки). Пустое значение
+(None) или значение, к которому спецификация не подходит, выводится как «нет данных».
+"""
+from __future__ import annotations
+
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import yaml
+
+from .datetime_utils import fmt, hours_between
+from .doc_index import DocumentIndex, SECTION_KINDS
+
+_RULES_PATH = os.getenv("RULES_MAIN_FILE", str(Path("rules") / "rules_all.yaml"))
+
+# order по умолчанию — как у прежних проверок в validator_stac_det / validator_gen_det
+DEFAULT_ORDER = {"timeline": "Приказ 27", "general": "Оформление/Общие"}
+DEFAULT_CONFIDENCE = 0.7
+MISSING_DATA_CONFIDENCE = 0.5
+WINDOW_DATE_CONFIDENCE = 0.6
+IMPLAUSIBLE_DATE_CONFIDENCE = 0.3
+EXTRACTOR_MISS_CONFIDENCE = 0.6
+MAX_STAY_DAYS = 365
+
+Check = Callable[[Dict[str, Any], Optional[DocumentIndex], Dict[str, Any]], bool]
+
+
+class DetRule(NamedTuple):
+    pos: int                      # порядок в YAML (порядок результатов)
+    rule_id: str
+    source: str
+    requires: Tuple[str, ...]
+    requires_any: Tuple[str, ...]
+    applies: Callable[[Dict[str, Any]], bool]
+    evaluate: Callable[[Dict[str, Any], Optional[DocumentIndex]], Tuple[str, Dict[str, Any]]]
+
+
+# ---------- компиляция ----------
+def _getter(path: str) -> Callable[[Dict[str, Any]], Any]:
+    keys = path.split(".")
+
+    def get(data: Dict[str, Any]) -> Any:
+        v: Any = data
+        for k in keys:
+            if not isinstance(v, dict):
+                return None
+            v = v.get(k)
+        return v
+    return get
+
+
+def _paths(spec: Any) -> List[Callable[[Dict[str, Any]], Any]]:
+    if isinstance(spec, str):
+        spec = [spec]
+    return [_getter(p) for p in (spec or [])]
+
+
+_FILTERS: Dict[str, Callable[[Any], Any]] = {
+    "yn": lambda v: "да" if bool(v) else "нет",
+    "fmt": fmt,
+    "join": lambda v: ", ".join(v or []),
+    "num": lambda v: v or 0,
+}
+NO_DATA = "нет данных"
+_TPL_RX = re.compile(r"\{([\w.]+)(?:\|(\w+))?(?::([^{}]*))?\}")
+
+
+def _render_value(v: Any, flt: Optional[Callable[[Any], Any]], spec: str) -> str:
+    # пустое значение или неподходящий формат (например, {delta_days:.2f} без дат) — не ошибка аудита
+    try:
+        if flt:
+            v = flt(v)
+        return NO_DATA if v is None else format(v, spec)
+    except (TypeError, ValueError, AttributeError):
+        return NO_DATA
+
+
+def _template(tpl: str) -> Callable[[Dict[str, Any]], str]:
+    parts = []
+    for m in _TPL_RX.finditer(tpl):
+        if m.group(2) and m.group(2) not in _FILTERS:
+            raise ValueError(f"неизвестный фильтр «{m.group(2)}» в evidence")
+        parts.append((m.start(), m.end(), _getter(m.group(1)), _FILTERS.get(m.group(2) or ""), m.group(3) or ""))
+
+    def render(ctx: Dict[str, Any]) -> str:
+        out, last = [], 0
+        for s, e, get, flt, spec in parts:
+            out.append(tpl[last:s])
+            out.append(_render_value(get(ctx), flt, spec))
+            last = e
+        out.append(tpl[last:])
+        return "".join(out).rstrip()
+    return render
+
+
+def _c_section(spec: Dict[str, Any]) -> Check:
+    kind = spec["section"]
+    if kind not in SECTION_KINDS:
+        raise ValueError(f"неизвестный раздел «{kind}»")
+
+    def check(data, idx, extra):
+        ok = idx is not None and idx.has(kind)
+        extra.setdefault("has", {})[kind] = ok
+        return ok
+    return check
+
+
+def _c_fields(spec: Dict[str, Any]) -> Check:
+    getters = _paths(spec["fields"])
+
+    def check(data, idx, extra):
+        ok = all(bool(g(data)) for g in getters)
+        if not ok:
+            extra["extractor_miss"] = True
+        return ok
+    return check
+
+
+_DELTA_UNITS = {"max_minutes": 1 / 60.0, "max_hours": 1.0, "max_days": 24.0}
+
+
+def _in_stay(data: Dict[str, Any], dt: datetime) -> bool:
+    adm = data.get("admission_dt")
+    if not isinstance(adm, datetime):
+        return True
+    return adm - timedelta(days=1) <= dt <= adm + timedelta(days=MAX_STAY_DAYS)
+
+
+def _c_delta(spec: Dict[str, Any]) -> Check:
+    names = list(spec["delta"])
+    get_a, get_b = _paths(names)
+    units = [k for k in _DELTA_UNITS if k in spec]
+    if len(units) != 1:
+        raise ValueError("delta: нужен ровно один из max_minutes / max_hours / max_days")
+    limit_h = float(spec[units[0]]) * _DELTA_UNITS[units[0]]
+    ordered = bool(spec.get("ordered"))
+
+    def check(data, idx, extra):
+        a, b = get_a(data), get_b(data)
+        h = hours_between(a, b)
+        extra.update(delta_h=h, delta_min=None if h is None else h * 60.0,
+                     delta_days=None if h is None else h / 24.0)
+        if h is None:
+            extra["missing_data"] = True
+            return False
+        src = data.get("dt_src") or {}
+        if any(src.get(n) == "window" for n in names):
+            extra["window_date"] = True
+        if h > MAX_STAY_DAYS * 24 or not (_in_stay(data, a) and _in_stay(data, b)):
+            extra["implausible_date"] = True
+        if ordered and b < a:
+            return False
+        return h <= limit_h
+    return check
+
+
+def _c_count(spec: Dict[str, Any]) -> Check:
+    get = _getter(spec["count"])
+    lo, gt = spec.get("min"), spec.get("gt")
+    if lo is None and gt is None:
+        raise ValueError("count: нужен min или gt")
+
+    def check(data, idx, extra):
+        v = get(data)
+        n = len(v) if isinstance(v, (list, tuple, dict)) else (v or 0)
+        return (lo is None or n >= lo) and (gt is None or n > gt)
+    return check
+
+
+_CHECKS: Dict[str, Callable[[Dict[str, Any]], Check]] = {
+    "section": _c_section,
+    "fields": _c_fields,
+    "delta": _c_delta,
+    "count": _c_count,
+}
+
+
+def _compile_check(spec: Dict[str, Any]) -> Check:
+    kinds = [k for k in _CHECKS if k in spec]
+    if len(kinds) != 1:
+        raise ValueError(f"проверка должна содержать ровно один из ключей {list(_CHECKS)}: {spec}")
+    return _CHECKS[kinds[0]](spec)
+
+
+def compile_rule(pos: int, rule: Dict[str, Any]) -> DetRule:
+    det = rule["det"]
+    rid = str(rule.get("id", "")).strip()
+    source = det.get("source", "timeline")
+    if source not in DEFAULT_ORDER:
+        raise ValueError(f"неизвестный source «{source}»")
+    requires = tuple(det.get("requires") or ())
+    requires_any = tuple(det.get("requires_any") or ())
+    for kind in requires + requires_any:
+        if kind not in SECTION_KINDS:
+            raise ValueError(f"неизвестный раздел «{kind}» в requires")
+
+    when, when_any = _paths(det.get("when")), _paths(det.get("when_any"))
+
+    def applies(data: Dict[str, Any]) -> bool:
+        return all(bool(g(data)) for g in when) and (not when_any or any(bool(g(data)) for g in when_any))
+
+    specs = det.get("check") or []
+    checks = [_compile_check(s) for s in (specs if isinstance(specs, list) else [specs])]
+    evidence = _template(str(det.get("evidence", "")))
+    confidence = float(det.get("confidence", DEFAULT_CONFIDENCE))
+    base = {
+        "rule_id": rid,
+        "title": det.get("title") or rule.get("title", rid),
+        "severity": det.get("severity") or rule.get("severity", "major"),
+        "required": bool(rule.get("required", True)),
+        "order": det.get("order") or DEFAULT_ORDER[source],
+        "where": det.get("where") or rule.get("where", ""),
+    }
+
+    def evaluate(data: Dict[str, Any], idx: Optional[DocumentIndex]) -> Tuple[str, Dict[str, Any]]:
+        extra: Dict[str, Any] = {}
+        ok = all([c(data, idx, extra) for c in checks])   # все проверки: их значения нужны в evidence
+        conf = confidence
+        for flag, cap in (("missing_data", MISSING_DATA_CONFIDENCE), ("window_date", WINDOW_DATE_CONFIDENCE),
+                          ("implausible_date", IMPLAUSIBLE_DATE_CONFIDENCE),
+                          ("extractor_miss", EXTRACTOR_MISS_CONFIDENCE)):
+            if extra.get(flag):
+                conf = min(conf, cap)
+        item = dict(base, evidence=evidence({**data, **extra}), confidence=conf)
+        return ("pass" if ok else "fail", item)
+
+    return DetRule(pos, rid, source, requires, requires_any, applies, evaluate)
+
+
+class RuleSet:
+    """
+    Скомпилированные правила одного source. Правило с requires лежит в индексе под первым
+    требуемым разделом, с requires_any — под каждым из них, без требований — в always.
+    """
+
+    def __init__(self, rules: List[DetRule]):
+        self.rules = rules
+        self.always: List[DetRule] = []
+        self.by_section: Dict[str, List[DetRule]] = {}
+        for r in rules:
+            keys = r.requires[:1] or r.requires_any
+            if not keys:
+                self.always.append(r)
+            for kind in keys:
+                self.by_section.setdefault(kind, []).append(r)
+
+    def candidates(self, idx: Optional[DocumentIndex]) -> List[DetRule]:
+        """Правила, все требуемые разделы которых есть в документе (без индекса — все правила)."""
+        if idx is None:
+            return list(self.rules)
+        picked = {r.pos: r for r in self.always}
+        for kind, rules in self.by_section.items():
+            if not idx.has(kind):
+                continue
+            for r in rules:
+                if r.pos not in picked and all(idx.has(k) for k in r.requires[1:]):
+                    picked[r.pos] = r
+        return [picked[p] for p in sorted(picked)]
+
+    def run(self, data: Dict[str, Any], idx: Optional[DocumentIndex] = None) -> Dict[str, List[Dict[str, Any]]]:
+        passes: List[Dict[str, Any]] = []
+        violations: List[Dict[str, Any]] = []
+        for r in self.candidates(idx):
+            if not r.applies(data):
+                continue
+            kind, item = r.evaluate(data, idx)
+            (passes if kind == "pass" else violations).append(item)
+        return {"passes": passes, "violations": violations}
+
+
+_rulesets: Optional[Dict[str, RuleSet]] = None
+
+
+def load_det_rules(path: Optional[str] = None) -> Dict[str, RuleSet]:
+    """Читает и компилирует det-блоки правил (один раз; path — для явной перезагрузки)."""
+    global _rulesets
+    if _rulesets is not None and path is None:
+        return _rulesets
+    p = Path(path or _RULES_PATH)
+    compiled: Dict[str, List[DetRule]] = {s: [] for s in DEFAULT_ORDER}
+    if not p.exists():
+        print(f"[det_rules] {p} not found: declarative rules disabled", file=sys.stderr)
+    else:
+        data = yaml.safe_load(p.read_text(encoding="utf-8")) or {}
+        for pos, rule in enumerate(data.get("rules", []) or []):
+            if not isinstance(rule, dict) or not rule.get("det"):
+                continue
+            try:
+                r = compile_rule(pos, rule)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"[det_rules] {rule.get('id', '?')}: skipped, bad det block: {e}", file=sys.stderr)
+                continue
+            compiled[r.source].append(r)
+    _rulesets = {s: RuleSet(rules) for s, rules in compiled.items()}
+    return _rulesets
+
+
+def run_det_rules(source: str, data: Dict[str, Any],
+                  index: Optional[DocumentIndex] = None) -> Dict[str, List[Dict[str, Any]]]:
+    return load_det_rules()[source].run(data, index)
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import re
+from bisect import bisect_right
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+import numpy as np
+
+from .datetime_utils import parse_dt, fmt
+from .doc_index import DocumentIndex
+
+# Типы дневников: строка относится к первому подходящему типу (порядок важен)
+DIARY_TYPES: Dict[str, re.Pattern] = {
+    "icu": re.compile(
+        r"(дневник|осмотр)\s+(врача[-\s]+)?(анестезиолога?[-\s]+)?реаниматолог\w*"
+        r"|реанимационн\w*\s+дневник|дневник\w*\s+(в\s+)?(оарит|орит|реанимаци\w*)", re.I),
+    "postop": re.compile(r"послеоперационн\w*\s+дневник", re.I),
+    "general": re.compile(r"дневник", re.I),
+}
+
+# Время без даты (записи вида «Дневник 14:00»): дата берётся из ближайшего предыдущего упоминания
+TIME_RX = re.compile(r"(?<![\d:])([01]?\d|2[0-3]):([0-5]\d)(?![\d:])")
+
+SEVERE_GAP_H = 3.0
+CPR_CHECK_MIN = 5
+
+
+def _line_bounds(text: str, i: int) -> Tuple[int, int]:
+    s = text.rfind("\n", 0, i) + 1
+    e = text.find("\n", i)
+    return s, (len(text) if e < 0 else e)
+
+
+def _line_dt(idx: DocumentIndex, line: str, line_start: int) -> Optional[datetime]:
+    dt = parse_dt(line)
+    if dt:
+        return dt
+    m = TIME_RX.search(line)
+    if not m:
+        return None
+    # дата — из последнего упоминания даты до начала строки
+    j = bisect_right(idx.dates.starts, line_start) - 1
+    while j >= 0:
+        day = parse_dt(idx.dates.strs[j])
+        if day:
+            return day.replace(hour=int(m.group(1)), minute=int(m.group(2)), second=0)
+        j -= 1
+    return None
+
+
+def diary_entries(idx: DocumentIndex) -> Dict[str, List[Tuple[int, datetime]]]:
+    """Записи дневников по типам: (смещение строки, время записи); строки без времени пропускаются."""
+    out: Dict[str, List[Tuple[int, datetime]]] = {k: [] for k in DIARY_TYPES}
+    t = idx.text
+    last_line = -1
+    for sec in idx.all("diary"):
+        s, e = _line_bounds(t, sec["start"])
+        if s == last_line:
+            continue
+        last_line = s
+        line = t[s:e]
+        kind = next((k for k, rx in DIARY_TYPES.items() if rx.search(line)), "general")
+        dt = _line_dt(idx, line, s)
+        if dt:
+            out[kind].append((s, dt))
+    return out
+
+
+def _as_minutes(dts: List[datetime]) -> np.ndarray:
+    return np.unique(np.array(dts, dtype="datetime64[m]"))
+
+
+def gap_stats(ts: np.ndarray, limit_h: float = SEVERE_GAP_H,
+              interval: Optional[Tuple[datetime, datetime]] = None) -> Dict[str, Any]:
+    """
+    Разрывы между записями (векторно): число записей, максимальный разрыв (ч), число разрывов
+    больше limit_h. С interval — только записи внутри интервала и доля интервала, покрытая
+    записями (каждая запись «покрывает» limit_h часов вперёд, до следующей записи).
+    """
+    if interval:
+        start, end = np.datetime64(interval[0], "m"), np.datetime64(interval[1], "m")
+        ts = ts[(ts >= start) & (ts <= end)]
+    out: Dict[str, Any] = {"count": int(ts.size), "first": "", "last": "", "max_gap_h": 0.0, "gaps_over_limit": 0}
+    if ts.size:
+        gaps_h = np.diff(ts).astype(np.int64) / 60.0
+        out.update({
+            "first": str(ts[0]).replace("T", " "),
+            "last": str(ts[-1]).replace("T", " "),
+            "max_gap_h": round(float(gaps_h.max()), 2) if gaps_h.size else 0.0,
+            "gaps_over_limit": int((gaps_h > limit_h).sum()),
+        })
+    if interval:
+        span = (end - start).astype(np.int64)
+        if span <= 0:
+            out["coverage"] = 1.0 if ts.size else 0.0
+        else:
+            nxt = np.append(ts[1:], end)
+            covered = np.minimum((nxt - ts).astype(np.int64), int(limit_h * 60)).sum()
+            out["coverage"] = round(float(covered) / float(span), 3)
+    return out
+
+
+def severe_interval(idx: DocumentIndex, notes: np.ndarray) -> Optional[Tuple[datetime, datetime]]:
+    """
+    Интервал тяжёлого состояния: от первой до последней датированной отметки «тяжёлое состояние»;
+    при единственной отметке — до последней записи дневника.
+    """
+    near = (idx.dates.nearest(sec["start"], max_dist=200) for sec in idx.all("severe"))
+    dts = sorted(filter(None, (parse_dt(n[1]) for n in near if n)))
+    if not dts:
+        return None
+    start, end = dts[0], dts[-1]
+    if end <= start and notes.size:
+        end = max(start, notes[-1].astype(datetime))
+    return start, end
+
+
+def extract_diaries(idx: DocumentIndex) -> Dict[str, Any]:
+    entries = diary_entries(idx)
+    by_type = {k: _as_minutes([dt for _, dt in v]) for k, v in entries.items()}
+    all_ts = np.unique(np.concatenate(list(by_type.values())))
+    interval = severe_interval(idx, all_ts)
+    return {
+        "by_type": {k: gap_stats(ts) for k, ts in by_type.items() if ts.size},
+        "all": gap_stats(all_ts),
+        "severe_interval": [fmt(interval[0]), fmt(interval[1])] if interval else None,
+        # при неизвестном интервале — по всем записям, как и прежняя проверка
+        "severe": gap_stats(all_ts, interval=interval) if interval else gap_stats(all_ts),
+    }
+
+
+CPR_LOG_MAX_STEP_MIN = 60
+
+
+def cpr_log(block: str) -> Dict[str, Any]:
+    """
+    Минутный лог СЛР в тексте от маркера: отметки времени ЧЧ:ММ, длительность и максимальный
+    интервал (мин). Лог — непрерывная цепочка отметок: обрывается на шаге больше часа.
+    """
+    mins = np.array([int(h) * 60 + int(m) for h, m in TIME_RX.findall(block or "")], dtype=np.int64)
+    if mins.size:
+        # переход через полночь: каждое уменьшение времени больше чем на 12 ч — следующие сутки
+        wraps = np.concatenate(([0], np.cumsum(np.diff(mins) < -720)))
+        mins = mins + wraps * 1440
+        breaks = np.flatnonzero(np.abs(np.diff(mins)) > CPR_LOG_MAX_STEP_MIN)
+        mins = np.unique(mins[:breaks[0] + 1] if breaks.size else mins)
+    gaps = np.diff(mins)
+    return {
+        "entries": int(mins.size),
+        "span_min": int(mins[-1] - mins[0]) if mins.size else 0,
+        "max_gap_min": int(gaps.max()) if gaps.size else 0,
+    }
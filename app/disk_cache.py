@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Один файл SQLite на сервис: каждая подсистема (страницы документов, OCR, ответы LLM)
+# держит свою таблицу. SQLite в режиме WAL безопасно разделяется между воркерами uvicorn.
+CACHE_PATH = os.getenv("CACHE_PATH", str(Path(".cache") / "medqc2.sqlite3"))
+
+
+def cache_enabled(env_name: str) -> bool:
+    return os.getenv(env_name, "1").lower() in ("1", "true", "yes", "on")
+
+
+class DiskCache:
+    """
+    Простой key→bytes кэш поверх SQLite с вытеснением по размеру (LRU по времени доступа)
+    и опциональным TTL. Значения хранятся сжатыми zlib.
+    """
+
+    def __init__(self, table: str, max_bytes: int, ttl_s: int = 0, path: str = CACHE_PATH):
+        self.table = table
+        self.max_bytes = max(0, int(max_bytes))
+        self.ttl_s = max(0, int(ttl_s))
+        self.path = path
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+
+    # ---------- соединение ----------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            # isolation_level=None — транзакциями управляем сами (BEGIN IMMEDIATE при записи)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+                " created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_accessed ON {self.table}(accessed)")
+            self._local.conn = conn
+        return conn
+
+    # ---------- API ----------
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            conn = self._conn()
+            row = conn.execute(f"SELECT value, created FROM {self.table} WHERE key=?", (key,)).fetchone()
+            now = time.time()
+            if row is None or (self.ttl_s and now - row[1] > self.ttl_s):
+                self.misses += 1
+                return None
+            conn.execute(f"UPDATE {self.table} SET accessed=? WHERE key=?", (now, key))
+            self.hits += 1
+            return zlib.decompress(row[0])
+        except Exception as e:
+            print(f"[disk_cache] {self.table} get failed: {e}", file=sys.stderr)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, value: bytes) -> None:
+        try:
+            data = zlib.compress(value, 6)
+            if self.max_bytes and len(data) > self.max_bytes:
+                return
+            now = time.time()
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {self.table}(key, value, size, created, accessed) VALUES (?,?,?,?,?)",
+                    (key, sqlite3.Binary(data), len(data), now, now),
+                )
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            print(f"[disk_cache] {self.table} put failed: {e}", file=sys.stderr)
+
+    def delete(self, key: str) -> None:
+        try:
+            self._conn().execute(f"DELETE FROM {self.table} WHERE key=?", (key,))
+        except Exception as e:
+            print(f"[disk_cache] {self.table} delete failed: {e}", file=sys.stderr)
+
+    def get_json(self, key: str) -> Optional[Any]:
+        raw = self.get(key)
+        if raw is None:
+            return None
+        try:
+            return json.loads(raw.decode("utf-8"))
+        except Exception:
+            return None
+
+    def put_json(self, key: str, value: Any) -> None:
+        self.put(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.ttl_s:
+            conn.execute(f"DELETE FROM {self.table} WHERE created < ?", (now - self.ttl_s,))
+        if not self.max_bytes:
+            return
+        total = conn.execute(f"SELECT COALESCE(SUM(size), 0) FROM {self.table}").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # вытесняем самые давно использованные записи до 90% лимита
+        target = int(self.max_bytes * 0.9)
+        freed = 0
+        victims = []
+        for key, size in conn.execute(f"SELECT key, size FROM {self.table} ORDER BY accessed ASC"):
+            if total - freed <= target:
+                break
+            victims.append((key,))
+            freed += size
+        conn.executemany(f"DELETE FROM {self.table} WHERE key=?", victims)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"table": self.table, "hits": self.hits, "misses": self.misses, "max_bytes": self.max_bytes}
+        try:
+            n, size = self._conn().execute(f"SELECT COUNT(*), COALESCE(SUM(size), 0) FROM {self.table}").fetchone()
+            out.update({"entries": n, "bytes": size})
+        except Exception as e:
+            out["error"] = str(e)
+        return out
+
+
+_caches: Dict[str, DiskCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(table: str, max_mb_env: str, default_mb: int, ttl_env: Optional[str] = None,
+              default_ttl_s: int = 0) -> DiskCache:
+    """Кэш-таблица с настройками из окружения (создаётся один раз на процесс)."""
+    with _caches_lock:
+        c = _caches.get(table)
+        if c is None:
+            max_bytes = int(float(os.getenv(max_mb_env, str(default_mb))) * 1024 * 1024)
+            ttl = int(os.getenv(ttl_env, str(default_ttl_s))) if ttl_env else default_ttl_s
+            c = DiskCache(table, max_bytes=max_bytes, ttl_s=ttl)
+            _caches[table] = c
+        return c
+
+
+def all_cache_stats() -> Dict[str, Any]:
+    return {name: c.stats() for name, c in _caches.items()}
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import re
+from bisect import bisect_right
+from typing import Dict, Any, List, Optional, Sequence
+from .datetime_utils import DateIndex, parse_dt
+from .lexer import MARKERS, Token, tokenize
+
+# Виды разделов/событий истории болезни (шаблоны — в lexer.MARKERS)
+SECTION_KINDS = (
+    "admission", "er_exam", "ward_exam", "primary_exam", "head_primary", "diag_justify",
+    "preop_epicrisis", "anes_protocol", "op_protocol", "postop_note", "diary", "cpr", "severe",
+    "consilium", "stage_epicrisis", "clinical_diag", "diet", "regimen", "transfusion_pre",
+    "discharge", "discharge_epicrisis", "consent",
+)
+SECTION_RX: Dict[str, re.Pattern] = {k: MARKERS[k][0] for k in SECTION_KINDS}
+
+# Заголовки, открывающие раздел документа: раздел тянется до следующего такого заголовка.
+# Остальные виды — точечные маркеры (конец = конец совпадения).
+STRUCTURAL_KINDS = (
+    "er_exam", "ward_exam", "primary_exam", "diag_justify", "preop_epicrisis",
+    "anes_protocol", "op_protocol", "postop_note", "diary", "transfusion_pre",
+    "consilium", "stage_epicrisis", "discharge_epicrisis",
+)
+
+
+class DocumentIndex:
+    """
+    Индекс разделов документа, строится один раз на текст по потоку токенов лексера
+    (все маркеры lexer.MARKERS за один проход; разделы — виды SECTION_KINDS).
+
+    Каждое вхождение маркера — dict:
+      kind        — вид маркера (ключ lexer.MARKERS)
+      start       — начало совпадения маркера в тексте
+      heading_end — конец совпадения маркера
+      end         — конец раздела: следующий структурный заголовок (для STRUCTURAL_KINDS)
+                    или конец совпадения (для точечных маркеров)
+      page        — номер страницы (0-based) по смещениям страниц, если они переданы
+    """
+
+    def __init__(self, text: str, page_offsets: Optional[Sequence[int]] = None,
+                 tokens: Optional[List[Token]] = None):
+        self.text = text or ""
+        self.page_offsets = list(page_offsets or [])
+        self.tokens = tokens if tokens is not None else tokenize(self.text)
+        self._by_kind: Dict[str, List[Dict[str, Any]]] = {k: [] for k in MARKERS}
+        for tok in self.tokens:
+            self._by_kind[tok.kind].append(
+                {"kind": tok.kind, "start": tok.start, "heading_end": tok.end, "end": tok.end,
+                 "page": self.page_of(tok.start)}
+            )
+        self._close_sections()
+        self._dates: Optional[DateIndex] = None
+
+    @property
+    def dates(self) -> DateIndex:
+        """Индекс упоминаний дат (строится при первом обращении)."""
+        if self._dates is None:
+            self._dates = DateIndex(self.text)
+        return self._dates
+
+    def _close_sections(self) -> None:
+        starts = sorted({s["start"] for k in STRUCTURAL_KINDS for s in self._by_kind[k]})
+        n = len(self.text)
+        for kind in STRUCTURAL_KINDS:
+            for sec in self._by_kind[kind]:
+                # следующий заголовок после текущего (вложенный в сам заголовок не считается)
+                i = bisect_right(starts, sec["heading_end"] - 1)
+                sec["end"] = starts[i] if i < len(starts) else n
+
+    # ---------- запросы ----------
+    def page_of(self, offset: int) -> Optional[int]:
+        if not self.page_offsets:
+            return None
+        return max(0, bisect_right(self.page_offsets, offset) - 1)
+
+    def all(self, kind: str) -> List[Dict[str, Any]]:
+        return self._by_kind.get(kind, [])
+
+    def first(self, kind: str) -> Optional[Dict[str, Any]]:
+        secs = self.all(kind)
+        return secs[0] if secs else None
+
+    def has(self, kind: str) -> bool:
+        return bool(self.all(kind))
+
+    def heading(self, sec: Dict[str, Any]) -> str:
+        return self.text[sec["start"]:sec["heading_end"]]
+
+    def section_text(self, sec: Dict[str, Any]) -> str:
+        return self.text[sec["start"]:sec["end"]]
+
+    def block(self, sec: Dict[str, Any], before: int = 100, after: int = 800) -> str:
+        """Окно вокруг маркера: before символов до начала и after после конца совпадения."""
+        s = max(0, sec["start"] - before)
+        e = min(len(self.text), sec["heading_end"] + after)
+        return self.text[s:e]
+
+    def blocks(self, kind: str, before: int = 100, after: int = 800) -> List[str]:
+        return [self.block(sec, before, after) for sec in self.all(kind)]
+
+    def section_dt_str(self, sec: Dict[str, Any], left: int = 200, right: int = 200) -> Optional[str]:
+        """Дата рядом с маркером: первое упоминание в окне [start-left, start+right)."""
+        return self.dates.first_in(sec["start"] - left, sec["start"] + right)
+
+    def events_within(self, center, hours: float, kinds: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
+        """Вхождения маркеров (по умолчанию — разделов), дата которых в пределах hours от center."""
+        out: List[Dict[str, Any]] = []
+        for kind in (kinds or SECTION_KINDS):
+            for sec in self.all(kind):
+                dt = parse_dt(self.section_dt_str(sec) or "")
+                if dt and abs((dt - center).total_seconds()) <= hours * 3600:
+                    out.append(dict(sec, dt=dt))
+        out.sort(key=lambda x: (x["dt"], x["start"]))
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        """Найденные разделы: вид → число вхождений и страницы (для отладки)."""
+        out: Dict[str, Any] = {}
+        for kind in SECTION_KINDS:
+            secs = self._by_kind[kind]
+            if secs:
+                pages = sorted({s["page"] for s in secs if s["page"] is not None})
+                out[kind] = {"count": len(secs), "pages": pages}
+        return out
+
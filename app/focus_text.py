@@ -1,4 +1,5 @@
 import re, os
+from typing import List, Tuple
 AVG_CHARS_PER_TOKEN = float(os.getenv("AVG_CHARS_PER_TOKEN", "3.7"))
 
 HEADINGS = [
@@ -16,6 +17,55 @@ HEADINGS = [
     r"консилиум", r"лист назначен", r"режим", r"лечебн\w* стол|диет",
 ]
 
+# Все заголовки одной альтернацией (без групп: так sre отсекает позиции по первому символу).
+# Какой именно заголовок совпал, проверяется только в позициях совпадения альтернации.
+HEADINGS_RE = re.compile("|".join(HEADINGS))
+_HEADING_RX = [re.compile(h) for h in HEADINGS]
+
+HEAD_CHARS, TAIL_CHARS = 6000, 3500
+WINDOW_BEFORE, WINDOW_AFTER = 1600, 3400
+_SEP = "\n\n"
+
+
+def first_heading_hits(low: str) -> List[Tuple[int, int]]:
+    """
+    (номер заголовка, позиция первого вхождения) за один проход по тексту в нижнем регистре.
+    Поиск продолжается со следующего символа после начала совпадения, поэтому находятся и
+    вложенные заголовки («дневник» внутри «послеоперационный дневник») — результат тот же,
+    что у отдельного re.search на каждый заголовок.
+    """
+    found = {}
+    pending = list(range(len(HEADINGS)))
+    pos = 0
+    while pending:
+        m = HEADINGS_RE.search(low, pos)
+        if not m:
+            break
+        s = m.start()
+        for k in [k for k in pending if _HEADING_RX[k].match(low, s)]:
+            found[k] = s
+            pending.remove(k)
+        pos = s + 1
+    return sorted(found.items())
+
+
+def _merge_windows(windows: List[Tuple[int, int, int]]) -> List[Tuple[int, int, int, int]]:
+    """
+    windows: (начало, конец, приоритет). Пересекающиеся/смежные окна сливаются в непересекающиеся
+    интервалы: (начало, конец, лучший приоритет, начало окна с этим приоритетом).
+    """
+    merged: List[List[int]] = []
+    for s, e, prio in sorted(windows):
+        if merged and s <= merged[-1][1]:
+            cur = merged[-1]
+            cur[1] = max(cur[1], e)
+            if prio < cur[2]:
+                cur[2], cur[3] = prio, s
+        else:
+            merged.append([s, e, prio, s])
+    return [tuple(x) for x in merged]
+
+
 def focus_text(text: str) -> str:
     num_ctx = int(os.getenv("OLLAMA_NUM_CTX", "3072"))
     out_budget = int(os.getenv("OUTPUT_BUDGET_TOKENS", "200"))
@@ -24,22 +74,26 @@ def focus_text(text: str) -> str:
     max_chars = int(max_input_tokens * AVG_CHARS_PER_TOKEN)
 
     t = text or ""
-    blocks = [t[:6000]]
-    low = t.lower()
-    for rx in HEADINGS:
-        m = re.search(rx, low)
-        if not m: continue
-        i = max(0, m.start() - 1600)
-        j = min(len(t), m.start() + 3400)
-        blocks.append(t[i:j])
-    blocks.append(t[-3500:])
-
-    seen, out, total = set(), [], 0
-    for b in blocks:
-        key = (b[:128], len(b))
-        if key in seen: continue
-        seen.add(key)
-        take = min(len(b), max(0, max_chars - total))
-        if take <= 0: break
-        out.append(b[:take]); total += take
-    return ("\n\n".join(out))[:max_chars]
+    n = len(t)
+    # окна: начало документа, окрестности первых вхождений заголовков, хвост документа;
+    # приоритет — порядок, в котором окна заполняют бюджет
+    windows = [(0, min(n, HEAD_CHARS), 0)]
+    for k, pos in first_heading_hits(t.lower()):
+        windows.append((max(0, pos - WINDOW_BEFORE), min(n, pos + WINDOW_AFTER), k + 1))
+    windows.append((max(0, n - TAIL_CHARS), n, len(HEADINGS) + 1))
+
+    # упаковка: интервалы по приоритету, пока есть бюджет; последний — частично,
+    # начиная с окна, давшего интервалу приоритет
+    picked: List[Tuple[int, int]] = []
+    total = 0
+    for s, e, _, anchor in sorted(_merge_windows(windows), key=lambda x: x[2]):
+        room = max_chars - total - (len(_SEP) if picked else 0)
+        if room <= 0:
+            break
+        if e - s > room:
+            s = max(s, min(anchor, e - room))
+            e = s + room
+        picked.append((s, e))
+        total += (len(_SEP) if len(picked) > 1 else 0) + e - s
+
+    return _SEP.join(t[s:e] for s, e in sorted(picked))[:max_chars]
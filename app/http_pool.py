@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Общий HTTP-клиент для LLM-провайдеров: пул соединений с keep-alive вместо нового
+TCP-соединения на каждый requests.post. requests.Session + HTTPAdapter (пул urllib3 на хост)
+потокобезопасен: им пользуются параллельные чанки аудита из пула потоков.
+
+Лимиты: HTTP_POOL_MAXSIZE — соединений на хост (по умолчанию 16), HTTP_POOL_HOSTS — число
+пулов по хостам (4). Сессия создаётся при первом запросе и закрывается close_http_pool.
+"""
+from __future__ import annotations
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Protocol
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_lock = threading.Lock()
+_session: Optional[requests.Session] = None
+_adapter: Optional[HTTPAdapter] = None
+_stats: Dict[str, int] = {"sync_requests": 0, "errors": 0}
+
+
+def _limits() -> Dict[str, int]:
+    return {
+        "maxsize": int(os.getenv("HTTP_POOL_MAXSIZE", "16")),
+        "hosts": int(os.getenv("HTTP_POOL_HOSTS", "4")),
+    }
+
+
+def _bump(key: str, n: int = 1) -> None:
+    with _lock:
+        _stats[key] = _stats.get(key, 0) + n
+
+
+def get_session() -> requests.Session:
+    global _session, _adapter
+    if _session is None:
+        with _lock:
+            if _session is None:
+                lim = _limits()
+                adapter = HTTPAdapter(pool_connections=lim["hosts"], pool_maxsize=lim["maxsize"], max_retries=0)
+                s = requests.Session()
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _adapter, _session = adapter, s
+    return _session
+
+
+def request(method: str, url: str, *, json: Any = None, headers: Optional[Dict[str, str]] = None,
+            timeout: float = 180, connect_timeout: float = 5, stream: bool = False) -> requests.Response:
+    """Запрос через общий пул (аналог requests.request с timeout=(connect, read))."""
+    _bump("sync_requests")
+    try:
+        return get_session().request(method, url, json=json, headers=headers, timeout=(connect_timeout, timeout),
+                                     stream=stream)
+    except Exception:
+        _bump("errors")
+        raise
+
+
+def post_json(url: str, body: Dict[str, Any], parse: Callable[[Any], str], *, headers: Optional[Dict[str, str]] = None,
+              timeout: float = 180, connect_timeout: float = 5, retries: int = 1, backoff_s: float = 0.2,
+              err_prefix: str = "HTTP error") -> str:
+    """
+    POST с повторами: parse(ответ) возвращает текст или бросает исключение (тогда — повтор).
+    После исчерпания попыток — RuntimeError(f"{err_prefix}: <последняя ошибка>").
+    """
+    last_err: Optional[Exception] = None
+    for _ in range(max(1, retries + 1)):
+        try:
+            return parse(request("POST", url, json=body, headers=headers, timeout=timeout, connect_timeout=connect_timeout))
+        except Exception as e:
+            last_err = e
+            time.sleep(backoff_s)
+    raise RuntimeError(f"{err_prefix}: {last_err}")
+
+
+class LineConsumer(Protocol):
+    def feed(self, line: str) -> bool: ...   # True — дальше не читать
+    def result(self) -> str: ...
+
+
+def post_stream(url: str, body: Dict[str, Any], consumer: Callable[[], LineConsumer], *,
+                headers: Optional[Dict[str, str]] = None, timeout: float = 180, connect_timeout: float = 5,
+                retries: int = 1, backoff_s: float = 0.2, err_prefix: str = "HTTP error") -> str:
+    """
+    POST с построчным чтением ответа (NDJSON): consumer() — новый разборщик на каждую попытку.
+    Когда разборщик просит остановиться, ответ закрывается вместе с соединением — сервер видит
+    разрыв и прекращает генерацию (такое соединение в пул не возвращается).
+    """
+    last_err: Optional[Exception] = None
+    for _ in range(max(1, retries + 1)):
+        try:
+            r = request("POST", url, json=body, headers=headers, timeout=timeout,
+                        connect_timeout=connect_timeout, stream=True)
+            try:
+                if r.status_code != 200:
+                    raise RuntimeError(f"HTTP {r.status_code}: {r.text[:400]}")
+                c = consumer()
+                for line in r.iter_lines(decode_unicode=True):
+                    if line and c.feed(line):
+                        break
+                return c.result()
+            finally:
+                r.close()
+        except Exception as e:
+            last_err = e
+            time.sleep(backoff_s)
+    raise RuntimeError(f"{err_prefix}: {last_err}")
+
+
+# ---------- жизненный цикл и статистика ----------
+def close_http_pool() -> None:
+    global _session, _adapter
+    with _lock:
+        if _session is not None:
+            _session.close()
+        _session = _adapter = None
+
+
+def http_pool_stats() -> Dict[str, Any]:
+    """
+    Переиспользование соединений по живым пулам urllib3 (на хост): запросов, открыто
+    соединений, переиспользовано.
+    """
+    hosts = []
+    adapter = _adapter
+    if adapter is not None:
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            hosts.append({
+                "host": f"{pool.scheme}://{pool.host}:{pool.port}",
+                "requests": pool.num_requests,
+                "connections_opened": pool.num_connections,
+                "reused": max(0, pool.num_requests - pool.num_connections),
+            })
+    with _lock:
+        st = dict(_stats)
+    return {"limits": _limits(), "sync_pools": hosts, **st}
@@ -81,6 +81,7 @@ def build_human_report(raw_result: Dict[str, Any]) -> Dict[str, Any]:
             "duration_ms": llm.get("duration_ms"),
             "bytes": llm.get("bytes"),
             "chunks": llm.get("chunks"),
+            "parallel": llm.get("parallel"),
             # дополнительные диагностические поля
             "mode": llm.get("mode"),
         }
@@ -96,6 +97,13 @@ def build_human_report(raw_result: Dict[str, Any]) -> Dict[str, Any]:
             llm_meta["supports"] = llm.get("supports")
         if llm.get("rules_per_chunk"):
             llm_meta["rules_per_chunk"] = llm.get("rules_per_chunk")
+        if llm.get("det_short_circuit"):
+            llm_meta["det_short_circuit"] = llm.get("det_short_circuit")
+        if llm.get("stream"):
+            llm_meta["stream"] = llm.get("stream")
+        ci = llm.get("cache_info") or {}
+        if ci.get("hits"):
+            llm_meta["cache_hits"] = {"chunks": ci["hits"], "misses": ci.get("misses", 0)}
         samples = llm.get("raw_samples") or []
         if samples:
             llm_meta["samples"] = samples
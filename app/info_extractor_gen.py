@@ -3,62 +3,69 @@ from __future__ import annotations
 import re
 from typing import Dict, Any, List, Optional
 from .datetime_utils import parse_dt, fmt
+from .doc_index import DocumentIndex
+from .lexer import MARKERS
 
+# Шаблоны маркеров, которые ищутся по всему документу, общие с лексером (lexer.MARKERS):
+# extract_general берёт их совпадения из потока токенов DocumentIndex, а не сканирует текст заново.
+# Остальные применяются только к небольшим окнам вокруг маркеров.
 RX = {
     # ФИО: варианты "Ф.И.О.", "Фамилия Имя Отчество", "Пациент:"
-    "fio": re.compile(r"(?:Ф\.?\s*И\.?\s*О\.?|ФИО|Пациент|Фамилия\s*Имя(?:\s*Отчество)?)\s*[:\-]\s*([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+){1,2})", re.I),
+    "fio": MARKERS["fio"][0],
 
-    "iin": re.compile(r"\b\d{12}\b"),
+    "iin": MARKERS["iin"][0],
 
     # ДР/возраст: "Дата рождения:", "Год рождения:", "Возраст: 56 лет"
-    "dob": re.compile(r"(дата|год)\s*рожд[её]н[ия]\s*[:\-]?\s*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}|\d{4})", re.I),
+    "dob": MARKERS["dob"][0],
     "age": re.compile(r"возраст\s*[:\-]?\s*(\d{1,3})\s*лет", re.I),
 
     # Пол: "Пол: муж/жен", "М/Ж" в отдельных местах
-    "sex": re.compile(r"\bпол\s*[:\-]?\s*(муж(?:ской)?|жен(?:ский)?)\b", re.I),
+    "sex": MARKERS["sex"][0],
     "sex_short": re.compile(r"\b(м|ж)\b", re.I),
 
     # № истории: "История болезни №", "ИБ №", "№ ИБ", "ист.бол. №"
-    "histno": re.compile(r"(истор(?:ия|и)\s*(?:болезни|родов)|ИБ|ист\.?\s*бол\.)\s*№\s*([A-Za-zА-Яа-я0-9\-\/]+)", re.I),
+    "histno": MARKERS["histno"][0],
 
     # МО/отделение
-    "org": re.compile(r"(ГКП|КГП|больниц[аы]|поликлиник[аы]|центр|клиник[аы]|наименовани[ея]\s*мед)", re.I),
-    "dept": re.compile(r"(отделени[ея]\s*[:\-]?\s*[А-ЯЁA-Za-zа-яё0-9 \-]+)", re.I),
+    "org": MARKERS["org"][0],
+    "dept": MARKERS["dept"][0],
 
     # Поступление/выписка + даты
-    "admission": re.compile(r"(поступил[аи]?|дата\s+поступ|время\s+поступ)", re.I),
-    "discharge": re.compile(r"(выписан[ао]?|дата\s+выписк|выписной\s+эпикриз)", re.I),
+    "admission": MARKERS["admission"][0],
+    "discharge": MARKERS["discharge"][0],
     "date": re.compile(r"\b\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}\b"),
 
     # Диагнозы + МКБ-10
-    "diagnosis_block": re.compile(r"(диагноз(ы)?(\s*[:\-])?.{0,400})", re.I | re.S),
+    "diagnosis_block": MARKERS["diagnosis_block"][0],
     "icd10": re.compile(r"\b([A-TV-ZА-ЯЁ][0-9][0-9][A-ZА-ЯЁ0-9](?:\.[0-9]{1,2})?)\b"),
 
     # Согласия, подписи, исследования
-    "consent": re.compile(r"(информированн\w*\s+согласие|добровольн\w*\s+информированн\w*\s+согласие)", re.I),
+    "consent": MARKERS["consent"][0],
     "consent_sig": re.compile(r"(подпис[ь|ан]|ФИО|паспорт|пациент|законн\w*\s+представител\w*)", re.I),
-    "lab": re.compile(r"(оак|оам|кщс|абг|биохими|э\W?к\W?г|узи|рентген|кт|мрт)", re.I),
-    "signature": re.compile(r"(врач|лечащий\s+врач|заведующ|ответственн\w*).{0,50}([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ]\.){1,2}|[А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+)", re.I),
+    "lab": MARKERS["lab"][0],
+    "signature": MARKERS["signature"][0],
 
     # Выписной эпикриз — структура
-    "discharge_title": re.compile(r"(выписн\w*\s+эпикриз)", re.I),
-    "block_diag": re.compile(r"(диагноз)", re.I),
-    "block_just": re.compile(r"(обосновани[ея])", re.I),
-    "block_treat": re.compile(r"(провед[её]нн\w*\s+лечени\w*|терап\w*)", re.I),
-    "block_outcome": re.compile(r"(исход|состояние\s+при\s+выписке)", re.I),
-    "block_recom": re.compile(r"(рекомендац)", re.I),
-    "block_regimen": re.compile(r"(режим\s*:\s*[^\n\r]+)", re.I),
-    "block_diet": re.compile(r"(диет[аы]\s*:\s*[^\n\r]+)", re.I),
-    "block_follow": re.compile(r"(явка|контрол[ья])", re.I),
-
-    "med_line": re.compile(r"^[ \t\-\•\*]?\s*[A-ЯЁA-Za-z].{0,120}(\d+\s*(мг|мл|ед))", re.I | re.M),
+    "discharge_title": MARKERS["discharge_epicrisis"][0],
+    "block_diag": MARKERS["block_diag"][0],
+    "block_just": MARKERS["block_just"][0],
+    "block_treat": MARKERS["block_treat"][0],
+    "block_outcome": MARKERS["block_outcome"][0],
+    "block_recom": MARKERS["block_recom"][0],
+    "block_regimen": MARKERS["block_regimen"][0],
+    "block_diet": MARKERS["block_diet"][0],
+    "block_follow": MARKERS["block_follow"][0],
+
+    "med_line": MARKERS["med_line"][0],
     "freq": re.compile(r"(раза?\s+в\s+день|кажд[а-я]+\s*\d+\s*(час|ч))", re.I),
     "duration": re.compile(r"(дн(ей|я)|недел[яи]?|сут(ок|ки))", re.I),
+    "dose": re.compile(r"\d+\s*(мг|мл|ед)", re.I),
 }
 
 
-def extract_general(text: str) -> Dict[str, Any]:
+def extract_general(text: str, index: Optional[DocumentIndex] = None) -> Dict[str, Any]:
     t = text or ""
+    idx = index if index is not None else DocumentIndex(t)
 
     def _find(pat, default=""):
         m = pat.search(t)
@@ -99,69 +106,72 @@ def extract_general(text: str) -> Dict[str, Any]:
         }
     }
 
+    def _first_text(kind: str) -> str:
+        sec = idx.first(kind)
+        return idx.heading(sec) if sec else ""
+
     # Шапка
-    m = RX["fio"].search(t); out["fio_line"] = m.group(0) if m else ""
-    m = RX["iin"].search(t); out["iin"] = m.group(0) if m else ""
-    m = RX["dob"].search(t); out["dob_or_age"] = m.group(0) if m else ""
-    m = RX["sex"].search(t); out["sex"] = m.group(0) if m else ""
-    m = RX["histno"].search(t); out["hist_no"] = m.group(0) if m else ""
-    out["org_present"] = bool(RX["org"].search(t))
-    m = RX["dept"].search(t); out["dept_line"] = m.group(0) if m else ""
+    out["fio_line"] = _first_text("fio")
+    out["iin"] = _first_text("iin")
+    out["dob_or_age"] = _first_text("dob")
+    out["sex"] = _first_text("sex")
+    out["hist_no"] = _first_text("histno")
+    out["org_present"] = idx.has("org")
+    out["dept_line"] = _first_text("dept")
     # Даты
-    adm = RX["admission"].search(t); out["admission_dt_str"] = (adm and RX["date"].search(t[adm.start():adm.end()+80])) and RX["date"].search(t[adm.start():adm.end()+80]).group(0) or ""
-    dis = RX["discharge"].search(t); out["discharge_dt_str"] = (dis and RX["date"].search(t[dis.start():dis.end()+180])) and RX["date"].search(t[dis.start():dis.end()+180]).group(0) or ""
+    adm = idx.first("admission"); m = adm and RX["date"].search(idx.block(adm, before=0, after=80))
+    out["admission_dt_str"] = m.group(0) if m else ""
+    dis = idx.first("discharge"); m = dis and RX["date"].search(idx.block(dis, before=0, after=180))
+    out["discharge_dt_str"] = m.group(0) if m else ""
 
     # Диагноз + МКБ-10
-    diag_blocks = RX["diagnosis_block"].finditer(t)
     icds = set()
-    for m in diag_blocks:
-        block = m.group(1)[:400]
+    for sec in idx.all("diagnosis_block"):
+        block = idx.heading(sec)[:400]
         for c in RX["icd10"].finditer(block):
             icds.add(c.group(1))
     out["icd10_codes"] = sorted(icds)
 
     # Согласия
-    consents = RX["consent"].finditer(t)
     cnt = with_sign = with_date = 0
-    for m in consents:
+    for sec in idx.all("consent"):
         cnt += 1
-        blk = t[max(0, m.start()-80): m.end()+260]
+        blk = idx.block(sec, before=80, after=260)
         if RX["consent_sig"].search(blk): with_sign += 1
         if RX["date"].search(blk): with_date += 1
     out["consents"] = {"count": cnt, "with_sign": with_sign, "with_date": with_date}
 
     # Анализы с датами
     lc = 0
-    for m in RX["lab"].finditer(t):
-        blk = t[max(0, m.start()-40): m.end()+60]
+    for sec in idx.all("lab"):
+        blk = idx.block(sec, before=40, after=60)
         if RX["date"].search(blk):
             lc += 1
     out["labs_with_dates"] = lc
 
     # Подписи исполнителей
-    out["signatures_count"] = len(list(RX["signature"].finditer(t)))
+    out["signatures_count"] = len(idx.all("signature"))
 
     # Выписной эпикриз — структура
     ds = out["discharge_struct"]
-    ds["has_title"]   = bool(RX["discharge_title"].search(t))
-    ds["has_diag"]    = bool(RX["block_diag"].search(t))
-    ds["has_just"]    = bool(RX["block_just"].search(t))
-    ds["has_treat"]   = bool(RX["block_treat"].search(t))
-    ds["has_outcome"] = bool(RX["block_outcome"].search(t))
-    ds["has_recom"]   = bool(RX["block_recom"].search(t))
-    ds["has_regimen"] = bool(RX["block_regimen"].search(t))
-    ds["has_diet"]    = bool(RX["block_diet"].search(t))
-    ds["has_follow"]  = bool(RX["block_follow"].search(t))
+    ds["has_title"]   = idx.has("discharge_epicrisis")
+    ds["has_diag"]    = idx.has("block_diag")
+    ds["has_just"]    = idx.has("block_just")
+    ds["has_treat"]   = idx.has("block_treat")
+    ds["has_outcome"] = idx.has("block_outcome")
+    ds["has_recom"]   = idx.has("block_recom")
+    ds["has_regimen"] = idx.has("block_regimen")
+    ds["has_diet"]    = idx.has("block_diet")
+    ds["has_follow"]  = idx.has("block_follow")
 
     # Рекомендации (препараты)
-    meds_lines = RX["med_line"].finditer(t)
     has_any = False; has_dose = False; has_freq = False; has_duration = False
-    for m in meds_lines:
+    for sec in idx.all("med_line"):
         has_any = True
-        line = m.group(0)
+        line = idx.heading(sec)
         if RX["freq"].search(line): has_freq = True
         if RX["duration"].search(line): has_duration = True
-        if re.search(r"\d+\s*(мг|мл|ед)", line, re.I): has_dose = True
+        if RX["dose"].search(line): has_dose = True
     out["meds_at_discharge"] = {
         "has_any": has_any, "has_dose": has_dose, "has_freq": has_freq, "has_duration": has_duration
     }
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+import re
+from typing import Dict, List, NamedTuple, Tuple
+
+# Маркеры документа: вид → (шаблон, триггеры).
+# Триггер — строчный литерал, с которого начинается ЛЮБОЕ совпадение шаблона
+# (или "\d" — цифра, "^" — начало строки). Триггеры ищутся одним проходом по тексту
+# в нижнем регистре; полный шаблон проверяется только в позициях триггеров.
+MARKERS: Dict[str, Tuple[re.Pattern, Tuple[str, ...]]] = {
+    # разделы / события истории болезни (см. doc_index.SECTION_KINDS)
+    "admission": (re.compile(r"(поступил[аи]?|дата\s+поступ|время\s+поступ)", re.I), ("поступил", "дата", "время")),
+    "er_exam": (re.compile(r"(при[её]мн[ао]м\s+отделен|осмотр\s+в\s+при[её]мном)", re.I), ("приемн", "приёмн", "осмотр")),
+    "ward_exam": (re.compile(r"(осмотр\s+врача\s+отделен|осмотр\s+отделенческ)", re.I), ("осмотр",)),
+    "primary_exam": (re.compile(r"(первичн\w*\s+осмотр)", re.I), ("первичн",)),
+    "head_primary": (re.compile(r"(первичн\w+\s+осмотр|первичный\s+осмотр).{0,80}(заведующ|зав\.)", re.I | re.S), ("первичн",)),
+    "diag_justify": (re.compile(r"(обосновани[ея]\s+диагноз[ао])", re.I), ("обосновани",)),
+    "preop_epicrisis": (re.compile(r"(предоперационн\w*\s+эпикриз)", re.I), ("предоперационн",)),
+    "anes_protocol": (re.compile(r"(протокол\s+анестез\w+|анестезиологическ\w+\s+пособи\w+)", re.I), ("протокол", "анестезиологическ")),
+    "op_protocol": (re.compile(r"(протокол\s+операц\w+)", re.I), ("протокол",)),
+    "postop_note": (re.compile(r"(послеоперационн\w*\s+дневник)", re.I), ("послеоперационн",)),
+    "diary": (re.compile(r"(дневник)", re.I), ("дневник",)),
+    "cpr": (re.compile(r"(сердечно[-\s]*легочн\w*\s+реанимац|СЛР)", re.I), ("сердечно", "слр")),
+    "severe": (re.compile(r"(тяжел\w*\s+состояни\w*)", re.I), ("тяжел",)),
+    "consilium": (re.compile(r"(консилиум)", re.I), ("консилиум",)),
+    "stage_epicrisis": (re.compile(r"(этапн\w*\s+эпикриз)", re.I), ("этапн",)),
+    "clinical_diag": (re.compile(r"(клинич\w*\s+диагноз)", re.I), ("клинич",)),
+    "diet": (re.compile(r"(диет[аы]\s*:\s*[^\n\r]+)", re.I), ("диет",)),
+    "regimen": (re.compile(r"(режим\s*:\s*[^\n\r]+)", re.I), ("режим",)),
+    "transfusion_pre": (re.compile(r"(предтрансфузионн\w*\s+эпикриз)", re.I), ("предтрансфузионн",)),
+    "discharge": (re.compile(r"(выписан[ао]?|дата\s+выписк|выписной\s+эпикриз)", re.I), ("выписан", "дата", "выписной")),
+    "discharge_epicrisis": (re.compile(r"(выписн\w*\s+эпикриз)", re.I), ("выписн",)),
+    "consent": (re.compile(r"(информированн\w*\s+согласие|добровольн\w*\s+информированн\w*\s+согласие)", re.I), ("информированн", "добровольн")),
+
+    # общие сведения / оформление (см. info_extractor_gen)
+    "fio": (re.compile(r"(?:Ф\.?\s*И\.?\s*О\.?|ФИО|Пациент|Фамилия\s*Имя(?:\s*Отчество)?)\s*[:\-]\s*([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ][а-яё]+){1,2})", re.I), ("ф", "пациент")),
+    "iin": (re.compile(r"\b\d{12}\b"), ("\\d",)),
+    "dob": (re.compile(r"(дата|год)\s*рожд[её]н[ия]\s*[:\-]?\s*(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}|\d{4})", re.I), ("дата", "год")),
+    "sex": (re.compile(r"\bпол\s*[:\-]?\s*(муж(?:ской)?|жен(?:ский)?)\b", re.I), ("пол",)),
+    "histno": (re.compile(r"(истор(?:ия|и)\s*(?:болезни|родов)|ИБ|ист\.?\s*бол\.)\s*№\s*([A-Za-zА-Яа-я0-9\-\/]+)", re.I), ("ист", "иб")),
+    "org": (re.compile(r"(ГКП|КГП|больниц[аы]|поликлиник[аы]|центр|клиник[аы]|наименовани[ея]\s*мед)", re.I), ("гкп", "кгп", "больниц", "поликлиник", "центр", "клиник", "наименовани")),
+    "dept": (re.compile(r"(отделени[ея]\s*[:\-]?\s*[А-ЯЁA-Za-zа-яё0-9 \-]+)", re.I), ("отделени",)),
+    "diagnosis_block": (re.compile(r"(диагноз(ы)?(\s*[:\-])?.{0,400})", re.I | re.S), ("диагноз",)),
+    "lab": (re.compile(r"(оак|оам|кщс|абг|биохими|э\W?к\W?г|узи|рентген|кт|мрт)", re.I), ("оак", "оам", "кщс", "абг", "биохими", "э", "узи", "рентген", "кт", "мрт")),
+    "signature": (re.compile(r"(врач|лечащий\s+врач|заведующ|ответственн\w*).{0,50}([А-ЯЁ][а-яё]+(?:\s+[А-ЯЁ]\.){1,2}|[А-ЯЁ][а-яё]+\s+[А-ЯЁ][а-яё]+)", re.I), ("врач", "лечащий", "заведующ", "ответственн")),
+    "block_diag": (re.compile(r"(диагноз)", re.I), ("диагноз",)),
+    "block_just": (re.compile(r"(обосновани[ея])", re.I), ("обосновани",)),
+    "block_treat": (re.compile(r"(провед[её]нн\w*\s+лечени\w*|терап\w*)", re.I), ("провед", "терап")),
+    "block_outcome": (re.compile(r"(исход|состояние\s+при\s+выписке)", re.I), ("исход", "состояние")),
+    "block_recom": (re.compile(r"(рекомендац)", re.I), ("рекомендац",)),
+    "block_regimen": (re.compile(r"(режим\s*:\s*[^\n\r]+)", re.I), ("режим",)),
+    "block_diet": (re.compile(r"(диет[аы]\s*:\s*[^\n\r]+)", re.I), ("диет",)),
+    "block_follow": (re.compile(r"(явка|контрол[ья])", re.I), ("явка", "контрол")),
+    "med_line": (re.compile(r"^[ \t\-\•\*]?\s*[A-ЯЁA-Za-z].{0,120}(\d+\s*(мг|мл|ед))", re.I | re.M), ("^",)),
+
+    # показатели и анализы с числом/датой (см. vitals_extractor); группы: значение(я), единица, дата
+    "hb": (re.compile(r"(?<![a-zа-яё])(?:hb|hgb|гемоглобин\w*)\s*[:\-=]?\s*(\d{2,3}(?:[.,]\d)?)\s*(г/л|g/l|г/дл|g/dl)?", re.I),
+           ("hb", "hgb", "гемоглобин")),
+    "spo2": (re.compile(r"(?:sp[o0][2₂]|сатурац\w*)\s*[:\-=]?\s*(\d{2,3})\s*(%)?", re.I), ("spo", "sp0", "сатурац")),
+    "bp": (re.compile(r"(?<![a-zа-яё])(?:ад|артериальн\w*\s+давлени\w*|давлени\w*)\s*[:\-=]?\s*(\d{2,3})\s*/\s*(\d{2,3})"
+                      r"\s*(мм\s*рт\.?\s*ст\.?)?", re.I), ("ад", "артериальн", "давлени")),
+    "pulse": (re.compile(r"(?<![a-zа-яё])(?:пульс|чсс|ps)\s*[:\-=]?\s*(\d{2,3})\s*(уд\.?\s*/?\s*мин\.?|в\s*мин\.?|/\s*мин)?", re.I),
+              ("пульс", "чсс", "ps")),
+    "blood_loss": (re.compile(r"кровопотер\w*\s*[:\-]?\s*(?:около|до|~|≈)?\s*(\d+(?:[.,]\d+)?)\s*(мл|л)?", re.I), ("кровопотер",)),
+    "cbc": (re.compile(r"(?:оак|общий\s+анализ\s+крови).{0,40}?(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}(?:[T\s]+\d{1,2}:\d{2})?)", re.I),
+            ("оак", "общий")),
+    "abg": (re.compile(r"(?:кщс|абг|кислотно-щелочн\w*).{0,40}?(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}(?:[T\s]+\d{1,2}:\d{2})?)", re.I),
+            ("кщс", "абг", "кислотно")),
+}
+
+
+class Token(NamedTuple):
+    kind: str
+    start: int
+    end: int
+    text: str
+
+
+class Lexer:
+    """
+    Однопроходный сканер маркеров. Результат совпадает с отдельным finditer по каждому шаблону
+    (по каждому виду — неперекрывающиеся совпадения слева направо), но текст просматривается
+    один раз: общая альтернация триггеров без групп (её sre прогоняет быстро, в отличие от
+    альтернации полных шаблонов с именованными группами) + проверка шаблонов только в её позициях.
+    """
+
+    def __init__(self, markers: Dict[str, Tuple[re.Pattern, Tuple[str, ...]]]):
+        self.patterns = {k: rx for k, (rx, _) in markers.items()}
+        self._by_char: Dict[str, List[Tuple[str, Tuple[str, ...]]]] = {}
+        self._digit_kinds: List[str] = []
+        self._line_kinds: List[str] = []
+        literals = set()
+        for kind, (_, triggers) in markers.items():
+            for trig in triggers:
+                if trig == "\\d":
+                    self._digit_kinds.append(kind)
+                elif trig == "^":
+                    self._line_kinds.append(kind)
+                else:
+                    literals.add(trig)
+            lits = tuple(t for t in triggers if t not in ("\\d", "^"))
+            for c in sorted({t[0] for t in lits}):
+                self._by_char.setdefault(c, []).append((kind, tuple(t for t in lits if t[0] == c)))
+        parts = [re.escape(t) for t in sorted(literals, key=len, reverse=True)]
+        if self._digit_kinds:
+            parts.insert(0, r"\d")
+        if self._line_kinds:
+            parts.insert(0, r"(?m:^)")
+        self._trigger_rx = re.compile("|".join(parts))
+
+    def _candidates(self, text: str, low: str, s: int) -> List[Tuple[str, Tuple[str, ...]]]:
+        out: List[Tuple[str, Tuple[str, ...]]] = []
+        if self._line_kinds and (s == 0 or text[s - 1] == "\n"):
+            out += [(k, ()) for k in self._line_kinds]
+        c = low[s:s + 1]
+        if self._digit_kinds and c.isdigit():
+            out += [(k, ()) for k in self._digit_kinds]
+        out += self._by_char.get(c, [])
+        return out
+
+    def scan(self, text: str) -> List[Token]:
+        """Поток токенов (kind, start, end, text) по возрастанию start."""
+        t = text or ""
+        low = t.lower()
+        if len(low) != len(t):
+            # редкие символы меняют длину при lower() — смещения не совпадут, идём по шаблонам
+            return self.scan_separate(t)
+        out: List[Token] = []
+        last = dict.fromkeys(self.patterns, 0)
+        pos = 0
+        n = len(t)
+        while pos <= n:
+            m = self._trigger_rx.search(low, pos)
+            if not m:
+                break
+            s = m.start()
+            for kind, trigs in self._candidates(t, low, s):
+                if s < last[kind] or (trigs and not low.startswith(trigs, s)):
+                    continue
+                mm = self.patterns[kind].match(t, s)
+                if mm:
+                    out.append(Token(kind, s, mm.end(), mm.group(0)))
+                    last[kind] = max(mm.end(), s + 1)
+            pos = s + 1
+        return out
+
+    def scan_separate(self, text: str) -> List[Token]:
+        """То же самое отдельным finditer на каждый шаблон (эталон и запасной путь)."""
+        t = text or ""
+        out = [Token(kind, m.start(), m.end(), m.group(0))
+               for kind, rx in self.patterns.items() for m in rx.finditer(t)]
+        out.sort(key=lambda tok: tok.start)
+        return out
+
+
+DOC_LEXER = Lexer(MARKERS)
+
+
+def tokenize(text: str) -> List[Token]:
+    return DOC_LEXER.scan(text)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Кэш ответов LLM на уровне чанка (таблица llm_answers в общем DiskCache).
+
+Ключ — SHA-256 от провайдера, URL и тела запроса к нему (модель, сообщения в текущей раскладке,
+опции генерации, JSON-Schema/grammar), без keep_alive/stream. Поэтому правка одного правила
+(его подсказки, названия, схемы) меняет ключ только того чанка, где оно лежит; остальные чанки
+того же документа берутся из кэша. Кэшируются только детерминированные вызовы (temperature=0).
+
+LLM_CACHE (1/0, по умолчанию 1), LLM_CACHE_MAX_MB (64), LLM_CACHE_TTL_S (7 суток; 0 — без TTL).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+from typing import Any, Dict, Optional
+
+from .disk_cache import cache_enabled, get_cache
+
+# поднимать при изменении формата ключа или хранимого значения
+LLM_CACHE_VERSION = "1"
+
+_VOLATILE = ("keep_alive", "stream")
+
+
+def enabled(temperature: float) -> bool:
+    return temperature == 0.0 and cache_enabled("LLM_CACHE")
+
+
+def _cache():
+    return get_cache("llm_answers", "LLM_CACHE_MAX_MB", 64, ttl_env="LLM_CACHE_TTL_S", default_ttl_s=7 * 24 * 3600)
+
+
+def cache_key(provider: str, url: str, body: Dict[str, Any]) -> str:
+    stable = {k: v for k, v in body.items() if k not in _VOLATILE}
+    payload = json.dumps({"v": LLM_CACHE_VERSION, "provider": provider, "url": url, "body": stable},
+                         ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def get(key: str) -> Optional[str]:
+    raw = _cache().get(key)
+    return raw.decode("utf-8") if raw is not None else None
+
+
+def put(key: str, answer: str) -> None:
+    if answer and answer.strip():
+        _cache().put(key, answer.encode("utf-8"))
+
+
+def forget(key: str) -> None:
+    """Убрать ответ, который не удалось разобрать (иначе повторный аудит получит тот же мусор)."""
+    _cache().delete(key)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Реестр возможностей LLM-бэкенда: доступность, поддержка JSON-Schema и grammar, загружена ли модель.
+Ключ — (провайдер, URL, модель); запись живёт LLM_CAPS_TTL_S секунд (неудачная проба — LLM_CAPS_RETRY_S).
+
+Пробы (schema_smoke_test / grammar_smoke_test / пинг) — полноценные вызовы модели, поэтому
+в запросе аудита они не выполняются: запись заполняется при старте (warm-up в фоне) и
+обновляется фоновым потоком. Устаревшая запись отдаётся сразу, а обновление уходит в фон;
+синхронно проба выполняется, только если записи нет вовсе.
+
+Warm-up (LLM_WARMUP=1, по умолчанию): предзагрузка модели Ollama с KEEP_ALIVE и слежение
+за /api/ps — выгруженная сервером модель загружается снова при следующем обновлении.
+"""
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from . import ollama_client, openai_compat_client
+
+Key = Tuple[str, str, str]
+
+_lock = threading.Lock()
+_entries: Dict[Key, Dict[str, Any]] = {}
+_probing: Dict[Key, threading.Lock] = {}
+_refreshing: set = set()
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+
+def _ttl() -> float:
+    return float(os.getenv("LLM_CAPS_TTL_S", "600"))
+
+
+def _retry_ttl() -> float:
+    return float(os.getenv("LLM_CAPS_RETRY_S", "30"))
+
+
+def _key(provider: str) -> Key:
+    if provider == "openai":
+        return ("openai", openai_compat_client.OPENAI_COMPAT_BASE_URL, os.getenv("OPENAI_MODEL", "gpt-4o-mini"))
+    return ("ollama", ollama_client.OLLAMA_URL, os.getenv("STAC_MODEL", "gpt-oss:latest"))
+
+
+def _loaded(model: str) -> Dict[str, Any]:
+    """Загружена ли модель (по /api/ps) и список загруженных моделей."""
+    try:
+        models = ollama_client.get_ps().get("models") or []
+    except Exception as e:
+        return {"loaded": None, "ps": [], "ps_error": f"{type(e).__name__}: {e}"}
+    names = [m.get("name") or m.get("model") or "" for m in models]
+    ps = [{"name": n, "expires_at": m.get("expires_at"), "size_vram": m.get("size_vram")} for n, m in zip(names, models)]
+    return {"loaded": model in names, "ps": ps}
+
+
+def _probe(key: Key) -> Dict[str, Any]:
+    provider, _url, model = key
+    t0 = time.time()
+    if provider == "openai":
+        ping = openai_compat_client.ping_openai_compat()
+        out: Dict[str, Any] = {"ping": ping, "schema": False, "grammar": False, "json_object": ping["ok"]}
+    else:
+        ping = ollama_client.quick_ping()
+        out = {"ping": ping, "schema": False, "grammar": False}
+        if not ping.get("error"):
+            # сервер отвечает: проверяем форматы вывода (при недоступном — не ждём ещё два таймаута)
+            out["schema"] = bool(ollama_client.schema_smoke_test())
+            out["grammar"] = bool(ollama_client.grammar_smoke_test())
+        out.update(_loaded(model))
+    now = time.time()
+    out.update(provider=provider, url=key[1], model=model, checked_at=now,
+               probe_ms=int((now - t0) * 1000), ok=bool(ping.get("ok")))
+    return out
+
+
+def _fresh(entry: Dict[str, Any]) -> bool:
+    ttl = _ttl() if entry.get("ok") else _retry_ttl()
+    return time.time() - entry["checked_at"] < ttl
+
+
+def refresh(provider: str = "ollama") -> Dict[str, Any]:
+    """Проба и запись в реестр (параллельные вызовы для одного ключа ждут одну пробу)."""
+    key = _key(provider)
+    with _lock:
+        plock = _probing.setdefault(key, threading.Lock())
+        started = time.time()
+    with plock:
+        with _lock:
+            entry = _entries.get(key)
+        if entry is not None and entry["checked_at"] >= started:
+            return entry        # пока ждали, запись обновил другой поток
+        entry = _probe(key)
+        with _lock:
+            _entries[key] = entry
+        return entry
+
+
+def _refresh_bg(provider: str) -> None:
+    key = _key(provider)
+    with _lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+
+    def run():
+        try:
+            refresh(provider)
+        except Exception as e:
+            print(f"[llm_capabilities] refresh {key}: {type(e).__name__}: {e}", file=sys.stderr)
+        finally:
+            with _lock:
+                _refreshing.discard(key)
+    threading.Thread(target=run, name="llm-caps-refresh", daemon=True).start()
+
+
+def capabilities(provider: str = "ollama", force: bool = False) -> Dict[str, Any]:
+    """
+    Возможности бэкенда из реестра. Свежая запись — как есть; устаревшая — как есть плюс
+    обновление в фоне; нет записи (или force) — синхронная проба.
+    """
+    with _lock:
+        entry = _entries.get(_key(provider))
+    if entry is None or force:
+        return refresh(provider)
+    if not _fresh(entry):
+        _refresh_bg(provider)
+    return entry
+
+
+def with_age(entry: Dict[str, Any]) -> Dict[str, Any]:
+    return dict(entry, age_s=round(time.time() - entry["checked_at"], 1), fresh=_fresh(entry))
+
+
+def registry_snapshot() -> Dict[str, Any]:
+    with _lock:
+        entries = list(_entries.values())
+    return {"ttl_s": _ttl(), "retry_s": _retry_ttl(), "warmup_running": bool(_thread and _thread.is_alive()),
+            "entries": [with_age(e) for e in entries]}
+
+
+# ---------- warm-up и фоновое обновление ----------
+def _provider() -> str:
+    return "openai" if os.getenv("LLM_PROVIDER", "").strip().lower() == "openai" else "ollama"
+
+
+def warm_up() -> Dict[str, Any]:
+    """Предзагрузка модели (Ollama) и проба возможностей; повторная загрузка, если модель выгружена."""
+    provider = _provider()
+    if provider == "ollama":
+        key = _key("ollama")
+        model = key[2]
+        with _lock:
+            entry = _entries.get(key)
+        if entry is None or entry.get("loaded") is not True:
+            try:
+                ollama_client.preload_model(model, keep_alive=os.getenv("KEEP_ALIVE", "30m"))
+            except Exception as e:
+                print(f"[llm_capabilities] preload {model}: {type(e).__name__}: {e}", file=sys.stderr)
+    return refresh(provider)
+
+
+def _loop() -> None:
+    while not _stop.is_set():
+        try:
+            entry = warm_up()
+            wait = _ttl() / 2 if entry.get("ok") else _retry_ttl()
+        except Exception as e:
+            print(f"[llm_capabilities] warm-up: {type(e).__name__}: {e}", file=sys.stderr)
+            wait = _retry_ttl()
+        _stop.wait(max(1.0, wait))
+
+
+def start_warmup() -> bool:
+    """Фоновый поток warm-up/обновления (не задерживает старт приложения)."""
+    global _thread
+    if os.getenv("LLM_WARMUP", "1") != "1" or os.getenv("SKIP_LLM", "0") == "1":
+        return False
+    if _thread is not None and _thread.is_alive():
+        return True
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="llm-warmup", daemon=True)
+    _thread.start()
+    return True
+
+
+def stop_warmup() -> None:
+    _stop.set()
@@ -2,35 +2,33 @@
 from __future__ import annotations
 
 import os
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Tuple
 
+from . import llm_cache, ollama_client, openai_compat_client
 from .ollama_client import chat_ollama
 from .openai_compat_client import chat_openai_compat
 
+_REQUEST = {"ollama": ollama_client.chat_request, "openai": openai_compat_client.chat_request}
 
-def chat_llm(
+
+def _route(
     system: str,
     question: str,
     text: str,
-    model: Optional[str] = None,
-    force_provider: Optional[str] = None,
-    # общие параметры
-    temperature: float = 0.0,
-    num_predict: int = 512,
-    num_ctx: int = 3072,
-    keep_alive: str = "30m",
-    use_json_format: bool = True,
-    timeout: int = 180,
-    connect_timeout: int = 8,
-    retries: int = 1,
-    # ollama-only
-    grammar: Optional[str] = None,
-    json_schema: Optional[dict] = None,
-) -> str:
-    """
-    Единый вход для LLM. Провайдер выбирается по env LLM_PROVIDER=ollama|openai (или force_provider),
-    по умолчанию: если есть OPENAI_API_KEY — используем openai-совместимый; иначе ollama.
-    """
+    model: Optional[str],
+    force_provider: Optional[str],
+    temperature: float,
+    num_predict: int,
+    num_ctx: int,
+    keep_alive: str,
+    use_json_format: bool,
+    timeout: int,
+    connect_timeout: int,
+    retries: int,
+    grammar: Optional[str],
+    json_schema: Optional[dict],
+) -> Tuple[str, Dict[str, Any]]:
+    """Провайдер и аргументы его клиента (они же — тело ключа кэша ответов)."""
     provider = (force_provider or os.getenv("LLM_PROVIDER", "")).strip().lower()
     if not provider:
         # По умолчанию используем локальный/удалённый Ollama с запечённой моделью
@@ -38,7 +36,7 @@ def chat_llm(
 
     if provider == "openai":
         # OpenAI-совместимый путь: строгий json через response_format
-        return chat_openai_compat(
+        return "openai", dict(
             system=system,
             question=question,
             text=text,
@@ -52,7 +50,7 @@ def chat_llm(
             retries=retries,
         )
     # Ollama по умолчанию (локальный/удалённый)
-    return chat_ollama(
+    return "ollama", dict(
         system=system,
         question=question,
         text=text,
@@ -68,3 +66,58 @@ def chat_llm(
         grammar=grammar,
         json_schema=json_schema,
     )
+
+
+def _cache_lookup(provider: str, kw: Dict[str, Any], cache_info: Optional[Dict[str, Any]]) -> Tuple[Optional[str], Optional[str]]:
+    """(ключ кэша или None, если вызов не кэшируется; ответ из кэша или None)."""
+    if not llm_cache.enabled(kw["temperature"]):
+        if cache_info is not None:
+            cache_info["hit"] = None
+        return None, None
+    key = llm_cache.cache_key(provider, *_REQUEST[provider](**kw))
+    cached = llm_cache.get(key)
+    if cache_info is not None:
+        cache_info.update(hit=cached is not None, key=key)
+    return key, cached
+
+
+def chat_llm(
+    system: str,
+    question: str,
+    text: str,
+    model: Optional[str] = None,
+    force_provider: Optional[str] = None,
+    # общие параметры
+    temperature: float = 0.0,
+    num_predict: int = 512,
+    num_ctx: int = 3072,
+    keep_alive: str = "30m",
+    use_json_format: bool = True,
+    timeout: int = 180,
+    connect_timeout: int = 8,
+    retries: int = 1,
+    # ollama-only
+    grammar: Optional[str] = None,
+    json_schema: Optional[dict] = None,
+    cache_info: Optional[Dict[str, Any]] = None,
+    stream_info: Optional[Dict[str, Any]] = None,
+) -> str:
+    """
+    Единый вход для LLM. Провайдер выбирается по env LLM_PROVIDER=ollama|openai (или force_provider),
+    по умолчанию: если есть OPENAI_API_KEY — используем openai-совместимый; иначе ollama.
+    HTTP-соединения к провайдеру переиспользуются (общий пул http_pool).
+    Детерминированные вызовы (temperature=0) идут через кэш ответов llm_cache; в cache_info
+    (если передан) — hit: True/False (None — вызов не кэшируется) и key. В stream_info — статистика
+    потокового ответа Ollama (ранняя остановка, токены).
+    """
+    provider, kw = _route(system, question, text, model, force_provider, temperature, num_predict, num_ctx,
+                          keep_alive, use_json_format, timeout, connect_timeout, retries, grammar, json_schema)
+    if provider == "ollama":
+        kw["stream_info"] = stream_info
+    key, cached = _cache_lookup(provider, kw, cache_info)
+    if cached is not None:
+        return cached
+    raw = chat_openai_compat(**kw) if provider == "openai" else chat_ollama(**kw)
+    if key:
+        llm_cache.put(key, raw)
+    return raw
@@ -1,19 +1,29 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
 import os
+import tempfile
+import threading
 import time
 
 from fastapi import FastAPI, File, UploadFile, Request, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from .audit_engine_stac import audit_stac
-from .ollama_client import quick_ping, get_tags, schema_smoke_test, grammar_smoke_test
-from .openai_compat_client import ping_openai_compat
-from .pdf_smart_reader import smart_focus_for_llm
+from .audit_engine_stac import AuditCancelled, EventCallback, audit_stac
+from .ollama_client import get_tags, schema_smoke_test, grammar_smoke_test
+from .pdf_smart_reader import build_page_store, smart_focus_for_llm
 from .pdf_text import extract_text_from_pdf
+from .pdf_ocr_fallback import shutdown_ocr_pool
+from .det_rules import load_det_rules
+from .disk_cache import all_cache_stats
+from .http_pool import close_http_pool, http_pool_stats
+from .llm_capabilities import capabilities, registry_snapshot, start_warmup, stop_warmup, with_age
+from .mem_stats import reset_peak_rss, peak_rss_mb
 from .humanize import build_human_report
 from .localize import localize_result
 
@@ -39,6 +49,22 @@ except Exception:
     pass
 
 
+@app.on_event("startup")
+def _startup():
+    # det-блоки rules_all.yaml компилируются один раз, до первого запроса
+    load_det_rules()
+    # предзагрузка модели и пробы возможностей LLM — в фоновом потоке
+    start_warmup()
+
+
+@app.on_event("shutdown")
+def _shutdown():
+    # гасим пул процессов OCR и закрываем keep-alive соединения к LLM вместе с воркером uvicorn
+    stop_warmup()
+    shutdown_ocr_pool()
+    close_http_pool()
+
+
 # измерение времени запроса
 @app.middleware("http")
 async def timing_mw(request: Request, call_next):
@@ -48,36 +74,99 @@ async def timing_mw(request: Request, call_next):
     return resp
 
 
-@app.post("/audit/pdf_stac")
-async def audit_pdf_stac(
-    file: UploadFile = File(...),
-    human: bool = Query(False, description="Человекочитаемый компактный ответ"),
-    format: str = Query("json", description="Формат человека: json|text|markdown", regex="^(json|text|markdown)$"),
-    use_full: bool = Query(False, description="Отдать LLM полный текст (медленнее, но шире покрытие)"),
-    model: str | None = Query(None, description="Переопределить модель Ollama для этого запроса"),
-):
-    blob = await file.read()
+async def _spool_upload(file: UploadFile) -> tuple[str, str, int]:
+    """
+    Пишем загрузку во временный файл блоками (UPLOAD_CHUNK_MB), попутно считая SHA-256.
+    Весь PDF в памяти не держим: дальше PyMuPDF/pdfminer открывают его по пути.
+    Возвращает (путь, sha256, размер в байтах); файл удаляет вызывающий.
+    """
+    chunk = int(float(os.getenv("UPLOAD_CHUNK_MB", "1")) * 1024 * 1024)
+    h = hashlib.sha256()
+    size = 0
+    fd, path = tempfile.mkstemp(suffix=".pdf", dir=os.getenv("UPLOAD_TMP_DIR") or None)
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                block = await file.read(chunk)
+                if not block:
+                    break
+                h.update(block)
+                out.write(block)
+                size += len(block)
+    except Exception:
+        os.remove(path)
+        raise
+    return path, h.hexdigest(), size
+
+
+def _run_audit(path: str, sha256: str, size: int, use_full: bool, model: str | None,
+               on_event: EventCallback | None = None) -> dict:
+    """
+    Аудит загруженного PDF (синхронно; временный файл удаляется). on_event — промежуточные
+    события: pages (страницы извлечены) и события audit_stac (deterministic, llm_start, llm_chunk).
+    """
+    try:
+        # 0) единый проход по PDF: каждая страница читается/OCR-ится один раз
+        store = build_page_store(path, sha256=sha256)
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    if on_event is not None:
+        on_event("pages", {
+            "pages_total": len(store["texts"]),
+            "ocr_pages": sum(1 for used in store["ocr"] if used),
+            "engine": store["engine"],
+            "doc_cache": store.get("cache"),
+        })
 
     # 1) фокусированный текст для LLM (ограничивает вход под num_ctx)
-    focus = smart_focus_for_llm(blob)
+    focus = smart_focus_for_llm(store)
     llm_text = focus["focused_text"]
 
     # 2) полный текст (для детерминированных проверок и как запасной вход)
-    full_text = extract_text_from_pdf(blob)
+    full_text = extract_text_from_pdf(store)
     base_text = full_text if full_text else llm_text
 
     # приоритеты выбора входа для LLM: явный use_full параметр → env LLM_USE_FULL_TEXT → фокусированный текст
     use_full_env = (os.getenv("LLM_USE_FULL_TEXT", "0").lower() in ("1", "true", "yes", "on"))
     llm_in = full_text if (use_full or use_full_env) else llm_text
 
-    result = audit_stac(base_text, llm_text=llm_in, model=model)
+    result = audit_stac(base_text, llm_text=llm_in, model=model,
+                        page_offsets=store["offsets"] if full_text else None, on_event=on_event)
     result.setdefault("debug_focus", {}).update(
         {
             "pages_used": focus.get("pages_used"),
+            "page_scores": focus.get("page_scores"),
             "token_estimate": focus.get("token_estimate"),
             "was_reduced": focus.get("was_reduced"),
+            "pages_total": len(store["texts"]),
+            "ocr_pages": [i for i, used in enumerate(store["ocr"]) if used],
+            "page_kinds": {k: store["page_kinds"].count(k) for k in set(store["page_kinds"])},
+            "engine": store["engine"],
+            "doc_cache": store.get("cache"),
+            "ocr_cache": store.get("ocr_cache"),
+            "ocr_meta": store.get("ocr_meta"),
+            "upload_mb": round(size / (1024 * 1024), 2),
+            "rss_peak_mb": peak_rss_mb(),
         }
     )
+    return result
+
+
+@app.post("/audit/pdf_stac")
+async def audit_pdf_stac(
+    file: UploadFile = File(...),
+    human: bool = Query(False, description="Человекочитаемый компактный ответ"),
+    format: str = Query("json", description="Формат человека: json|text|markdown", regex="^(json|text|markdown)$"),
+    use_full: bool = Query(False, description="Отдать LLM полный текст (медленнее, но шире покрытие)"),
+    model: str | None = Query(None, description="Переопределить модель Ollama для этого запроса"),
+):
+    reset_peak_rss()
+    path, sha256, size = await _spool_upload(file)
+    # чтение/OCR и чанки LLM блокируют: выполняем в пуле потоков, event loop остаётся свободен
+    result = await asyncio.get_running_loop().run_in_executor(None, _run_audit, path, sha256, size, use_full, model)
     if human:
         report = build_human_report(result)
         if format == "json":
@@ -89,6 +178,72 @@ async def audit_pdf_stac(
     return JSONResponse(localize_result(result))
 
 
+# задачи SSE-аудитов: сильная ссылка, пока задача не завершится
+_audit_tasks: set = set()
+
+
+def _sse(kind: str, payload: dict) -> str:
+    return f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+
+@app.post("/audit/pdf_stac/stream")
+async def audit_pdf_stac_stream(
+    file: UploadFile = File(...),
+    human: bool = Query(False, description="Итоговое событие result — человекочитаемый отчёт (JSON)"),
+    use_full: bool = Query(False, description="Отдать LLM полный текст (медленнее, но шире покрытие)"),
+    model: str | None = Query(None, description="Переопределить модель Ollama для этого запроса"),
+):
+    """
+    Тот же аудит, но поэтапно (Server-Sent Events): pages → deterministic → llm_start →
+    llm_chunk (по одному на чанк, в порядке слияния) → result (как у /audit/pdf_stac) → end.
+    При сбое вместо result приходит error. Пункты passes/violations в событиях локализованы.
+    """
+    reset_peak_rss()
+    path, sha256, size = await _spool_upload(file)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    stop = threading.Event()
+
+    def on_event(kind: str, payload: dict) -> None:
+        # вызывается из потока аудита; клиент ушёл — прерываем аудит на ближайшем этапе
+        if stop.is_set():
+            raise AuditCancelled()
+        loop.call_soon_threadsafe(queue.put_nowait, (kind, payload))
+
+    async def run():
+        try:
+            result = await loop.run_in_executor(None, _run_audit, path, sha256, size, use_full, model, on_event)
+            await queue.put(("result", build_human_report(result) if human else localize_result(result)))
+        except AuditCancelled:
+            pass
+        except Exception as e:
+            await queue.put(("error", {"error": f"{type(e).__name__}: {e}"}))
+        finally:
+            queue.put_nowait(("end", {}))
+
+    async def events():
+        task = asyncio.create_task(run())
+        _audit_tasks.add(task)
+        task.add_done_callback(_audit_tasks.discard)
+        try:
+            while True:
+                kind, payload = await queue.get()
+                if kind in ("deterministic", "llm_chunk"):
+                    payload = localize_result(payload)
+                yield _sse(kind, payload)
+                if kind == "end":
+                    break
+        finally:
+            # клиент отключился (Starlette закрывает генератор): результат некому отдать —
+            # поток аудита остановится на следующем событии, не начатые чанки LLM отменятся
+            stop.set()
+            task.cancel()
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 # ---------- DEBUG ----------
 @app.get("/debug/env")
 def dbg_env():
@@ -104,6 +259,10 @@ def dbg_env():
         "OLLAMA_TIMEOUT_READ",
         "LLM_LIMIT_ITEMS",
         "EVIDENCE_MAX_CHARS",
+        "HTTP_POOL_MAXSIZE",
+        "HTTP_POOL_HOSTS",
+        "LLM_WARMUP",
+        "LLM_CAPS_TTL_S",
     ]
     return {k: os.getenv(k) for k in keys}
 
@@ -134,17 +293,41 @@ def dbg_grammar():
         return JSONResponse({"grammar_supported": False, "error": str(e)}, status_code=502)
 
 
+@app.get("/debug/cache")
+def dbg_cache():
+    """Статистика дисковых кэшей (в рамках текущего воркера: hits/misses; по файлу: записи/байты)."""
+    return all_cache_stats()
+
+
+@app.get("/debug/http")
+def dbg_http():
+    """Пул HTTP-соединений к LLM: лимиты, запросы, открытые и переиспользованные соединения."""
+    return http_pool_stats()
+
+
+@app.get("/debug/llm_caps")
+def dbg_llm_caps():
+    """Реестр возможностей LLM: пробы schema/grammar, загруженные модели (/api/ps), возраст записей."""
+    return registry_snapshot()
+
+
+def _cached_ping(provider: str, refresh: bool) -> dict:
+    c = with_age(capabilities(provider, force=refresh))
+    return dict(c["ping"], cached=not refresh, age_s=c["age_s"])
+
+
 @app.get("/debug/llm_ping")
-def llm_ping():
-    return quick_ping()
+def llm_ping(refresh: bool = Query(False, description="Пинговать модель заново, а не брать из реестра")):
+    return dict(_cached_ping("ollama", refresh), http_pool=http_pool_stats())
 
 
 @app.get("/debug/provider")
-def dbg_provider():
+def dbg_provider(refresh: bool = Query(False, description="Проверить провайдеров заново")):
     """Показывает доступность провайдеров (Ollama/OpenAI-совместимый)."""
-    out = {"ollama": quick_ping()}
+    out = {"ollama": _cached_ping("ollama", refresh)}
     try:
-        out["openai_compat"] = ping_openai_compat()
+        out["openai_compat"] = _cached_ping("openai", refresh)
     except Exception as e:
         out["openai_compat"] = {"ok": False, "error": str(e)}
+    out["http_pool"] = http_pool_stats()
     return out
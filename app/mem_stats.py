@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import resource
+import sys
+from typing import Optional
+
+
+def _status_kb(field: str) -> Optional[int]:
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except Exception:
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """
+    Сбрасывает пик RSS процесса (Linux: запись «5» в /proc/self/clear_refs обнуляет VmHWM).
+    Пик общий на воркер: при параллельных запросах в одном воркере значение — верхняя оценка.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="ascii") as f:
+            f.write("5")
+        return True
+    except Exception:
+        return False
+
+
+def peak_rss_mb() -> float:
+    """Пик RSS (VmHWM) в МБ; без /proc — максимум за жизнь процесса из getrusage."""
+    kb = _status_kb("VmHWM")
+    if kb is None:
+        ru = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        kb = ru // 1024 if sys.platform == "darwin" else ru  # macOS отдаёт байты
+    return round(kb / 1024.0, 1)
+
+
+def current_rss_mb() -> float:
+    kb = _status_kb("VmRSS")
+    return round(kb / 1024.0, 1) if kb is not None else 0.0
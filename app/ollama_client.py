@@ -4,47 +4,33 @@ from __future__ import annotations
 import json
 import os
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
-import requests
+from .http_pool import post_json, post_stream, request
+from .prompt_layout import join_messages, join_prompt
+from .utils_json import JsonBalance
 
 # Базовый URL Ollama (GPU-сервер)
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://127.0.0.1:11434")
 
 
 def _join_messages(system: str, question: str, text: str) -> list[dict]:
-    msgs: list[dict] = []
-    if system:
-        msgs.append({"role": "system", "content": system})
-    u = (question or "").strip() or "Проверь документ и верни требуемый JSON."
-    if text:
-        u = f"{u}\n\n=== ДОКУМЕНТ ===\n{text}"
-    msgs.append({"role": "user", "content": u})
-    return msgs
+    return join_messages(system, question, text, "Проверь документ и верни требуемый JSON.")
 
 
-def chat_ollama(
+def _chat_body(
     system: str,
     question: str,
     text: str,
-    model: Optional[str] = None,
-    temperature: float = 0.0,
-    num_predict: int = 512,
-    num_ctx: int = 3072,
-    keep_alive: str = "30m",
-    use_json_format: bool = False,
-    timeout: int = 180,
-    connect_timeout: int = 5,
-    retries: int = 1,
-    grammar: Optional[str] = None,
-    json_schema: Optional[dict] = None,
-) -> str:
-    """
-    Универсальный вызов Ollama /api/chat.
-    Приоритет вывода: JSON-Schema > grammar > format=json.
-    """
-    mdl = model or os.getenv("STAC_MODEL", "gpt-oss:latest")
-
+    mdl: str,
+    temperature: float,
+    num_predict: int,
+    num_ctx: int,
+    keep_alive: str,
+    use_json_format: bool,
+    grammar: Optional[str],
+    json_schema: Optional[dict],
+) -> Dict[str, Any]:
     body: Dict[str, Any] = {
         "model": mdl,
         "messages": _join_messages(system, question, text),
@@ -83,58 +69,144 @@ def chat_ollama(
         body["options"]["grammar"] = grammar
     elif use_json_format:
         body["format"] = "json"
+    return body
 
+
+def _use_generate(grammar: Optional[str], json_schema: Optional[dict]) -> bool:
     # Возможность принудительно использовать /api/generate вместо /api/chat
     use_chat_env = os.getenv("OLLAMA_USE_CHAT", "1").lower() in ("1", "true", "yes", "on")
-    if not use_chat_env and json_schema is None and grammar is None:
-        return generate_ollama(system, question, text, mdl, body.get("options", {}), keep_alive, timeout, connect_timeout, retries)
+    return not use_chat_env and json_schema is None and grammar is None
 
-    last_err: Optional[Exception] = None
-    for _ in range(max(1, retries + 1)):
-        t0 = time.time()
-        try:
-            r = requests.post(f"{OLLAMA_URL}/api/chat", json=body, timeout=(connect_timeout, timeout))
-            dt = int((time.time() - t0) * 1000)
-            if r.status_code != 200:
-                raise RuntimeError(f"Ollama {r.status_code}: {r.text[:400]}")
-            payload = r.json()
-            msg = (payload.get("message") or {})
-            content = msg.get("content") or payload.get("content") or ""
-            if not content:
-                raise RuntimeError(f"Ollama empty content (dt={dt}ms, model={mdl})")
-            return content
-        except Exception as e:
-            last_err = e
-            time.sleep(0.2)
-    raise RuntimeError(f"Ollama error: {last_err}")
 
+def _parse_chat(mdl: str):
+    def parse(r) -> str:
+        if r.status_code != 200:
+            raise RuntimeError(f"Ollama {r.status_code}: {r.text[:400]}")
+        payload = r.json()
+        msg = (payload.get("message") or {})
+        content = msg.get("content") or payload.get("content") or ""
+        if not content:
+            dt = int(r.elapsed.total_seconds() * 1000)
+            raise RuntimeError(f"Ollama empty content (dt={dt}ms, model={mdl})")
+        return content
+    return parse
 
-def generate_ollama(
+
+def chat_request(
     system: str,
     question: str,
     text: str,
     model: Optional[str] = None,
-    options: Optional[Dict[str, Any]] = None,
+    temperature: float = 0.0,
+    num_predict: int = 512,
+    num_ctx: int = 3072,
+    keep_alive: str = "30m",
+    use_json_format: bool = False,
+    grammar: Optional[str] = None,
+    json_schema: Optional[dict] = None,
+    **_transport: Any,
+) -> Tuple[str, Dict[str, Any]]:
+    """URL и тело запроса, который отправит chat_ollama (/api/chat или фолбэк /api/generate)."""
+    mdl = model or os.getenv("STAC_MODEL", "gpt-oss:latest")
+    body = _chat_body(system, question, text, mdl, temperature, num_predict, num_ctx, keep_alive,
+                      use_json_format, grammar, json_schema)
+    if _use_generate(grammar, json_schema):
+        return f"{OLLAMA_URL}/api/generate", _generate_body(system, question, text, mdl, body.get("options", {}), keep_alive)
+    return f"{OLLAMA_URL}/api/chat", body
+
+
+def _parser(url: str, body: Dict[str, Any]):
+    if url.endswith("/api/generate"):
+        return _parse_generate, "Ollama generate error"
+    return _parse_chat(body["model"]), "Ollama error"
+
+
+def _stream_enabled() -> bool:
+    return os.getenv("OLLAMA_STREAM", "1").lower() in ("1", "true", "yes", "on")
+
+
+class _StreamCollector:
+    """
+    Собирает ответ из NDJSON-потока Ollama (/api/chat или /api/generate, stream=true). Как только
+    JSON-объект верхнего уровня закрылся (баланс скобок — utils_json.JsonBalance), чтение
+    прекращается: хвост из пробелов/текста до num_predict модель уже не генерирует.
+    Итог — в info: streamed, early_stop, tokens (получено), tokens_saved_max (num_predict − tokens
+    при ранней остановке: верхняя граница, модель могла бы закончить и сама).
+    """
+
+    def __init__(self, model: str, num_predict: int, info: Optional[Dict[str, Any]]):
+        self.model = model
+        self.num_predict = num_predict
+        self.info = info
+        self.parts: list[str] = []
+        self.balance = JsonBalance()
+        self.tokens = 0
+        self.early_stop = False
+
+    def feed(self, line: str) -> bool:
+        payload = json.loads(line)
+        if payload.get("error"):
+            raise RuntimeError(f"Ollama stream error: {payload['error']}")
+        piece = (payload.get("message") or {}).get("content") or payload.get("response") or ""
+        if piece:
+            self.tokens += 1
+            end = self.balance.feed(piece)
+            if end >= 0:
+                self.parts.append(piece[:end])
+                self.early_stop = not payload.get("done")
+                return True
+            self.parts.append(piece)
+        return bool(payload.get("done"))
+
+    def result(self) -> str:
+        content = "".join(self.parts)
+        if self.info is not None:
+            saved = max(0, self.num_predict - self.tokens) if self.early_stop else 0
+            self.info.update(streamed=True, early_stop=self.early_stop, tokens=self.tokens, tokens_saved_max=saved)
+        if not content:
+            raise RuntimeError(f"Ollama empty content (stream, model={self.model})")
+        return content
+
+
+def chat_ollama(
+    system: str,
+    question: str,
+    text: str,
+    model: Optional[str] = None,
+    temperature: float = 0.0,
+    num_predict: int = 512,
+    num_ctx: int = 3072,
     keep_alive: str = "30m",
+    use_json_format: bool = False,
     timeout: int = 180,
     connect_timeout: int = 5,
     retries: int = 1,
+    grammar: Optional[str] = None,
+    json_schema: Optional[dict] = None,
+    stream_info: Optional[Dict[str, Any]] = None,
 ) -> str:
     """
-    Вызов Ollama /api/generate. Собирает prompt из system + question + text. Без structured outputs.
-    Используйте как фолбэк, если /api/chat даёт пустые ответы на некоторых моделях (например, gpt-oss).
+    Универсальный вызов Ollama /api/chat (через общий пул соединений http_pool).
+    Приоритет вывода: JSON-Schema > grammar > format=json.
+    При OLLAMA_STREAM=1 (по умолчанию) ответ читается потоком и обрывается на закрытии JSON;
+    статистика потока — в stream_info (если передан).
     """
+    url, body = chat_request(system, question, text, model, temperature, num_predict, num_ctx, keep_alive,
+                             use_json_format, grammar, json_schema)
+    parse, err_prefix = _parser(url, body)
+    if _stream_enabled():
+        return post_stream(url, dict(body, stream=True), lambda: _StreamCollector(body["model"], num_predict, stream_info),
+                           timeout=timeout, connect_timeout=connect_timeout, retries=retries, err_prefix=err_prefix)
+    return post_json(url, body, parse, timeout=timeout, connect_timeout=connect_timeout, retries=retries,
+                     err_prefix=err_prefix)
+
+
+def _generate_body(system: str, question: str, text: str, model: Optional[str],
+                   options: Optional[Dict[str, Any]], keep_alive: str) -> Dict[str, Any]:
     mdl = model or os.getenv("STAC_MODEL", "gpt-oss:latest")
-    prompt_parts = []
-    if system:
-        prompt_parts.append(system)
-    if question:
-        prompt_parts.append(question)
-    if text:
-        prompt_parts.append("=== ДОКУМЕНТ ===\n" + text)
-    prompt = "\n\n".join(p.strip() for p in prompt_parts if p.strip())
+    prompt = join_prompt(system, question, text)
 
-    body: Dict[str, Any] = {
+    return {
         "model": mdl,
         "prompt": prompt,
         "options": options or {},
@@ -142,25 +214,39 @@ def generate_ollama(
         "stream": False,
     }
 
-    last_err: Optional[Exception] = None
-    for _ in range(max(1, retries + 1)):
-        try:
-            r = requests.post(f"{OLLAMA_URL}/api/generate", json=body, timeout=(connect_timeout, timeout))
-            if r.status_code != 200:
-                raise RuntimeError(f"Ollama generate {r.status_code}: {r.text[:400]}")
-            payload = r.json()
-            content = payload.get("response") or payload.get("content") or ""
-            if not content:
-                raise RuntimeError("Ollama generate empty content")
-            return content
-        except Exception as e:
-            last_err = e
-            time.sleep(0.2)
-    raise RuntimeError(f"Ollama generate error: {last_err}")
+
+def _parse_generate(r) -> str:
+    if r.status_code != 200:
+        raise RuntimeError(f"Ollama generate {r.status_code}: {r.text[:400]}")
+    payload = r.json()
+    content = payload.get("response") or payload.get("content") or ""
+    if not content:
+        raise RuntimeError("Ollama generate empty content")
+    return content
+
+
+def generate_ollama(
+    system: str,
+    question: str,
+    text: str,
+    model: Optional[str] = None,
+    options: Optional[Dict[str, Any]] = None,
+    keep_alive: str = "30m",
+    timeout: int = 180,
+    connect_timeout: int = 5,
+    retries: int = 1,
+) -> str:
+    """
+    Вызов Ollama /api/generate. Собирает prompt из system + question + text. Без structured outputs.
+    Используйте как фолбэк, если /api/chat даёт пустые ответы на некоторых моделях (например, gpt-oss).
+    """
+    body = _generate_body(system, question, text, model, options, keep_alive)
+    return post_json(f"{OLLAMA_URL}/api/generate", body, _parse_generate, timeout=timeout,
+                     connect_timeout=connect_timeout, retries=retries, err_prefix="Ollama generate error")
 
 
 def get_tags(timeout: int = 5, connect_timeout: int = 3) -> dict:
-    r = requests.get(f"{OLLAMA_URL}/api/tags", timeout=(connect_timeout, timeout))
+    r = request("GET", f"{OLLAMA_URL}/api/tags", timeout=timeout, connect_timeout=connect_timeout)
     r.raise_for_status()
     return r.json()
 
@@ -181,7 +267,7 @@ def schema_smoke_test(timeout: int = 12, connect_timeout: int = 3) -> bool:
         "stream": False,
     }
     try:
-        r = requests.post(f"{OLLAMA_URL}/api/chat", json=body, timeout=(connect_timeout, timeout))
+        r = request("POST", f"{OLLAMA_URL}/api/chat", json=body, timeout=timeout, connect_timeout=connect_timeout)
         r.raise_for_status()
         data = r.json()
         msg = (data.get("message") or {})
@@ -207,7 +293,7 @@ def quick_ping() -> dict:
             "format": {"type": "object", "properties": {"ok": {"type": "boolean"}}, "required": ["ok"]},
             "stream": False,
         }
-        r = requests.post(f"{OLLAMA_URL}/api/chat", json=body, timeout=(5, 12))
+        r = request("POST", f"{OLLAMA_URL}/api/chat", json=body, timeout=12, connect_timeout=5)
         dt = int((time.time() - t0) * 1000)
         r.raise_for_status()
         payload = r.json()
@@ -237,7 +323,7 @@ ws   ::= ([ \t\n\r])*
         "stream": False,
     }
     try:
-        r = requests.post(f"{OLLAMA_URL}/api/chat", json=body, timeout=(connect_timeout, timeout))
+        r = request("POST", f"{OLLAMA_URL}/api/chat", json=body, timeout=timeout, connect_timeout=connect_timeout)
         r.raise_for_status()
         data = r.json()
         msg = (data.get("message") or {})
@@ -246,3 +332,22 @@ ws   ::= ([ \t\n\r])*
         return s.startswith("{") and '"ok"' in s and 'true' in s
     except Exception:
         return False
+
+
+def get_ps(timeout: int = 5, connect_timeout: int = 3) -> dict:
+    """Модели, загруженные в память сервера Ollama (/api/ps)."""
+    r = request("GET", f"{OLLAMA_URL}/api/ps", timeout=timeout, connect_timeout=connect_timeout)
+    r.raise_for_status()
+    return r.json()
+
+
+def preload_model(model: Optional[str] = None, keep_alive: str = "30m", timeout: int = 120,
+                  connect_timeout: int = 3) -> bool:
+    """
+    Загружает модель в память без генерации (/api/generate без prompt) и продлевает keep_alive,
+    чтобы первый запрос аудита не ждал загрузки весов.
+    """
+    body = {"model": model or os.getenv("STAC_MODEL", "gpt-oss:latest"), "keep_alive": keep_alive, "stream": False}
+    r = request("POST", f"{OLLAMA_URL}/api/generate", json=body, timeout=timeout, connect_timeout=connect_timeout)
+    r.raise_for_status()
+    return True
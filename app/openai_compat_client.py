@@ -3,9 +3,10 @@ from __future__ import annotations
 
 import os
 import time
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
 
-import requests
+from .http_pool import post_json
+from .prompt_layout import join_messages
 
 
 OPENAI_COMPAT_BASE_URL = os.getenv("OPENAI_COMPAT_BASE_URL", "https://api.openai.com")
@@ -13,41 +14,26 @@ OPENAI_COMPAT_API_KEY = os.getenv("OPENAI_API_KEY", "")
 
 
 def _join_messages(system: str, question: str, text: str) -> list[dict]:
-    msgs: list[dict] = []
-    if system:
-        msgs.append({"role": "system", "content": system})
-    u = (question or "").strip() or "Проанализируй документ и верни строгий JSON."
-    if text:
-        u = f"{u}\n\n=== ДОКУМЕНТ ===\n{text}"
-    msgs.append({"role": "user", "content": u})
-    return msgs
+    return join_messages(system, question, text, "Проанализируй документ и верни строгий JSON.")
 
 
-def chat_openai_compat(
+def _request(
     system: str,
     question: str,
     text: str,
-    model: Optional[str] = None,
-    temperature: float = 0.0,
-    max_tokens: int = 800,
-    top_p: Optional[float] = None,
-    keep_alive: Optional[str] = None,  # не используется для openai-совместимого
-    use_json_format: bool = True,
-    timeout: int = 180,
-    connect_timeout: int = 10,
-    retries: int = 1,
-) -> str:
-    """
-    Вызов OpenAI-совместимого /v1/chat/completions (OpenAI, Azure OpenAI, OpenRouter и пр.).
-    Поддержка строгого JSON через response_format={"type":"json_object"} если use_json_format=True.
-    """
+    model: Optional[str],
+    temperature: float,
+    max_tokens: int,
+    top_p: Optional[float],
+    use_json_format: bool,
+) -> Tuple[str, Dict[str, str], Dict[str, Any]]:
     base = OPENAI_COMPAT_BASE_URL.rstrip("/")
     mdl = model or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
-    headers = {
-        "Authorization": f"Bearer {OPENAI_COMPAT_API_KEY}",
-        "Content-Type": "application/json",
-    }
+    headers = {"Content-Type": "application/json"}
+    if OPENAI_COMPAT_API_KEY:
+        # локальным OpenAI-совместимым серверам ключ не нужен: без ключа заголовок не шлём
+        headers["Authorization"] = f"Bearer {OPENAI_COMPAT_API_KEY}"
 
     body: Dict[str, Any] = {
         "model": mdl,
@@ -63,33 +49,62 @@ def chat_openai_compat(
     if use_json_format and use_json_env:
         # OpenAI/совместимые поддерживают строгий JSON через этот флаг
         body["response_format"] = {"type": "json_object"}
+    return f"{base}/v1/chat/completions", headers, body
 
-    last_err: Optional[Exception] = None
-    for _ in range(max(1, retries + 1)):
-        t0 = time.time()
-        try:
-            r = requests.post(
-                f"{base}/v1/chat/completions",
-                headers=headers,
-                json=body,
-                timeout=(connect_timeout, timeout),
-            )
-            dt = int((time.time() - t0) * 1000)
-            if r.status_code != 200:
-                raise RuntimeError(f"OpenAI-compat {r.status_code}: {r.text[:400]}")
-            data = r.json()
-            choices = data.get("choices") or []
-            if not choices:
-                raise RuntimeError(f"OpenAI-compat empty choices (dt={dt}ms)")
-            msg = (choices[0].get("message") or {})
-            content = msg.get("content") or ""
-            if not content or not content.strip():
-                raise RuntimeError(f"OpenAI-compat empty content (dt={dt}ms)")
-            return content
-        except Exception as e:
-            last_err = e
-            time.sleep(0.3)
-    raise RuntimeError(f"OpenAI-compat error: {last_err}")
+
+def chat_request(
+    system: str,
+    question: str,
+    text: str,
+    model: Optional[str] = None,
+    temperature: float = 0.0,
+    max_tokens: int = 800,
+    top_p: Optional[float] = None,
+    use_json_format: bool = True,
+    **_transport: Any,
+) -> Tuple[str, Dict[str, Any]]:
+    """URL и тело запроса chat_openai_compat (без заголовков с ключом)."""
+    url, _headers, body = _request(system, question, text, model, temperature, max_tokens, top_p, use_json_format)
+    return url, body
+
+
+def _parse(r) -> str:
+    dt = int(r.elapsed.total_seconds() * 1000)
+    if r.status_code != 200:
+        raise RuntimeError(f"OpenAI-compat {r.status_code}: {r.text[:400]}")
+    data = r.json()
+    choices = data.get("choices") or []
+    if not choices:
+        raise RuntimeError(f"OpenAI-compat empty choices (dt={dt}ms)")
+    msg = (choices[0].get("message") or {})
+    content = msg.get("content") or ""
+    if not content or not content.strip():
+        raise RuntimeError(f"OpenAI-compat empty content (dt={dt}ms)")
+    return content
+
+
+def chat_openai_compat(
+    system: str,
+    question: str,
+    text: str,
+    model: Optional[str] = None,
+    temperature: float = 0.0,
+    max_tokens: int = 800,
+    top_p: Optional[float] = None,
+    keep_alive: Optional[str] = None,  # не используется для openai-совместимого
+    use_json_format: bool = True,
+    timeout: int = 180,
+    connect_timeout: int = 10,
+    retries: int = 1,
+) -> str:
+    """
+    Вызов OpenAI-совместимого /v1/chat/completions (OpenAI, Azure OpenAI, OpenRouter и пр.).
+    Поддержка строгого JSON через response_format={"type":"json_object"} если use_json_format=True.
+    Соединения берутся из общего пула http_pool (keep-alive, в т.ч. TLS-сессии).
+    """
+    url, headers, body = _request(system, question, text, model, temperature, max_tokens, top_p, use_json_format)
+    return post_json(url, body, _parse, headers=headers, timeout=timeout, connect_timeout=connect_timeout,
+                     retries=retries, backoff_s=0.3, err_prefix="OpenAI-compat error")
 
 
 def ping_openai_compat() -> dict:
@@ -1,11 +1,26 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import io, os, sys
-from typing import Optional
+import io, os, sys, hashlib, threading
+from functools import lru_cache
+from typing import Optional, Dict, List, Tuple, Iterable, Any
 from PIL import Image, ImageOps, ImageFilter
+from .disk_cache import get_cache, cache_enabled
 
-# мягкая проверка наличия pytesseract и бинарника tesseract
-def has_tesseract() -> bool:
+# ---------- OCR-бэкенды ----------
+# tesserocr — привязки к C API tesseract: движок с загруженными traineddata живёт в процессе
+# (по одному на поток), без запуска отдельного процесса tesseract на каждую страницу.
+# pytesseract — запасной вариант: subprocess на каждый вызов.
+_BACKENDS = ("tesserocr", "pytesseract")
+_tls = threading.local()
+
+def _has_tesserocr() -> bool:
+    try:
+        import tesserocr  # noqa
+        return True
+    except Exception:
+        return False
+
+def _has_pytesseract() -> bool:
     try:
         import pytesseract as _pt  # noqa
     except Exception:
@@ -14,6 +29,30 @@ def has_tesseract() -> bool:
     from shutil import which
     return which("tesseract") is not None
 
+@lru_cache(maxsize=None)
+def _available_backends() -> Tuple[str, ...]:
+    avail = []
+    if _has_tesserocr():
+        avail.append("tesserocr")
+    if _has_pytesseract():
+        avail.append("pytesseract")
+    return tuple(avail)
+
+def ocr_backend() -> str:
+    """
+    Активный бэкенд OCR: OCR_BACKEND=auto|tesserocr|pytesseract.
+    auto (по умолчанию) — tesserocr, если установлен, иначе pytesseract. Пустая строка — OCR недоступен.
+    """
+    avail = _available_backends()
+    want = os.getenv("OCR_BACKEND", "auto").lower()
+    if want in avail:
+        return want
+    return avail[0] if avail else ""
+
+# мягкая проверка наличия OCR (tesserocr или pytesseract + бинарник tesseract)
+def has_tesseract() -> bool:
+    return bool(ocr_backend())
+
 def _pil_from_fitz_pixmap(pixmap) -> Image.Image:
     mode = "RGBA" if pixmap.alpha else "RGB"
     img = Image.frombytes(mode, [pixmap.width, pixmap.height], pixmap.samples)
@@ -29,36 +68,125 @@ def _preprocess(img: Image.Image) -> Image.Image:
     g = ImageOps.autocontrast(g, cutoff=2)
     return g
 
-def ocr_image(img: Image.Image, lang: Optional[str] = None) -> str:
+def _tesserocr_api(lang: str):
+    """Инициализированный движок tesserocr для текущего потока (traineddata грузятся один раз)."""
+    api = getattr(_tls, "api", None)
+    if api is not None and _tls.lang == lang:
+        return api
+    import tesserocr
+    if api is not None:
+        api.End()
+    kwargs = {"lang": lang, "psm": tesserocr.PSM.SINGLE_COLUMN}  # = --psm 4
+    if os.getenv("TESSDATA_PREFIX"):
+        kwargs["path"] = os.getenv("TESSDATA_PREFIX")
+    api = tesserocr.PyTessBaseAPI(**kwargs)
+    _tls.api, _tls.lang = api, lang
+    return api
+
+def _postprocess(text: str) -> str:
+    # легкая пост-обработка
+    return (text or "").replace("-\n", "").replace("\r", "")
+
+def ocr_image(img: Image.Image, lang: Optional[str] = None, backend: Optional[str] = None) -> str:
+    lang = lang or os.getenv("OCR_LANGS", "rus+kaz+eng")
+    backend = backend or ocr_backend()
+    if backend == "tesserocr":
+        try:
+            api = _tesserocr_api(lang)
+            api.SetImage(img)
+            return _postprocess(api.GetUTF8Text())
+        except Exception as e:
+            print(f"[OCR] tesserocr error: {e}; falling back to pytesseract", file=sys.stderr)
     try:
         import pytesseract as pt
     except Exception:
         return ""
-    lang = lang or os.getenv("OCR_LANGS", "rus+kaz+eng")
     try:
         text = pt.image_to_string(img, lang=lang, config="--psm 4")
     except Exception as e:
         print(f"[OCR] pytesseract error: {e}", file=sys.stderr)
         return ""
-    # легкая пост-обработка
-    text = text.replace("-\n", "").replace("\r", "")
-    return text
+    return _postprocess(text)
 
-def ocr_page_fitz(page, dpi: int = 300, lang: Optional[str] = None) -> str:
+def ocr_image_data(img: Image.Image, lang: Optional[str] = None, backend: Optional[str] = None) -> Tuple[str, float]:
     """
-    Рендерим страницу PyMuPDF → PIL → OCR. dpi=300 по умолчанию.
+    OCR с уверенностями: текст и средняя уверенность по словам (0..100; -1 — слов не найдено).
     """
+    lang = lang or os.getenv("OCR_LANGS", "rus+kaz+eng")
+    backend = backend or ocr_backend()
+    if backend == "tesserocr":
+        try:
+            api = _tesserocr_api(lang)
+            api.SetImage(img)
+            text = _postprocess(api.GetUTF8Text())
+            confs = [c for c in api.AllWordConfidences() if c >= 0]
+            return text, (sum(confs) / len(confs) if confs else -1.0)
+        except Exception as e:
+            print(f"[OCR] tesserocr error: {e}; falling back to pytesseract", file=sys.stderr)
     try:
-        import fitz  # noqa
+        import pytesseract as pt
     except Exception:
-        return ""
+        return "", -1.0
+    try:
+        data = pt.image_to_data(img, lang=lang, config="--psm 4", output_type=pt.Output.DICT)
+    except Exception as e:
+        print(f"[OCR] pytesseract error: {e}", file=sys.stderr)
+        return "", -1.0
+    # image_to_data отдаёт слова — собираем текст обратно по строкам
+    lines: Dict[Tuple[int, int, int], List[str]] = {}
+    confs: List[float] = []
+    for k, word in enumerate(data.get("text") or []):
+        word = (word or "").strip()
+        try:
+            conf = float(data["conf"][k])
+        except (TypeError, ValueError):
+            conf = -1.0
+        if not word or conf < 0:
+            continue
+        key = (data["block_num"][k], data["par_num"][k], data["line_num"][k])
+        lines.setdefault(key, []).append(word)
+        confs.append(conf)
+    text = "\n".join(" ".join(ws) for ws in lines.values())
+    return _postprocess(text), (sum(confs) / len(confs) if confs else -1.0)
+
+def _render_page(page, dpi: int) -> Tuple[str, int, int, bytes]:
+    """
+    Рендер страницы в «сырые» байты (mode, width, height, samples) — их можно передать
+    в другой процесс (объекты PyMuPDF не сериализуются).
+    """
+    import fitz
     zoom = dpi / 72.0
     mat = fitz.Matrix(zoom, zoom)
     pm = page.get_pixmap(matrix=mat, alpha=False)  # без альфы → быстрее
-    img = _pil_from_fitz_pixmap(pm)
+    return ("RGBA" if pm.alpha else "RGB", pm.width, pm.height, pm.samples)
+
+def _ocr_rendered(job: Tuple[str, int, int, bytes, Optional[str]]) -> str:
+    mode, w, h, samples, lang = job
+    img = Image.frombytes(mode, [w, h], samples)
+    if mode == "RGBA":
+        img = img.convert("RGB")
     img = _preprocess(img)
     return ocr_image(img, lang=lang)
 
+def _ocr_rendered_conf(job: Tuple[str, int, int, bytes, Optional[str]]) -> Tuple[str, float]:
+    mode, w, h, samples, lang = job
+    img = Image.frombytes(mode, [w, h], samples)
+    if mode == "RGBA":
+        img = img.convert("RGB")
+    img = _preprocess(img)
+    return ocr_image_data(img, lang=lang)
+
+def ocr_page_fitz(page, dpi: int = 300, lang: Optional[str] = None) -> str:
+    """
+    Рендерим страницу PyMuPDF → PIL → OCR. dpi=300 по умолчанию.
+    """
+    try:
+        import fitz  # noqa
+    except Exception:
+        return ""
+    mode, w, h, samples = _render_page(page, dpi)
+    return _ocr_rendered((mode, w, h, samples, lang))
+
 def maybe_ocr_page_text(page, current_text: str, min_chars: int = 60, dpi: int = 300, lang: Optional[str] = None) -> str:
     """
     Если текущий текст короткий — включаем OCR. Иначе возвращаем current_text.
@@ -69,3 +197,280 @@ def maybe_ocr_page_text(page, current_text: str, min_chars: int = 60, dpi: int =
     if not has_tesseract():
         return current_text
     return ocr_page_fitz(page, dpi=int(os.getenv("OCR_DPI", str(dpi))), lang=lang)
+
+
+# ---------- планировщик OCR ----------
+PAGE_KINDS = ("text", "scanned", "mixed", "blank")
+_LIGHT_BYTES = bytes(range(160, 256))
+
+def _image_coverage(page) -> float:
+    """Доля площади страницы, занятая растровыми картинками (0..1)."""
+    try:
+        area = abs(page.rect)
+        if not area:
+            return 0.0
+        covered = 0.0
+        for info in page.get_image_info():
+            r = page.rect & info["bbox"]
+            covered += abs(r) if not r.is_empty else 0.0
+        return min(1.0, covered / area)
+    except Exception:
+        return 0.0
+
+def _looks_blank(page) -> bool:
+    """Пустая ли страница «на глаз»: рендер миниатюры в оттенках серого и доля тёмных пикселей."""
+    try:
+        import fitz
+        dpi = int(os.getenv("OCR_BLANK_DPI", "24"))
+        pm = page.get_pixmap(matrix=fitz.Matrix(dpi / 72.0, dpi / 72.0), colorspace=fitz.csGRAY, alpha=False)
+        samples = pm.samples
+        if not samples:
+            return True
+        # число «тёмных» пикселей (<160): выкидываем светлые байты средствами C, а не циклом
+        dark = len(samples.translate(None, _LIGHT_BYTES))
+        return dark / len(samples) < float(os.getenv("OCR_BLANK_INK", "0.003"))
+    except Exception:
+        return False
+
+def classify_page(page, text: str, min_chars: int, probe_blank: bool = True) -> str:
+    """
+    Тип страницы по данным PyMuPDF (без OCR):
+      text    — текстовый слой достаточной длины, картинки не доминируют;
+      mixed   — текстовый слой есть, но страница в основном картинка (скан с «шапкой» и т.п.);
+      scanned — текста нет/мало, есть что распознавать (скан или текст кривыми);
+      blank   — ни текста, ни «чернил» на миниатюре.
+    """
+    n = len((text or "").strip())
+    coverage = _image_coverage(page)
+    scan_cov = float(os.getenv("OCR_SCAN_COVERAGE", "0.3"))
+    if n >= min_chars:
+        return "mixed" if coverage >= scan_cov else "text"
+    if probe_blank and _looks_blank(page):
+        return "blank"
+    if n and not coverage:
+        # короткий текстовый слой без картинок (номер листа и т.п.) — распознавать нечего
+        return "text"
+    if not n and not coverage and not probe_blank:
+        return "blank"
+    return "scanned"
+
+def plan_ocr(doc, texts: List[str], min_chars: Optional[int] = None, probe_blank: bool = True) -> Tuple[List[str], List[int]]:
+    """
+    Классифицирует все страницы один раз и возвращает (типы страниц, список OCR-задач).
+    В OCR уходят только scanned (и mixed при OCR_MIXED=1); text и blank до tesseract не доходят.
+    """
+    min_chars = int(os.getenv("OCR_MIN_CHARS", "60")) if min_chars is None else min_chars
+    ocr_mixed = os.getenv("OCR_MIXED", "0").lower() in ("1", "true", "yes", "on")
+    kinds: List[str] = []
+    jobs: List[int] = []
+    for i, t in enumerate(texts):
+        kind = classify_page(doc.load_page(i), t, min_chars, probe_blank=probe_blank)
+        kinds.append(kind)
+        if kind == "scanned" or (kind == "mixed" and ocr_mixed):
+            jobs.append(i)
+    return kinds, jobs
+
+
+# ---------- параллельный OCR по страницам ----------
+# один пул на процесс, им пользуются параллельные аудиты (из потоков): создание и замена — под замком
+_POOL = None
+_POOL_WORKERS = 0
+_POOL_LOCK = threading.Lock()
+
+def ocr_workers() -> int:
+    """Число процессов OCR: OCR_WORKERS (по умолчанию — половина ядер; 1 — без пула)."""
+    default = max(1, (os.cpu_count() or 2) // 2)
+    try:
+        return max(1, int(os.getenv("OCR_WORKERS", str(default))))
+    except ValueError:
+        return default
+
+def _pool_init():
+    # tesseract сам распараллеливается через OpenMP — при пуле процессов это только мешает
+    os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+def _get_pool(workers: int):
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is None or _POOL_WORKERS != workers:
+            import multiprocessing as mp
+            from concurrent.futures import ProcessPoolExecutor
+            if _POOL is not None:
+                # без cancel_futures: уже отправленные задачи других запросов доработают
+                _POOL.shutdown(wait=False)
+            # spawn, а не fork: воркер uvicorn многопоточный, fork из него небезопасен
+            ctx = mp.get_context(os.getenv("OCR_MP_START", "spawn"))
+            _POOL = ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_pool_init)
+            _POOL_WORKERS = workers
+        return _POOL
+
+def _discard_pool(pool) -> None:
+    """Убрать сломанный пул, если его ещё не заменили (задачи других запросов не отменяем)."""
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        if _POOL is not pool:
+            return
+        _POOL = None
+        _POOL_WORKERS = 0
+    pool.shutdown(wait=False)
+
+def shutdown_ocr_pool():
+    global _POOL, _POOL_WORKERS
+    with _POOL_LOCK:
+        pool, _POOL, _POOL_WORKERS = _POOL, None, 0
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+# ---------- постраничный кэш OCR ----------
+# версия предобработки/распознавания: поднимать при изменении _preprocess/ocr_image
+OCR_PIPELINE_VERSION = "2"
+
+def page_fingerprint(page) -> Optional[str]:
+    """
+    Хэш содержимого страницы: потоки содержимого + «сырые» потоки картинок + геометрия.
+    Одинаковая страница в разных загрузках (история дополняется новыми листами) даёт тот же хэш,
+    поэтому OCR повторно выполняется только для новых страниц.
+    """
+    try:
+        doc = page.parent
+        h = hashlib.sha256()
+        h.update(page.read_contents() or b"")
+        for img in page.get_images(full=True):
+            h.update(doc.xref_stream_raw(img[0]) or b"")
+        h.update(f"{tuple(page.rect)}|{page.rotation}".encode("utf-8"))
+        return h.hexdigest()
+    except Exception as e:
+        print(f"[OCR] page fingerprint failed: {e}", file=sys.stderr)
+        return None
+
+def _adaptive_settings() -> Optional[Tuple[int, float]]:
+    """(DPI пробы, порог уверенности), если включён адаптивный режим OCR_ADAPTIVE."""
+    if os.getenv("OCR_ADAPTIVE", "0").lower() not in ("1", "true", "yes", "on"):
+        return None
+    return int(os.getenv("OCR_PROBE_DPI", "150")), float(os.getenv("OCR_MIN_CONF", "70"))
+
+def _page_cache_key(fp: str, dpi: int, lang: Optional[str]) -> str:
+    lang = lang or os.getenv("OCR_LANGS", "rus+kaz+eng")
+    adaptive = _adaptive_settings()
+    mode = f"{dpi}" if adaptive is None else f"{adaptive[0]}>{dpi}@{adaptive[1]:g}"
+    return f"{fp}|{mode}|{lang}|{ocr_backend()}|{OCR_PIPELINE_VERSION}"
+
+def ocr_pages(doc, page_indices: Iterable[int], dpi: Optional[int] = None, lang: Optional[str] = None,
+              stats: Optional[Dict[str, Any]] = None,
+              meta: Optional[Dict[int, Dict[str, Any]]] = None) -> Dict[int, str]:
+    """
+    OCR набора страниц открытого документа PyMuPDF.
+    Сначала смотрим постраничный кэш (OCR_PAGE_CACHE) по хэшу содержимого страницы.
+    Промахи рендерятся в текущем процессе (по одной странице), распознавание — в ограниченном пуле
+    процессов; одновременно «в полёте» не больше 2×OCR_WORKERS картинок, чтобы не раздувать память.
+    Не больше OCR_PAGE_CAP страниц на документ (остальные остаются без OCR).
+    Результат — {номер страницы: текст}, порядок страниц сохраняется.
+    В stats (если передан) накапливаются cache_hits/cache_misses,
+    в meta — DPI и уверенность распознавания по каждой странице.
+    """
+    if not has_tesseract():
+        return {}
+    dpi = dpi or int(os.getenv("OCR_DPI", "300"))
+    cap = int(os.getenv("OCR_PAGE_CAP", "300"))
+    indices: List[int] = list(page_indices)
+    if cap > 0 and len(indices) > cap:
+        print(f"[OCR] page cap {cap} reached, skipping {len(indices) - cap} pages", file=sys.stderr)
+        indices = indices[:cap]
+    if not indices:
+        return {}
+
+    cache = get_cache("ocr_pages", "OCR_PAGE_CACHE_MAX_MB", 256) if cache_enabled("OCR_PAGE_CACHE") else None
+    keys: Dict[int, str] = {}
+    cached: Dict[int, Dict[str, Any]] = {}
+    if cache is not None:
+        for i in indices:
+            fp = page_fingerprint(doc.load_page(i))
+            if not fp:
+                continue
+            keys[i] = _page_cache_key(fp, dpi, lang)
+            entry = cache.get_json(keys[i])
+            if isinstance(entry, dict) and "text" in entry:
+                cached[i] = dict(entry, cached=True)
+    todo = [i for i in indices if i not in cached]
+    if stats is not None:
+        stats["cache_hits"] = stats.get("cache_hits", 0) + len(cached)
+        stats["cache_misses"] = stats.get("cache_misses", 0) + len(todo)
+
+    fresh = _ocr_pages_uncached(doc, todo, dpi, lang)
+    if cache is not None:
+        for i, entry in fresh.items():
+            # пустой результат не кэшируем: это может быть временная ошибка tesseract
+            if i in keys and (entry.get("text") or "").strip():
+                cache.put_json(keys[i], entry)
+    out = {**cached, **fresh}
+    if meta is not None:
+        for i in indices:
+            if i in out:
+                meta[i] = {k: v for k, v in out[i].items() if k != "text"}
+    return {i: out[i]["text"] for i in indices if i in out}
+
+def _ocr_pages_uncached(doc, indices: List[int], dpi: int, lang: Optional[str]) -> Dict[int, Dict[str, Any]]:
+    """
+    Обычный режим: одна проба на OCR_DPI.
+    Адаптивный (OCR_ADAPTIVE=1): сначала все страницы на OCR_PROBE_DPI с уверенностями
+    (image_to_data), затем на полном DPI перераспознаются только страницы со средней
+    уверенностью ниже OCR_MIN_CONF. Из двух попыток остаётся более уверенная.
+    """
+    adaptive = _adaptive_settings()
+    if adaptive is None:
+        texts = _map_rendered(doc, indices, dpi, _ocr_rendered, lang)
+        return {i: {"text": t, "dpi": dpi} for i, t in texts.items()}
+
+    probe_dpi, min_conf = adaptive
+    out: Dict[int, Dict[str, Any]] = {}
+    for i, (t, conf) in _map_rendered(doc, indices, probe_dpi, _ocr_rendered_conf, lang).items():
+        out[i] = {"text": t, "dpi": probe_dpi, "conf": round(conf, 1)}
+    escalate = [i for i in indices if i in out and out[i]["conf"] < min_conf and probe_dpi < dpi]
+    for i, (t, conf) in _map_rendered(doc, escalate, dpi, _ocr_rendered_conf, lang).items():
+        probe = out[i]
+        if conf >= probe["conf"]:
+            out[i] = {"text": t, "dpi": dpi, "conf": round(conf, 1), "probe_conf": probe["conf"]}
+        else:
+            probe["escalated_conf"] = round(conf, 1)
+    return out
+
+def _map_rendered(doc, indices: List[int], dpi: int, fn, lang: Optional[str]) -> Dict[int, Any]:
+    """Рендер страниц и применение fn (OCR) — последовательно или через пул процессов."""
+    out: Dict[int, Any] = {}
+    if not indices:
+        return out
+
+    workers = min(ocr_workers(), len(indices))
+    if workers <= 1:
+        for i in indices:
+            mode, w, h, samples = _render_page(doc.load_page(i), dpi)
+            out[i] = fn((mode, w, h, samples, lang))
+        return out
+
+    from concurrent.futures import wait, FIRST_COMPLETED
+    pool = _get_pool(ocr_workers())
+    max_inflight = 2 * workers
+    inflight = {}
+    try:
+        for i in indices:
+            while len(inflight) >= max_inflight:
+                done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for f in done:
+                    out[inflight.pop(f)] = f.result()
+            mode, w, h, samples = _render_page(doc.load_page(i), dpi)
+            inflight[pool.submit(fn, (mode, w, h, samples, lang))] = i
+            del samples
+        for f in list(inflight):
+            out[inflight.pop(f)] = f.result()
+    except Exception as e:
+        # пул сломан (например, убит воркер) — досчитаем оставшееся последовательно;
+        # следующий запрос получит новый пул
+        print(f"[OCR] process pool failed: {e}; falling back to sequential OCR", file=sys.stderr)
+        for f in inflight:
+            f.cancel()
+        _discard_pool(pool)
+        for i in indices:
+            if i not in out:
+                mode, w, h, samples = _render_page(doc.load_page(i), dpi)
+                out[i] = fn((mode, w, h, samples, lang))
+    return {i: out[i] for i in indices if i in out}
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-import io, re, os, sys
+import io, re, os, sys, hashlib
 from typing import List, Tuple, Iterable, Dict, Any, Optional
-from .pdf_ocr_fallback import has_tesseract, maybe_ocr_page_text
+from .pdf_ocr_fallback import has_tesseract, ocr_pages, ocr_backend, plan_ocr
+from .disk_cache import get_cache, cache_enabled
 
 # ключевые маркеры для стационара
 KEYWORDS = [
@@ -15,69 +16,290 @@ KEYWORDS = [
     r"выписн\w*\s+эпикриз", r"лист\s+назнач", r"диет[аы]\s*:", r"режим\s*:",
     r"сердечно[-\s]*легочн\w*\s+реанимац|СЛР"
 ]
-KW_RE = re.compile("|".join(KEYWORDS), re.I)
+KW_RE = re.compile("|".join(f"(?P<k{i}>{k})" for i, k in enumerate(KEYWORDS)), re.I)
 
 def _estimate_tokens(chars: int) -> int:
     return max(1, chars // 4)
 
-def _iter_page_texts_pymupdf(blob: bytes, use_ocr: bool) -> Iterable[Tuple[int, str]]:
+def _empty_store() -> Dict[str, Any]:
+    return {"engine": "none", "texts": [], "ocr": [], "page_kinds": [], "kw_hits": [], "kw_kinds": [], "offsets": [], "full_text": "",
+            "ocr_cache": {"cache_hits": 0, "cache_misses": 0}, "ocr_meta": []}
+
+def _finalize_store(store: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Досчитываем производные поля: попадания ключевых слов по страницам, полный текст и смещения
+    начала каждой страницы в нём (для привязки находок к номерам страниц).
+    """
+    texts = store["texts"]
+    hits: List[int] = []
+    kinds: List[List[int]] = []
+    for t in texts:
+        n = 0
+        seen = set()
+        for m in KW_RE.finditer(t):
+            n += 1
+            seen.add(int(m.lastgroup[1:]))
+        hits.append(n)
+        kinds.append(sorted(seen))
+    store["kw_hits"] = hits
+    store["kw_kinds"] = kinds
+    offsets: List[int] = []
+    pos = 0
+    for t in texts:
+        offsets.append(pos)
+        pos += len(t) + 1
+    joined = "\n".join(texts)
+    lead = len(joined) - len(joined.lstrip())
+    store["full_text"] = joined.strip()
+    store["offsets"] = [max(0, o - lead) for o in offsets]
+    return store
+
+def _is_bytes(src) -> bool:
+    return isinstance(src, (bytes, bytearray, memoryview))
+
+def _open_fitz(src):
+    """Открыть PDF в PyMuPDF: из байтов или по пути (файл не читается в память целиком)."""
     import fitz  # PyMuPDF
-    doc = fitz.open(stream=blob, filetype="pdf")
-    for i in range(doc.page_count):
-        page = doc.load_page(i)
-        txt = page.get_text("text") or ""
-        if use_ocr:
-            txt = maybe_ocr_page_text(page, txt)
-        yield i, txt
-
-def _iter_page_texts_pdfminer(blob: bytes) -> Iterable[Tuple[int, str]]:
-    from pdfminer.high_level import extract_text_to_fp
+    if _is_bytes(src):
+        return fitz.open(stream=src, filetype="pdf")
+    return fitz.open(os.fspath(src), filetype="pdf")
+
+def _open_binary(src):
+    return io.BytesIO(src) if _is_bytes(src) else open(os.fspath(src), "rb")
+
+def _release_fitz_memory():
+    # MuPDF держит кэш отрендеренных ресурсов — отпускаем его после документа
+    try:
+        import fitz
+        fitz.TOOLS.store_shrink(100)
+    except Exception:
+        pass
+
+def _store_pymupdf(src, use_ocr: bool) -> Dict[str, Any]:
+    store = _empty_store()
+    store["engine"] = "pymupdf"
+    doc = _open_fitz(src)
+    try:
+        ocr_on = use_ocr and has_tesseract()
+        for i in range(doc.page_count):
+            t = doc.load_page(i).get_text("text") or ""
+            store["texts"].append(t.strip())
+            store["ocr"].append(False)
+        # планировщик: каждая страница классифицируется один раз (text/scanned/mixed/blank),
+        # в tesseract уходит единый список задач — пачкой через пул процессов
+        store["page_kinds"], jobs = plan_ocr(doc, store["texts"], probe_blank=ocr_on)
+        meta: Dict[int, Dict[str, Any]] = {}
+        if ocr_on:
+            for i, t2 in ocr_pages(doc, jobs, stats=store["ocr_cache"], meta=meta).items():
+                if t2 and len(t2.strip()) > len(store["texts"][i]):
+                    store["texts"][i] = t2.strip()
+                    store["ocr"][i] = True
+        store["ocr_meta"] = [dict(meta[i], page=i) for i in sorted(meta)]
+        _finalize_store(store)
+    finally:
+        doc.close()
+        _release_fitz_memory()
+    used_ocr = sum(1 for x in store["ocr"] if x)
+    if used_ocr:
+        print(f"[pdf_smart_reader] OCR used on {used_ocr} pages", file=sys.stderr)
+    return store
+
+def _pdfminer_limits() -> Tuple[int, float]:
+    return (int(os.getenv("PDFMINER_MAX_PAGES", "300")),
+            float(os.getenv("PDFMINER_TIME_BUDGET_S", "60")))
+
+def _iter_page_texts_pdfminer(src, pages: Optional[Iterable[int]] = None,
+                              max_pages: Optional[int] = None,
+                              time_budget_s: Optional[float] = None) -> Iterable[Tuple[int, str]]:
+    """
+    Ленивое постраничное извлечение pdfminer.six: страница разбирается только когда её запросили.
+    pages — только эти страницы (0-based); max_pages / time_budget_s — потолок числа страниц
+    и бюджет по времени (по умолчанию PDFMINER_MAX_PAGES / PDFMINER_TIME_BUDGET_S).
+    """
+    import time
+    from pdfminer.converter import TextConverter
     from pdfminer.layout import LAParams
-    buff = io.BytesIO()
-    extract_text_to_fp(io.BytesIO(blob), buff, laparams=LAParams(), output_type="text", codec="utf-8")
-    text = buff.getvalue().decode("utf-8", errors="ignore")
-    pages = text.split("\x0c")
-    for i, p in enumerate(pages):
-        yield i, p or ""
-
-def iter_page_texts(blob: bytes, use_ocr: bool = True) -> Iterable[Tuple[int, str]]:
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+    default_pages, default_budget = _pdfminer_limits()
+    max_pages = default_pages if max_pages is None else max_pages
+    time_budget_s = default_budget if time_budget_s is None else time_budget_s
+    wanted = sorted(set(pages)) if pages is not None else None
+    if wanted is not None:
+        if not wanted:
+            return
+        # maxpages в pdfminer — номер страницы, после которой разбор прекращается
+        max_pages = wanted[-1] + 1
+    t0 = time.monotonic()
+    out = io.StringIO()
+    rsrc = PDFResourceManager()
+    # тот же конвертер, что и в pdfminer.high_level.extract_text, но вывод забираем после каждой страницы
+    device = TextConverter(rsrc, out, laparams=LAParams())
+    interpreter = PDFPageInterpreter(rsrc, device)
+    try:
+        with _open_binary(src) as fp:
+            for n, page in enumerate(PDFPage.get_pages(fp, wanted, maxpages=max_pages)):
+                interpreter.process_page(page)
+                text = out.getvalue()
+                out.seek(0)
+                out.truncate()
+                yield (wanted[n] if wanted is not None else n), text.rstrip("\x0c")
+                if time_budget_s and time.monotonic() - t0 > time_budget_s:
+                    print(f"[pdf_smart_reader] pdfminer time budget {time_budget_s:.0f}s exhausted "
+                          f"after {n + 1} pages", file=sys.stderr)
+                    return
+    finally:
+        device.close()
+
+def _pdf_page_count(src) -> int:
+    """Число страниц по дереву страниц PDF (без разбора содержимого); 0 — если не удалось."""
+    try:
+        from pdfminer.pdfpage import PDFPage
+        with _open_binary(src) as fp:
+            return sum(1 for _ in PDFPage.get_pages(fp))
+    except Exception:
+        return 0
+
+def _store_pdfminer(src) -> Dict[str, Any]:
+    store = _empty_store()
+    store["engine"] = "pdfminer"
+    for _, txt in _iter_page_texts_pdfminer(src):
+        store["texts"].append((txt or "").strip())
+        store["ocr"].append(False)
+        store["page_kinds"].append("text" if store["texts"][-1] else "blank")
+    # документ прочитан не целиком (лимит страниц или времени) — такой результат не кэшируем
+    if _pdf_page_count(src) > len(store["texts"]):
+        store["partial"] = True
+    return _finalize_store(store)
+
+def page_texts(src, pages: Iterable[int]) -> Dict[int, str]:
+    """
+    Текстовый слой только указанных страниц (без построения хранилища и без OCR):
+    PyMuPDF, а при его отказе — ленивый pdfminer по этим же страницам.
+    """
+    wanted = sorted({p for p in pages if p >= 0})
+    out: Dict[int, str] = {}
+    if not wanted:
+        return out
+    try:
+        doc = _open_fitz(src)
+        try:
+            for i in wanted:
+                if i < doc.page_count:
+                    out[i] = (doc.load_page(i).get_text("text") or "").strip()
+        finally:
+            doc.close()
+            _release_fitz_memory()
+        if any(out.values()):
+            return out
+    except Exception as e:
+        print(f"[pdf_smart_reader] PyMuPDF failed: {e}", file=sys.stderr)
+    try:
+        out = {i: (t or "").strip() for i, t in _iter_page_texts_pdfminer(src, pages=wanted)}
+    except Exception as e:
+        print(f"[pdf_smart_reader] pdfminer failed: {e}", file=sys.stderr)
+    return out
+
+def _build_page_store(src, use_ocr: bool) -> Dict[str, Any]:
     # сначала PyMuPDF (быстро), по страницам с опциональным OCR
     try:
-        yield from _iter_page_texts_pymupdf(blob, use_ocr=use_ocr and bool(int(os.getenv("USE_OCR", "1"))))
-        return
+        store = _store_pymupdf(src, use_ocr=use_ocr)
+        if len(store["full_text"]) >= 10:
+            return store
     except Exception as e:
         print(f"[pdf_smart_reader] PyMuPDF failed: {e}", file=sys.stderr)
     # fallback pdfminer (без OCR, но даёт текст если он встроен)
     try:
-        yield from _iter_page_texts_pdfminer(blob)
+        store = _store_pdfminer(src)
+        if store["full_text"]:
+            return store
     except Exception as e:
         print(f"[pdf_smart_reader] pdfminer failed: {e}", file=sys.stderr)
-        yield from []
+    return _empty_store()
 
-def find_relevant_pages(blob: bytes, neighbor: int = 1, max_pages: int = 40) -> List[int]:
-    hits: List[int] = []
-    # первичный проход (без принудительного OCR, но с локальным на «пустых» страницах)
-    for i, txt in iter_page_texts(blob, use_ocr=True):
-        if KW_RE.search(txt or ""):
-            hits.append(i)
+# версия формата хранилища: поднимать при изменении логики извлечения (инвалидирует кэш)
+PAGE_STORE_VERSION = "4"
+_CACHED_FIELDS = ("engine", "texts", "ocr", "page_kinds", "ocr_meta")
 
-    if not hits:
-        # вторичный выборочный OCR-поиск (если тессеракт есть)
-        if has_tesseract():
-            step = int(os.getenv("OCR_SAMPLING_STEP", "10"))
-            sec_max = int(os.getenv("OCR_SECOND_PASS_PAGES", "30"))
-            checked = 0
-            import fitz
-            doc = fitz.open(stream=blob, filetype="pdf")
-            for i in range(0, doc.page_count, max(1, step)):
-                if checked >= sec_max:
-                    break
-                page = doc.load_page(i)
-                # принудительный OCR этой страницы
-                txt = maybe_ocr_page_text(page, "", min_chars=999999)  # заставим OCR
-                if KW_RE.search(txt or ""):
-                    hits.append(i)
-                checked += 1
+def file_sha256(src, chunk: int = 1 << 20) -> str:
+    """SHA-256 байтов или файла (файл читается блоками)."""
+    if _is_bytes(src):
+        return hashlib.sha256(src).hexdigest()
+    h = hashlib.sha256()
+    with open(os.fspath(src), "rb") as f:
+        for block in iter(lambda: f.read(chunk), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def _doc_cache_key(sha256: str, ocr_on: bool) -> str:
+    """SHA-256 документа + настройки OCR, влияющие на результат."""
+    settings = "|".join([
+        PAGE_STORE_VERSION,
+        os.getenv("OCR_LANGS", "rus+kaz+eng"),
+        os.getenv("OCR_DPI", "300"),
+        os.getenv("OCR_MIN_CHARS", "60"),
+        os.getenv("OCR_ADAPTIVE", "0"),
+        os.getenv("OCR_PROBE_DPI", "150"),
+        os.getenv("OCR_MIN_CONF", "70"),
+        ocr_backend() if ocr_on else "no-ocr",
+    ])
+    return hashlib.sha256(f"{sha256}|{settings}".encode("utf-8")).hexdigest()
+
+def build_page_store(src, use_ocr: bool = True, sha256: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Единая стадия чтения PDF: документ открывается один раз, каждая страница извлекается
+    (и при необходимости OCR-ится) ровно один раз. Из результата строятся и фокус для LLM,
+    и полный текст для детерминированных проверок.
+    src — байты PDF или путь к файлу (предпочтительно: PyMuPDF/pdfminer читают файл по месту,
+    без копии в памяти). sha256 — заранее посчитанный хэш (например, при приёме загрузки).
+
+    Возвращает dict:
+      engine        — pymupdf | pdfminer | none
+      texts[i]      — текст страницы i (strip)
+      ocr[i]        — применялся ли OCR к странице i
+      page_kinds[i] — тип страницы по планировщику OCR: text | scanned | mixed | blank
+      kw_hits[i]    — число попаданий KW_RE на странице i
+      kw_kinds[i]   — номера различных ключевых маркеров (KEYWORDS) на странице i
+      offsets[i]    — смещение начала страницы i в full_text
+      full_text     — страницы, склеенные через перевод строки
+      cache         — hit | miss | off (дисковый кэш по содержимому документа, DOC_CACHE)
+      ocr_cache     — попадания/промахи постраничного кэша OCR (OCR_PAGE_CACHE)
+      ocr_meta      — по OCR-страницам: DPI и средняя уверенность распознавания
+      partial       — (только pdfminer) документ прочитан не целиком: лимит страниц или времени
+    """
+    use_ocr = use_ocr and bool(int(os.getenv("USE_OCR", "1")))
+    if not cache_enabled("DOC_CACHE"):
+        store = _build_page_store(src, use_ocr)
+        store["cache"] = "off"
+        return store
+
+    cache = get_cache("doc_pages", "DOC_CACHE_MAX_MB", 512)
+    key = _doc_cache_key(sha256 or file_sha256(src), use_ocr and has_tesseract())
+    cached = cache.get_json(key)
+    if cached:
+        store = _empty_store()
+        store.update({k: cached[k] for k in _CACHED_FIELDS if k in cached})
+        store = _finalize_store(store)
+        store["cache"] = "hit"
+        return store
+
+    store = _build_page_store(src, use_ocr)
+    if store["full_text"] and not store.get("partial"):
+        cache.put_json(key, {k: store[k] for k in _CACHED_FIELDS})
+    store["cache"] = "miss"
+    return store
+
+def _as_store(src) -> Dict[str, Any]:
+    # допускаем «сырые» байты/путь к PDF (обратная совместимость) и готовое хранилище страниц
+    return src if isinstance(src, dict) else build_page_store(src)
+
+def iter_page_texts(src, use_ocr: bool = True) -> Iterable[Tuple[int, str]]:
+    store = src if isinstance(src, dict) else build_page_store(src, use_ocr=use_ocr)
+    yield from enumerate(store["texts"])
+
+def find_relevant_pages(src, neighbor: int = 1, max_pages: int = 40) -> List[int]:
+    store = _as_store(src)
+    hits: List[int] = [i for i, n in enumerate(store["kw_hits"]) if n]
 
     if not hits:
         # ничего не нашли — возьмём обложку/хвост/середину
@@ -93,17 +315,100 @@ def find_relevant_pages(blob: bytes, neighbor: int = 1, max_pages: int = 40) ->
     pages = sorted(list(ext))
     return pages[:max_pages]
 
-def extract_text_from_pages(blob: bytes, pages: List[int], join_with_headers: bool = True) -> str:
+def extract_text_from_pages(src, pages: List[int], join_with_headers: bool = True) -> str:
+    if isinstance(src, dict):
+        items = enumerate(src["texts"])
+    else:
+        # «сырой» PDF: читаем только запрошенные страницы (текстовый слой), а не весь документ
+        items = sorted(page_texts(src, pages).items())
     out: List[str] = []
     pages_set = set(pages)
-    for i, txt in iter_page_texts(blob, use_ocr=True):
+    for i, txt in items:
         if i in pages_set:
             if join_with_headers:
                 out.append(f"\n===== СТРАНИЦА {i+1} =====\n")
-            out.append((txt or "").strip())
+            out.append(txt or "")
     return "\n".join(out).strip()
 
-def smart_focus_for_llm(blob: bytes,
+_PAGE_HEADER_CHARS = len("\n===== СТРАНИЦА 0000 =====\n") + 2
+
+def score_pages(src) -> List[Dict[str, Any]]:
+    """
+    Оценка страниц с ключевыми маркерами: плотность попаданий (на 1000 символов)
+    и число различных маркеров. Страницы без попаданий не оцениваются.
+    """
+    store = _as_store(src)
+    out: List[Dict[str, Any]] = []
+    for i, n in enumerate(store["kw_hits"]):
+        if not n:
+            continue
+        chars = len(store["texts"][i])
+        kinds = store["kw_kinds"][i]
+        density = n * 1000.0 / max(chars, 200)
+        out.append({"page": i, "hits": n, "keywords": len(kinds), "kinds": kinds,
+                    "density": round(density, 2), "chars": chars,
+                    "score": round(len(kinds) + density, 2)})
+    return out
+
+def select_pages_by_budget(src, max_tokens: int, neighbor: int = 1,
+                           max_pages: int = 40) -> Tuple[List[int], List[Dict[str, Any]], bool]:
+    """
+    Жадный отбор страниц в пределах бюджета токенов (вместо обрезки склейки по голове):
+      1) страницы с маркерами — по убыванию выигрыша: новые (ещё не покрытые) маркеры
+         плюс плотность попаданий; страницы, которые не влезают, пропускаются;
+      2) оставшийся бюджет — соседние страницы выбранных (в порядке их оценки).
+    Возвращает (страницы по возрастанию, оценки выбранных страниц, было ли что-то отброшено).
+    """
+    store = _as_store(src)
+    texts = store["texts"]
+    budget = max_tokens * 4  # в символах, как в _estimate_tokens
+
+    def cost(i: int) -> int:
+        return len(texts[i]) + _PAGE_HEADER_CHARS
+
+    scored = score_pages(store)
+    if not scored:
+        # маркеров нет — те же страницы-заглушки, что и в find_relevant_pages
+        pages = [i for i in find_relevant_pages(store, neighbor=neighbor, max_pages=max_pages) if i < len(texts)]
+        chosen, used = [], 0
+        for i in pages:
+            if used + cost(i) <= budget:
+                chosen.append(i)
+                used += cost(i)
+        return chosen, [], len(chosen) < len(pages)
+
+    covered: set = set()
+    chosen: List[int] = []
+    picked: List[Dict[str, Any]] = []
+    used = 0
+    pool = list(scored)
+    while pool and len(chosen) < max_pages:
+        best = max(pool, key=lambda e: (len(set(e["kinds"]) - covered) + e["density"], -e["page"]))
+        pool.remove(best)
+        if used + cost(best["page"]) > budget:
+            continue
+        chosen.append(best["page"])
+        picked.append(best)
+        covered.update(best["kinds"])
+        used += cost(best["page"])
+    dropped = bool(pool) or len(picked) < len(scored)
+
+    chosen_set = set(chosen)
+    for e in picked:
+        for j in range(e["page"] - neighbor, e["page"] + neighbor + 1):
+            if j < 0 or j >= len(texts) or j in chosen_set:
+                continue
+            if len(chosen) >= max_pages or used + cost(j) > budget:
+                dropped = True
+                continue
+            chosen.append(j)
+            chosen_set.add(j)
+            used += cost(j)
+
+    picked.sort(key=lambda e: e["page"])
+    return sorted(chosen), picked, dropped
+
+def smart_focus_for_llm(src,
                         ctx_limit: int = None,
                         safety_ratio: float = 0.7,
                         neighbor: int = 1,
@@ -112,23 +417,23 @@ def smart_focus_for_llm(blob: bytes,
     max_pages = max_pages or int(os.getenv("FOCUS_MAX_PAGES", "40"))
     neighbor = int(os.getenv("FOCUS_NEIGHBOR", str(neighbor)))
 
-    pages = find_relevant_pages(blob, neighbor=neighbor, max_pages=max_pages)
-    focused = extract_text_from_pages(blob, pages)
-    tokens = _estimate_tokens(len(focused))
-
+    store = _as_store(src)
     max_tokens = int(ctx_limit * safety_ratio)
-    if tokens > max_tokens:
-        max_chars = max_tokens * 4
-        focused = focused[:max_chars]
-        tokens = _estimate_tokens(len(focused))
+    pages, scores, reduced = select_pages_by_budget(store, max_tokens, neighbor=neighbor, max_pages=max_pages)
+    focused = extract_text_from_pages(store, pages)
+
+    if not pages and store["texts"]:
+        # даже одна лучшая страница не влезает в бюджет — берём её голову
+        best = max(score_pages(store) or [{"page": 0, "score": 0}], key=lambda e: e["score"])
+        pages = [best["page"]]
+        focused = extract_text_from_pages(store, pages)[:max_tokens * 4]
         reduced = True
-    else:
-        reduced = False
 
     return {
         "focused_text": focused,
-        "token_estimate": tokens,
+        "token_estimate": _estimate_tokens(len(focused)),
         "pages_used": pages,
+        "page_scores": [{k: e[k] for k in ("page", "hits", "keywords", "density", "score")} for e in scores],
         "was_reduced": reduced
     }
 
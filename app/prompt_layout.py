@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Раскладка промпта LLM (LLM_PROMPT_LAYOUT).
+
+  prefix (по умолчанию) — system статичен, в сообщении пользователя сначала документ, затем задание
+                          чанка. У всех чанков одного аудита общий префикс (system + документ), и кэш
+                          промпта Ollama/llama.cpp переиспользует его KV: заново считается только хвост.
+  legacy                — прежняя раскладка: задание перед документом (префикс расходится на первом
+                          же правиле, документ пересчитывается в каждом чанке).
+"""
+from __future__ import annotations
+
+import os
+from typing import Optional
+
+DOC_HEADER = "=== ДОКУМЕНТ ==="
+TASK_HEADER = "=== ЗАДАНИЕ ==="
+
+
+def prefix_first() -> bool:
+    return os.getenv("LLM_PROMPT_LAYOUT", "prefix").strip().lower() != "legacy"
+
+
+def user_content(question: str, text: str, default_question: str, prefix: Optional[bool] = None) -> str:
+    u = (question or "").strip() or default_question
+    if not text:
+        return u
+    if prefix_first() if prefix is None else prefix:
+        return f"{DOC_HEADER}\n{text}\n\n{TASK_HEADER}\n{u}"
+    return f"{u}\n\n{DOC_HEADER}\n{text}"
+
+
+def join_messages(system: str, question: str, text: str, default_question: str,
+                  prefix: Optional[bool] = None) -> list[dict]:
+    msgs: list[dict] = []
+    if system:
+        msgs.append({"role": "system", "content": system})
+    msgs.append({"role": "user", "content": user_content(question, text, default_question, prefix)})
+    return msgs
+
+
+def join_prompt(system: str, question: str, text: str, prefix: Optional[bool] = None) -> str:
+    """Один prompt для /api/generate в той же раскладке."""
+    doc = f"{DOC_HEADER}\n{text}" if text else ""
+    task = (question or "").strip()
+    if prefix_first() if prefix is None else prefix:
+        parts = [system, doc, f"{TASK_HEADER}\n{task}" if task and doc else task]
+    else:
+        parts = [system, question, doc]
+    return "\n\n".join(p.strip() for p in parts if p and p.strip())
@@ -2,68 +2,114 @@
 from __future__ import annotations
 import re
 from typing import Dict, Any, List, Optional, Tuple
-from .datetime_utils import parse_dt, fmt, within_minutes, hours_between, days_between, is_work_hours
-
-# Ключевые маркеры разделов / событий
-RX = {
-    "admission": re.compile(r"(поступил[аи]?|дата\s+поступ|время\s+поступ)", re.I),
-    "er_exam": re.compile(r"(при[её]мн[ао]м\s+отделен|осмотр\s+в\s+при[её]мном)", re.I),
-    "ward_exam": re.compile(r"(осмотр\s+врача\s+отделен|осмотр\s+отделенческ)", re.I),
-    "head_primary": re.compile(r"(первичн\w+\s+осмотр|первичный\s+осмотр).{0,80}(заведующ|зав\.)", re.I | re.S),
-    "diag_justify": re.compile(r"(обосновани[ея]\s+диагноз[ао])", re.I),
-    "preop_epicrisis": re.compile(r"(предоперационн\w*\s+эпикриз)", re.I),
-    "anes_protocol": re.compile(r"(протокол\s+анестез\w+|анестезиологическ\w+\s+пособи\w+)", re.I),
-    "op_protocol": re.compile(r"(протокол\s+операц\w+)", re.I),
-    "postop_note": re.compile(r"(послеоперационн\w*\s+дневник)", re.I),
-    "cpr": re.compile(r"(сердечно[-\s]*легочн\w*\s+реанимац|СЛР)", re.I),
-    "severe": re.compile(r"(тяжел\w*\s+состояни\w*)", re.I),
-    "consilium": re.compile(r"(консилиум)", re.I),
-    "stage_epicrisis": re.compile(r"(этапн\w*\s+эпикриз)", re.I),
-    "clinical_diag": re.compile(r"(клинич\w*\s+диагноз)", re.I),
-    "diet": re.compile(r"(диет[аы]\s*:\s*[^\n\r]+)", re.I),
-    "regimen": re.compile(r"(режим\s*:\s*[^\n\r]+)", re.I),
-    "transfusion_pre": re.compile(r"(предтрансфузионн\w*\s+эпикриз)", re.I),
+from .datetime_utils import parse_dt, fmt, within_minutes, hours_between, days_between, is_work_hours, DT_MENTION_RX
+from .doc_index import DocumentIndex, SECTION_RX
+from .diary_extractor import extract_diaries, cpr_log
+from .vitals_extractor import extract_vitals, vitals_table, value_str, LABELS
+
+# Ключевые маркеры разделов / событий — общие с остальными экстракторами (см. doc_index)
+RX = SECTION_RX
+
+# Поля внутри найденных блоков (компилируются один раз при импорте)
+FIELD_RX = {
+    "preop_indications": re.compile(r"показан\w*\s+к\s+операц", re.I),
+    "preop_complaints": re.compile(r"жалоб", re.I),
+    "preop_anamnesis_vitae": re.compile(r"анамнез\s+жизн", re.I),
+    "preop_anamnesis_morbi": re.compile(r"анамнез\s+заболеван", re.I),
+    "preop_somatic_status": re.compile(r"(соматическ\w*\s+статус|объективн\w*\s+статус)", re.I),
+    "op_ab_prophylaxis": re.compile(r"антибио\w*\s*профил|АБ-?профил", re.I),
+    "op_pre_diag": re.compile(r"диагноз\s*до\s*операц", re.I),
+    "op_post_diag": re.compile(r"диагноз\s*после\s*операц", re.I),
+    "op_name": re.compile(r"(операция|лапаротом|фиксац|резекц|остеосинтез|лапароскоп)", re.I),
+    "op_complications": re.compile(r"осложнен|интраоперационн\w*", re.I),
+    "op_biopsy": re.compile(r"биопс", re.I),
+    "op_anesthesiologist": re.compile(r"анестезиолог", re.I),
+    "op_nurse": re.compile(r"(мед\.?\s*сестра|медсестра)", re.I),
+    "op_surgeon": re.compile(r"(хирург|оперирующ)", re.I),
+    "cpr_duration": re.compile(r"(\d{1,2})\s*мин", re.I),
+    "cpr_every_5_min": re.compile(r"каждые?\s*5\s*мин", re.I),
 }
 
-DT_LINE = re.compile(r"(\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}(?:[T\s]+\d{1,2}:\d{2}(?::\d{2})?)?)")
+DT_LINE = DT_MENTION_RX
 
-def _neighbor_dt(text: str, i: int, left: int = 200, right: int = 200) -> Optional[str]:
-    s = max(0, i - left)
-    e = min(len(text), i + right)
-    m = DT_LINE.search(text[s:e])
-    return m.group(1) if m else None
+def _heading_line(idx: DocumentIndex, sec: Dict[str, Any]) -> Tuple[int, int]:
+    t = idx.text
+    s = t.rfind("\n", 0, sec["start"]) + 1
+    e = t.find("\n", sec["heading_end"])
+    return s, (len(t) if e < 0 else e)
 
-def _find_first(text: str, patt: re.Pattern) -> Tuple[Optional[int], Optional[str]]:
-    m = patt.search(text)
-    if not m:
+def _find_first(idx: DocumentIndex, kind: str,
+                dt_src: Optional[Dict[str, str]] = None) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Первый маркер kind и его дата: сначала в строке заголовка, иначе — в окне ±200 символов.
+    dt_src[<kind>_dt] — откуда взята дата: heading (строка заголовка), section (тело раздела)
+    или window (окно соседства — там могут оказаться чужие даты, например дата рождения).
+    """
+    sec = idx.first(kind)
+    if not sec:
         return None, None
-    dt_str = _neighbor_dt(text, m.start())
-    return m.start(), dt_str
-
-def _find_all_blocks(text: str, patt: re.Pattern, window: int = 800) -> List[str]:
-    out = []
-    for m in patt.finditer(text):
-        s = max(0, m.start() - 100)
-        e = min(len(text), m.end() + window)
-        out.append(text[s:e])
-    return out
+    line_s, line_e = _heading_line(idx, sec)
+    hit = idx.dates.first_at(line_s, line_e)
+    if hit is None:
+        hit = idx.dates.first_at(sec["start"] - 200, sec["start"] + 200)
+    if hit is None:
+        return sec["start"], None
+    off, dt_str = hit
+    if dt_src is not None:
+        if line_s <= off < line_e:
+            src = "heading"
+        elif sec["start"] <= off < sec["end"]:
+            src = "section"
+        else:
+            src = "window"
+        dt_src[f"{kind}_dt"] = src
+    return sec["start"], dt_str
+
+def _find_all_blocks(idx: DocumentIndex, kind: str, window: int = 800) -> List[str]:
+    return idx.blocks(kind, before=100, after=window)
+
+def _block_vitals(idx: DocumentIndex, kind: str, vitals, window: int = 800):
+    """Показатели в окне первого раздела kind (те же границы, что у _find_all_blocks)."""
+    sec = idx.first(kind)
+    if not sec:
+        return []
+    s, e = max(0, sec["start"] - 100), sec["heading_end"] + window
+    return [r for r in vitals if s <= r.offset < e]
 
 def _has_word(block: str, word_rx: re.Pattern) -> bool:
     return bool(word_rx.search(block))
 
-def extract_timeline(text: str) -> Dict[str, Any]:
+def _line_starts(idx: DocumentIndex, kind: str, max_chars: int = 160) -> List[str]:
+    """Строки документа от маркера до конца строки (по одной на строку)."""
+    out: List[str] = []
+    t = idx.text
+    line_end = -1
+    for sec in idx.all(kind):
+        if sec["start"] < line_end:
+            continue
+        e = sec["heading_end"]
+        while e < len(t) and t[e] not in "\n\r":
+            e += 1
+        line_end = e
+        out.append(t[sec["start"]:e][:max_chars])
+    return out
+
+def extract_timeline(text: str, index: Optional[DocumentIndex] = None) -> Dict[str, Any]:
     t = text or ""
+    idx = index if index is not None else DocumentIndex(t)
     # Базовые точки
-    _, dt_adm = _find_first(t, RX["admission"])
-    _, dt_er = _find_first(t, RX["er_exam"])
-    _, dt_ward = _find_first(t, RX["ward_exam"])
-    head_idx, dt_head = _find_first(t, RX["head_primary"])
-    _, dt_diag = _find_first(t, RX["diag_justify"])
-    _, dt_anes = _find_first(t, RX["anes_protocol"])
-    _, dt_op = _find_first(t, RX["op_protocol"])
+    dt_src: Dict[str, str] = {}
+    _, dt_adm = _find_first(idx, "admission", dt_src)
+    _, dt_er = _find_first(idx, "er_exam", dt_src)
+    _, dt_ward = _find_first(idx, "ward_exam", dt_src)
+    head_idx, dt_head = _find_first(idx, "head_primary", dt_src)
+    _, dt_diag = _find_first(idx, "diag_justify", dt_src)
+    _, dt_anes = _find_first(idx, "anes_protocol", dt_src)
+    _, dt_op = _find_first(idx, "op_protocol", dt_src)
+    vitals = extract_vitals(idx)
 
     # Предоперационный эпикриз — проверим наполненность
-    preop_blocks = _find_all_blocks(t, RX["preop_epicrisis"])
+    preop_blocks = _find_all_blocks(idx, "preop_epicrisis")
     preop = {
         "exists": bool(preop_blocks),
         "has_indications": False,
@@ -76,14 +122,14 @@ def extract_timeline(text: str) -> Dict[str, Any]:
     if preop_blocks:
         b = preop_blocks[0]
         preop["quote"] = b[:180].replace("\n", " ")
-        preop["has_indications"] = _has_word(b, re.compile(r"показан\w*\s+к\s+операц", re.I))
-        preop["has_complaints"] = _has_word(b, re.compile(r"жалоб", re.I))
-        preop["has_anamnesis_vitae"] = _has_word(b, re.compile(r"анамнез\s+жизн", re.I))
-        preop["has_anamnesis_morbi"] = _has_word(b, re.compile(r"анамнез\s+заболеван", re.I))
-        preop["has_somatic_status"] = _has_word(b, re.compile(r"(соматическ\w*\s+статус|объективн\w*\s+статус)", re.I))
+        preop["has_indications"] = _has_word(b, FIELD_RX["preop_indications"])
+        preop["has_complaints"] = _has_word(b, FIELD_RX["preop_complaints"])
+        preop["has_anamnesis_vitae"] = _has_word(b, FIELD_RX["preop_anamnesis_vitae"])
+        preop["has_anamnesis_morbi"] = _has_word(b, FIELD_RX["preop_anamnesis_morbi"])
+        preop["has_somatic_status"] = _has_word(b, FIELD_RX["preop_somatic_status"])
 
     # Операционный протокол — поля
-    op_blocks = _find_all_blocks(t, RX["op_protocol"])
+    op_blocks = _find_all_blocks(idx, "op_protocol")
     op_proto = {
         "exists": bool(op_blocks),
         "ab_prophylaxis": False,
@@ -101,38 +147,37 @@ def extract_timeline(text: str) -> Dict[str, Any]:
     if op_blocks:
         b = op_blocks[0]
         op_proto["quote"] = b[:180].replace("\n", " ")
-        op_proto["ab_prophylaxis"] = _has_word(b, re.compile(r"антибио\w*\s*профил|АБ-?профил", re.I))
-        op_proto["pre_diag"] = _has_word(b, re.compile(r"диагноз\s*до\s*операц", re.I))
-        op_proto["post_diag"] = _has_word(b, re.compile(r"диагноз\s*после\s*операц", re.I))
-        op_proto["op_name"] = _has_word(b, re.compile(r"(операция|лапаротом|фиксац|резекц|остеосинтез|лапароскоп)", re.I))
-        bl = re.search(r"(кровопотер[яи]\s*[:\-]\s*(\d+)\s*м?л?)", b, re.I)
+        op_proto["ab_prophylaxis"] = _has_word(b, FIELD_RX["op_ab_prophylaxis"])
+        op_proto["pre_diag"] = _has_word(b, FIELD_RX["op_pre_diag"])
+        op_proto["post_diag"] = _has_word(b, FIELD_RX["op_post_diag"])
+        op_proto["op_name"] = _has_word(b, FIELD_RX["op_name"])
+        bl = next((r for r in _block_vitals(idx, "op_protocol", vitals) if r.kind == "blood_loss"), None)
         if bl:
-            op_proto["blood_loss_ml"] = bl.group(2)
-        op_proto["complications"] = _has_word(b, re.compile(r"осложнен|интраоперационн\w*", re.I))
-        op_proto["biopsy_taken"] = _has_word(b, re.compile(r"биопс", re.I))
-        op_proto["anesthesiologist"] = _has_word(b, re.compile(r"анестезиолог", re.I))
-        op_proto["nurse"] = _has_word(b, re.compile(r"(мед\.?\s*сестра|медсестра)", re.I))
-        op_proto["surgeon"] = _has_word(b, re.compile(r"(хирург|оперирующ)", re.I))
+            op_proto["blood_loss_ml"] = f"{bl.value:g}"
+        op_proto["complications"] = _has_word(b, FIELD_RX["op_complications"])
+        op_proto["biopsy_taken"] = _has_word(b, FIELD_RX["op_biopsy"])
+        op_proto["anesthesiologist"] = _has_word(b, FIELD_RX["op_anesthesiologist"])
+        op_proto["nurse"] = _has_word(b, FIELD_RX["op_nurse"])
+        op_proto["surgeon"] = _has_word(b, FIELD_RX["op_surgeon"])
 
     # CPR
-    cpr_blocks = _find_all_blocks(t, RX["cpr"])
-    cpr = {"present": bool(cpr_blocks), "duration_min": 0, "every_5_min_checks": False, "quote": ""}
+    cpr_blocks = _find_all_blocks(idx, "cpr")
+    cpr = {"present": bool(cpr_blocks), "duration_min": 0, "every_5_min_checks": False, "quote": "",
+           "log": cpr_log("")}
     if cpr_blocks:
         b = cpr_blocks[0]
         cpr["quote"] = b[:180].replace("\n", " ")
+        cpr["log"] = cpr_log(idx.block(idx.first("cpr"), before=0, after=800))
         # duration
-        d1 = re.search(r"(\d{1,2})\s*мин", b, re.I)
+        d1 = FIELD_RX["cpr_duration"].search(b)
         if d1:
             try: cpr["duration_min"] = int(d1.group(1))
             except: pass
-        cpr["every_5_min_checks"] = bool(re.search(r"каждые?\s*5\s*мин", b, re.I))
+        cpr["every_5_min_checks"] = bool(FIELD_RX["cpr_every_5_min"].search(b))
 
     # Тяжёлое состояние и дневники
-    severe_present = bool(RX["severe"].search(t))
-    note_lines = []
-    for m in re.finditer(r"(дневник[^\n\r]*)(.*)", t, re.I):
-        line = (m.group(0) or "")[:160]
-        note_lines.append(line)
+    severe_present = idx.has("severe")
+    note_lines = _line_starts(idx, "diary")
     # конвертируем возможные часы в набор с датами
     note_times = []
     for line in note_lines:
@@ -142,7 +187,7 @@ def extract_timeline(text: str) -> Dict[str, Any]:
     note_times_sorted = sorted(note_times)
 
     # Предтрансфузионный эпикриз
-    transf_blocks = _find_all_blocks(t, RX["transfusion_pre"])
+    transf_blocks = _find_all_blocks(idx, "transfusion_pre")
     transf = {
         "exists": bool(transf_blocks),
         "cbc_dt": False,
@@ -151,30 +196,34 @@ def extract_timeline(text: str) -> Dict[str, Any]:
         "bp": False,
         "spo2": False,
         "hb": False,
+        "values": [],
+        "facts": "",
         "quote": ""
     }
     if transf_blocks:
         b = transf_blocks[0]
         transf["quote"] = b[:180].replace("\n", " ")
-        # очень простая проверка полей
-        transf["cbc_dt"] = bool(re.search(r"(оак|общий\s+анализ\s+крови).{0,40}\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}", b, re.I))
-        transf["abg_dt"] = bool(re.search(r"(кщс|абг|кислотно-щелочн).{0,40}\d{1,2}[.\-/]\d{1,2}[.\-/]\d{2,4}", b, re.I))
-        transf["pulse"] = bool(re.search(r"(пульс|чсс)\s*[:\-]?\s*\d{2,3}", b, re.I))
-        transf["bp"]    = bool(re.search(r"(АД|давлени\w*)\s*[:\-]?\s*\d{2,3}\s*/\s*\d{2,3}", b, re.I))
-        transf["spo2"]  = bool(re.search(r"(сатурац|spo2)\s*[:\-]?\s*\d{2,3}", b, re.I))
-        transf["hb"]    = bool(re.search(r"(Hb|гемоглобин)\s*[:\-]?\s*\d{2,3}", b, re.I))
+        # показатели — из таблицы vitals_extractor (значение, единица, время)
+        rows = _block_vitals(idx, "transfusion_pre", vitals)
+        last = {r.kind: r for r in rows}
+        transf["cbc_dt"] = "cbc" in last
+        transf["abg_dt"] = "abg" in last
+        for key in ("pulse", "bp", "spo2", "hb"):
+            transf[key] = key in last
+        transf["values"] = vitals_table(rows)
+        transf["facts"] = ", ".join(f"{LABELS[k]} {value_str(last[k])}" for k in ("hb", "spo2", "bp", "pulse", "cbc", "abg") if k in last)
 
     # Этапный эпикриз / клинический диагноз
-    stage_idx, stage_dt_str = _find_first(t, RX["stage_epicrisis"])
-    clin_idx, clin_dt_str = _find_first(t, RX["clinical_diag"])
+    stage_idx, stage_dt_str = _find_first(idx, "stage_epicrisis", dt_src)
+    clin_idx, clin_dt_str = _find_first(idx, "clinical_diag", dt_src)
 
     # Диета/режим (для сведения; детермин. проверка в другом месте)
     diet = None
-    m_diet = RX["diet"].search(t)
-    if m_diet: diet = m_diet.group(0)
+    sec_diet = idx.first("diet")
+    if sec_diet: diet = idx.heading(sec_diet)
     regimen = None
-    m_reg = RX["regimen"].search(t)
-    if m_reg: regimen = m_reg.group(0)
+    sec_reg = idx.first("regimen")
+    if sec_reg: regimen = idx.heading(sec_reg)
 
     out = {
         "admission_dt_str": dt_adm, "er_exam_dt_str": dt_er, "ward_exam_dt_str": dt_ward,
@@ -190,11 +239,16 @@ def extract_timeline(text: str) -> Dict[str, Any]:
         "op_protocol_dt": parse_dt(dt_op) if dt_op else None,
         "stage_epicrisis_dt": parse_dt(stage_dt_str) if stage_dt_str else None,
         "clinical_diag_dt": parse_dt(clin_dt_str) if clin_dt_str else None,
+        "dt_src": dt_src,
         "preop_epicrisis": preop,
         "op_protocol": op_proto,
+        "transfusion_pre": transf,
         "cpr": cpr,
         "severe_present": severe_present,
         "note_times": [fmt(x) for x in note_times_sorted],
+        "note_dts": note_times_sorted,
+        "diaries": extract_diaries(idx),
+        "vitals": vitals_table(vitals),
         "diet_line": diet or "",
         "regimen_line": regimen or "",
     }
@@ -103,6 +103,53 @@ def coerce_json(raw: str) -> dict:
         raise ValueError(f"json parse failed: {e}; raw_snippet={txt[:220]!r}")
 
 
+class JsonBalance:
+    """
+    Инкрементальный баланс {} верхнего уровня с учётом строк и экранирования: текст подаётся
+    кусками (feed), состояние сохраняется между ними. Считает только текст, который после пробелов
+    начинается с '{' (иначе closed так и останется False).
+    """
+    __slots__ = ("depth", "in_str", "esc", "started", "skipped", "closed")
+
+    def __init__(self) -> None:
+        self.depth = 0
+        self.in_str = False
+        self.esc = False
+        self.started = False     # встретили открывающую '{'
+        self.skipped = False     # первый непробельный символ — не '{': баланс не отслеживаем
+        self.closed = False      # объект верхнего уровня закрылся
+
+    def feed(self, chunk: str) -> int:
+        """Позиция в chunk сразу после закрывающей '}' объекта верхнего уровня, иначе -1."""
+        if self.closed or self.skipped:
+            return -1
+        for i, ch in enumerate(chunk):
+            if not self.started:
+                if ch.isspace():
+                    continue
+                if ch != "{":
+                    self.skipped = True
+                    return -1
+                self.started = True
+            if self.in_str:
+                if self.esc:
+                    self.esc = False
+                elif ch == "\\":
+                    self.esc = True
+                elif ch == "\"":
+                    self.in_str = False
+            elif ch == "\"":
+                self.in_str = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}":
+                self.depth -= 1
+                if self.depth == 0:
+                    self.closed = True
+                    return i + 1
+        return -1
+
+
 def is_likely_truncated_json(txt: str) -> bool:
     """
     Грубая эвристика: начинаем с '{', но суммарно скобки не сошлись.
@@ -111,26 +158,5 @@ def is_likely_truncated_json(txt: str) -> bool:
     s = (txt or "").strip()
     if not s.startswith("{"):
         return False
-    depth = 0
-    in_str = False
-    esc = False
-    for ch in s:
-        if in_str:
-            if esc:
-                esc = False
-            elif ch == "\\":
-                esc = True
-            elif ch == "\"":
-                in_str = False
-        else:
-            if ch == "\"":
-                in_str = True
-            elif ch == "{":
-                depth += 1
-            elif ch == "}":
-                depth -= 1
-                if depth == 0:
-                    # нашли закрывающую скобку всего объекта — не обрезан
-                    return False
-    # дошли до конца без depth==0 -> похоже, оборванный
-    return True
\ No newline at end of file
+    # дошли до конца, не закрыв объект верхнего уровня -> похоже, оборванный
+    return JsonBalance().feed(s) < 0
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+from bisect import bisect_right
+from collections import Counter
+from datetime import datetime
+from typing import Dict, Any, List, NamedTuple, Optional
+
+from .datetime_utils import parse_dt, fmt
+from .doc_index import DocumentIndex
+from .lexer import MARKERS
+
+# Виды показателей (маркеры — в lexer.MARKERS, токены — в DocumentIndex)
+VITAL_KINDS = ("hb", "spo2", "bp", "pulse", "blood_loss", "cbc", "abg")
+LABELS = {"hb": "Hb", "spo2": "SpO₂", "bp": "АД", "pulse": "Пульс", "blood_loss": "Кровопотеря",
+          "cbc": "ОАК", "abg": "КЩС"}
+
+# Допустимые значения (после приведения единиц): всё вне диапазона — не показатель, а шум
+RANGES = {"hb": (30, 250), "spo2": (50, 100), "bp": (50, 300), "bp2": (20, 200), "pulse": (20, 250),
+          "blood_loss": (0, 20000)}
+UNITS = {"hb": "г/л", "spo2": "%", "bp": "мм рт. ст.", "pulse": "уд/мин", "blood_loss": "мл"}
+
+# Время показателя без своей даты — последнее упоминание даты не дальше стольких символов до него
+DT_WINDOW = 600
+
+
+class Vital(NamedTuple):
+    kind: str                  # вид (VITAL_KINDS)
+    value: Optional[float]     # значение в единицах UNITS (для АД — систолическое; для ОАК/КЩС — нет)
+    value2: Optional[float]    # диастолическое АД
+    unit: str
+    ts: Optional[datetime]     # дата анализа (ОАК/КЩС) или время записи, к которой относится показатель
+    offset: int                # смещение в тексте
+    page: Optional[int]
+
+
+def _num(s: str) -> float:
+    return float(s.replace(",", "."))
+
+
+def _in_range(kind: str, v: float) -> bool:
+    lo, hi = RANGES[kind]
+    return lo <= v <= hi
+
+
+def _record_dt(idx: DocumentIndex, offset: int) -> Optional[datetime]:
+    starts = idx.dates.starts
+    j = bisect_right(starts, offset) - 1
+    while j >= 0 and offset - starts[j] <= DT_WINDOW:
+        dt = parse_dt(idx.dates.strs[j])
+        if dt:
+            return dt
+        j -= 1
+    return None
+
+
+def _parse(idx: DocumentIndex, sec: Dict[str, Any]) -> Optional[Vital]:
+    kind = sec["kind"]
+    m = MARKERS[kind][0].match(idx.text, sec["start"])
+    if not m:
+        return None
+    v = v2 = None
+    unit = UNITS.get(kind, "")
+    if kind in ("cbc", "abg"):
+        ts = parse_dt(m.group(1))
+        return Vital(kind, None, None, "", ts, sec["start"], sec["page"]) if ts else None
+    v = _num(m.group(1))
+    u = (m.group(2) or "").lower() if kind != "bp" else ""
+    if kind == "hb" and (u in ("г/дл", "g/dl") or (not u and v < 25)):
+        v *= 10                      # г/дл → г/л
+    elif kind == "blood_loss" and u == "л":
+        v *= 1000
+    elif kind == "bp":
+        v2 = _num(m.group(2))
+        if not (_in_range("bp2", v2) and v > v2):
+            return None
+    if not _in_range(kind, v):
+        return None
+    return Vital(kind, v, v2, unit, _record_dt(idx, sec["start"]), sec["start"], sec["page"])
+
+
+def extract_vitals(idx: DocumentIndex, start: int = 0, end: Optional[int] = None) -> List[Vital]:
+    """Показатели в [start, end) по возрастанию смещения (из токенов индекса, без повторного сканирования)."""
+    end = len(idx.text) if end is None else end
+    out: List[Vital] = []
+    for kind in VITAL_KINDS:
+        for sec in idx.all(kind):
+            if start <= sec["start"] < end:
+                row = _parse(idx, sec)
+                if row:
+                    out.append(row)
+    out.sort(key=lambda r: r.offset)
+    return out
+
+
+def value_str(r: Vital) -> str:
+    if r.kind in ("cbc", "abg"):
+        return fmt(r.ts)
+    if r.kind == "bp":
+        return f"{r.value:g}/{r.value2:g} {r.unit}"
+    return f"{r.value:g} {r.unit}".replace(" %", "%")
+
+
+def vitals_table(rows: List[Vital]) -> List[Dict[str, Any]]:
+    """Таблица для JSON: kind, value, value2, unit, ts (строка), offset, page."""
+    return [dict(r._asdict(), ts=fmt(r.ts)) for r in rows]
+
+
+def vitals_summary(rows: List[Vital]) -> Dict[str, int]:
+    return dict(Counter(r.kind for r in rows))
+
+
+def fact_sheet(rows: List[Vital], per_kind: int = 3, max_chars: int = 600) -> str:
+    """
+    Компактная сводка для LLM: по каждому виду — последние per_kind значений со временем,
+    например «Hb: 95 г/л (2024-02-03 10:00); 102 г/л». Пустая строка, если показателей нет.
+    """
+    by_kind: Dict[str, List[Vital]] = {}
+    for r in rows:
+        by_kind.setdefault(r.kind, []).append(r)
+    lines = []
+    for kind in VITAL_KINDS:
+        vals = by_kind.get(kind)
+        if not vals:
+            continue
+        items = []
+        for r in vals[-per_kind:]:
+            s = value_str(r)
+            if r.ts and r.kind not in ("cbc", "abg"):
+                s += f" ({fmt(r.ts)})"
+            items.append(s)
+        lines.append(f"{LABELS[kind]}: " + "; ".join(items))
+    return "\n".join(lines)[:max_chars]
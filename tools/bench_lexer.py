@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк детерминированного извлечения: однопроходный лексер (lexer.Lexer.scan) против
+отдельного finditer на каждый шаблон маркера (как экстракторы сканировали текст раньше).
+Большой текст получается повторением текста PDF --scale раз.
+
+  python3 tools/bench_lexer.py test.pdf --scale 1 5 20 --runs 5
+"""
+from __future__ import annotations
+import argparse, os, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+os.environ.setdefault("DOC_CACHE", "0")
+
+from app.doc_index import DocumentIndex  # noqa: E402
+from app.info_extractor_gen import extract_general  # noqa: E402
+from app.lexer import DOC_LEXER  # noqa: E402
+from app.pdf_text import extract_text_from_pdf  # noqa: E402
+from app.timeline_extractor import extract_timeline  # noqa: E402
+from app.validator_gen_det import validate_gen_det  # noqa: E402
+from app.validator_stac_det import validate_stac_det  # noqa: E402
+
+
+def _extract(text: str, tokens) -> dict:
+    idx = DocumentIndex(text, tokens=tokens)
+    tl = extract_timeline(text, index=idx)
+    gen = extract_general(text, index=idx)
+    return {"tl": tl, "stac": validate_stac_det(tl, full_text=text, index=idx), "gen": validate_gen_det(gen)}
+
+
+def _best_ms(fn, runs: int) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pdf", nargs="?", default="test.pdf")
+    ap.add_argument("--scale", type=int, nargs="+", default=[1, 5, 20])
+    ap.add_argument("--runs", type=int, default=5)
+    args = ap.parse_args()
+
+    base = extract_text_from_pdf(args.pdf)
+    if not base:
+        print(f"{args.pdf}: текст не извлечён")
+        return 1
+
+    print(f"{'×':>4} {'символов':>10} {'токенов':>8} {'finditer, мс':>13} {'лексер, мс':>11} "
+          f"{'извлеч. до, мс':>15} {'извлеч. после, мс':>18}")
+    for k in args.scale:
+        text = "\n".join([base] * k)
+        sep = DOC_LEXER.scan_separate(text)
+        one = DOC_LEXER.scan(text)
+        if sorted(sep) != sorted(one):
+            print(f"×{k}: поток токенов лексера расходится с finditer!")
+            return 2
+        if _extract(text, sep) != _extract(text, one):
+            print(f"×{k}: результаты извлечения расходятся!")
+            return 2
+        t_sep = _best_ms(lambda: DOC_LEXER.scan_separate(text), args.runs)
+        t_one = _best_ms(lambda: DOC_LEXER.scan(text), args.runs)
+        e_sep = _best_ms(lambda: _extract(text, DOC_LEXER.scan_separate(text)), args.runs)
+        e_one = _best_ms(lambda: _extract(text, None), args.runs)
+        print(f"{k:>4} {len(text):>10} {len(one):>8} {t_sep:>13.1f} {t_one:>11.1f} {e_sep:>15.1f} {e_one:>18.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
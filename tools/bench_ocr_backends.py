@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Микро-бенчмарк OCR-бэкендов: tesserocr (движок в процессе) vs pytesseract (subprocess на страницу).
+Страницы рендерятся один раз, затем каждый доступный бэкенд распознаёт их --repeat раз.
+
+  python3 tools/bench_ocr_backends.py test.pdf --pages 6 --dpi 300 --repeat 3
+"""
+from __future__ import annotations
+import argparse, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.pdf_ocr_fallback import (  # noqa: E402
+    _available_backends, _preprocess, _render_page, ocr_image,
+)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pdf", nargs="?", default="test.pdf")
+    ap.add_argument("--pages", type=int, default=6)
+    ap.add_argument("--dpi", type=int, default=300)
+    ap.add_argument("--lang", default=None)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    backends = _available_backends()
+    if not backends:
+        print("Нет доступных OCR-бэкендов (tesserocr / pytesseract + tesseract)")
+        return 1
+
+    import fitz
+    from PIL import Image
+    doc = fitz.open(args.pdf)
+    n = min(args.pages, doc.page_count)
+    images = []
+    for i in range(n):
+        mode, w, h, samples = _render_page(doc.load_page(i), args.dpi)
+        img = Image.frombytes(mode, [w, h], samples)
+        images.append(_preprocess(img.convert("RGB") if mode == "RGBA" else img))
+    print(f"{args.pdf}: {n} стр., {args.dpi} DPI, повторов: {args.repeat}")
+
+    results = {}
+    for backend in backends:
+        # холодный старт (для tesserocr — инициализация движка) считаем отдельно
+        t0 = time.perf_counter()
+        first = ocr_image(images[0], lang=args.lang, backend=backend)
+        cold_ms = (time.perf_counter() - t0) * 1000
+        t0 = time.perf_counter()
+        chars = 0
+        for _ in range(args.repeat):
+            for img in images:
+                chars += len(ocr_image(img, lang=args.lang, backend=backend))
+        per_page = (time.perf_counter() - t0) * 1000 / (args.repeat * n)
+        results[backend] = per_page
+        print(f"{backend:12s} первая стр.: {cold_ms:8.1f} мс   в среднем: {per_page:8.1f} мс/стр.   "
+              f"символов/прогон: {chars // args.repeat}   (проба: {len(first)} симв.)")
+
+    if len(results) == 2:
+        print(f"ускорение tesserocr: x{results['pytesseract'] / max(results['tesserocr'], 1e-6):.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк кэша префикса промпта в Ollama: раскладка legacy (задание перед документом) против prefix
+(system + документ — общий префикс, задание чанка в конце). Для каждой раскладки все чанки правил
+аудита отправляются по очереди с num_predict=1; из ответа берутся prompt_eval_count (сколько токенов
+промпта сервер посчитал заново) и prompt_eval_duration (время prefill). Перед каждой раскладкой кэш
+слота сбрасывается посторонним промптом. Первый чанк кэша не имеет ни в одной раскладке, поэтому
+экономия считается по остальным.
+
+  OLLAMA_URL=http://gpu:11434 python3 tools/bench_prefix_cache.py test.pdf --chunk-size 6 --runs 2
+"""
+from __future__ import annotations
+import argparse, os, sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from app.audit_engine_stac import _chunk_prompt, _chunks  # noqa: E402
+from app.focus_text import focus_text  # noqa: E402
+from app.http_pool import request  # noqa: E402
+from app.json_schema import RULE_ID_ENUM  # noqa: E402
+from app.ollama_client import OLLAMA_URL  # noqa: E402
+from app.pdf_text import extract_text_from_pdf  # noqa: E402
+from app.prompt_layout import join_messages  # noqa: E402
+
+# как в audit_stac
+LIMIT_ITEMS = int(os.getenv("LLM_LIMIT_ITEMS", "10"))
+EV_MAX = int(os.getenv("EVIDENCE_MAX_CHARS", "90"))
+
+
+def _prefill(model: str, messages: list, num_ctx: int) -> dict:
+    body = {"model": model, "messages": messages, "stream": False, "keep_alive": "10m",
+            "options": {"temperature": 0.0, "num_predict": 1, "num_ctx": num_ctx}}
+    r = request("POST", f"{OLLAMA_URL}/api/chat", json=body, timeout=600)
+    r.raise_for_status()
+    p = r.json()
+    return {"tokens": int(p.get("prompt_eval_count") or 0), "ms": (p.get("prompt_eval_duration") or 0) / 1e6}
+
+
+def _run(model: str, doc: str, plan: list, prefix: bool, num_ctx: int) -> list:
+    os.environ["LLM_PROMPT_LAYOUT"] = "prefix" if prefix else "legacy"
+    # сброс кэша слота: промпт без общего префикса с аудитом
+    _prefill(model, [{"role": "user", "content": "сброс кэша " * 50}], num_ctx)
+    rows = []
+    for rules in plan:
+        system, q = _chunk_prompt(rules, LIMIT_ITEMS, EV_MAX)
+        rows.append(_prefill(model, join_messages(system, q, doc, "", prefix=prefix), num_ctx))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("doc", nargs="?", default="test.pdf", help="PDF или .txt")
+    ap.add_argument("--model", default=os.getenv("STAC_MODEL", "gpt-oss:latest"))
+    ap.add_argument("--chunk-size", type=int, default=int(os.getenv("LLM_RULES_PER_CALL", "6")))
+    ap.add_argument("--num-ctx", type=int, default=int(os.getenv("OLLAMA_NUM_CTX", "3072")))
+    ap.add_argument("--runs", type=int, default=2)
+    args = ap.parse_args()
+
+    path = Path(args.doc)
+    text = path.read_text(encoding="utf-8") if path.suffix == ".txt" else extract_text_from_pdf(str(path))
+    if not text:
+        print(f"{args.doc}: текст не извлечён")
+        return 1
+    doc = focus_text(text)
+    plan = _chunks(RULE_ID_ENUM, args.chunk_size)
+    if len(plan) < 2:
+        print("нужно хотя бы 2 чанка (уменьшите --chunk-size)")
+        return 1
+
+    _prefill(args.model, [{"role": "user", "content": "ping"}], args.num_ctx)   # загрузка модели
+    res = {"legacy": [], "prefix": []}
+    for _ in range(args.runs):
+        for name in res:
+            res[name].append(_run(args.model, doc, plan, name == "prefix", args.num_ctx))
+
+    print(f"модель {args.model}, документ {len(doc)} символов, чанков {len(plan)}, прогонов {args.runs}")
+    print(f"{'раскладка':>10} {'1-й чанк, ток':>14} {'1-й, мс':>8} {'далее, ток/чанк':>16} {'далее, мс/чанк':>15}")
+    avg = {}
+    for name, runs in res.items():
+        first = [r[0] for r in runs]
+        rest = [c for r in runs for c in r[1:]]
+        avg[name] = (sum(c["tokens"] for c in rest) / len(rest), sum(c["ms"] for c in rest) / len(rest))
+        print(f"{name:>10} {sum(c['tokens'] for c in first) / len(first):>14.0f} "
+              f"{sum(c['ms'] for c in first) / len(first):>8.0f} {avg[name][0]:>16.0f} {avg[name][1]:>15.0f}")
+    saved_tok = avg["legacy"][0] - avg["prefix"][0]
+    saved_ms = avg["legacy"][1] - avg["prefix"][1]
+    print(f"экономия prefill на чанк (кроме первого): {saved_tok:.0f} токенов, {saved_ms:.0f} мс; "
+          f"на аудит: {saved_ms * (len(plan) - 1):.0f} мс")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,13 +10,15 @@
     const format = $('#format').value;
   const useFull = $('#useFull').checked;
   const model = ($('#model').value || '').trim();
+    // поэтапный режим (SSE) — только для JSON-ответа: text/markdown отдаётся одним куском
+    const stream = $('#stream').checked && (!human || format === 'json');
 
     const fd = new FormData();
     fd.append('file', f);
 
-    const url = new URL('/audit/pdf_stac', apiBase);
+    const url = new URL(stream ? '/audit/pdf_stac/stream' : '/audit/pdf_stac', apiBase);
     if (human) url.searchParams.set('human', 'true');
-    if (human) url.searchParams.set('format', format);
+    if (human && !stream) url.searchParams.set('format', format);
   if (useFull) url.searchParams.set('use_full', 'true');
   if (model) url.searchParams.set('model', model);
 
@@ -28,6 +30,7 @@
     $('#diagBox').hidden = true; $('#diag').innerHTML=''; $('#assessed').innerHTML='';
 
     try {
+      if (stream) { await auditStream(url, fd); return; }
       const resp = await fetch(url, { method: 'POST', body: fd });
       const ct = resp.headers.get('content-type') || '';
       const text = await resp.text();
@@ -50,6 +53,55 @@
     }
   }
 
+  // SSE поверх fetch (EventSource не умеет POST): события разбираются по мере прихода
+  async function auditStream(url, fd) {
+    const resp = await fetch(url, { method: 'POST', body: fd });
+    if (!resp.ok) throw new Error((await resp.text()) || resp.statusText);
+    const log = [];
+    const say = (line) => { log.push(line); $('#out').textContent = log.join('\n'); };
+    const handlers = {
+      pages: (d) => say(`Страниц: ${d.pages_total}` + (d.ocr_pages ? `, OCR: ${d.ocr_pages}` : '') + ` (${d.engine})`),
+      deterministic: (d) => {
+        say(`Детерминированные проверки: соответствует ${d.passes.length}, нарушений ${d.violations.length}`);
+        d.violations.forEach(appendViolation);
+      },
+      llm_start: (d) => say(`LLM: чанков ${d.chunks}, параллельно ${d.parallel}, режим ${d.mode}` +
+        (d.skipped_rules.length ? `, решено без LLM: ${d.skipped_rules.length}` : '')),
+      llm_chunk: (d) => {
+        say(`LLM чанк ${d.chunk + 1}/${d.of}: оценено ${d.assessed.length}, нарушений ${d.violations.length}, ` +
+          `${d.ms} мс` + (d.cache === 'hit' ? ' (кэш)' : '') + (d.error ? ` — ошибка: ${d.error}` : ''));
+        d.violations.forEach(appendViolation);
+      },
+      result: (d) => {
+        $('#out').textContent = log.join('\n') + '\n\n' + JSON.stringify(d, null, 2);
+        renderViolations(d);
+        renderDiagnostics(d);
+        enableDownloads(d);
+      },
+      error: (d) => say('Ошибка: ' + d.error),
+    };
+
+    const reader = resp.body.getReader();
+    const dec = new TextDecoder();
+    let buf = '';
+    for (;;) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += dec.decode(value, { stream: true });
+      let i;
+      while ((i = buf.indexOf('\n\n')) >= 0) {
+        const frame = buf.slice(0, i);
+        buf = buf.slice(i + 2);
+        let kind = 'message', data = '';
+        for (const line of frame.split('\n')) {
+          if (line.startsWith('event: ')) kind = line.slice(7);
+          else if (line.startsWith('data: ')) data += line.slice(6);
+        }
+        if (handlers[kind]) handlers[kind](JSON.parse(data));
+      }
+    }
+  }
+
   function prettyJson(t) {
     try { return JSON.stringify(JSON.parse(t), null, 2); } catch { return t; }
   }
@@ -59,21 +111,22 @@
     const viols = obj.violations || obj.violations_compact || [];
     if (!Array.isArray(viols) || viols.length === 0) return;
 
+    $('#violList').innerHTML = '';
+    viols.forEach(appendViolation);
+  }
+
+  function appendViolation(v) {
     $('#violBox').hidden = false;
-    const ul = $('#violList');
-    ul.innerHTML = '';
-    for (const v of viols) {
-      const li = document.createElement('li');
-      const id = v.rule_id || v.id || '';
-      const title = v.title || '';
-      const sev = (v.severity || '').toString().toLowerCase();
-      const ev = v.evidence || '';
-      li.className = sev || '';
-      li.innerHTML = `<div class="rid">${id} — ${title}</div>` +
-        `<div class="sev">${sev || ''}</div>` +
-        (ev ? `<div class="ev">${escapeHtml(ev)}</div>` : '');
-      ul.appendChild(li);
-    }
+    const li = document.createElement('li');
+    const id = v.rule_id || v.id || '';
+    const title = v.title || '';
+    const sev = (v.severity || '').toString().toLowerCase();
+    const ev = v.evidence || '';
+    li.className = sev || '';
+    li.innerHTML = `<div class="rid">${id} — ${title}</div>` +
+      `<div class="sev">${sev || ''}</div>` +
+      (ev ? `<div class="ev">${escapeHtml(ev)}</div>` : '');
+    $('#violList').appendChild(li);
   }
 
   function renderDiagnostics(obj) {